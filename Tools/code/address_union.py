@@ -0,0 +1,200 @@
+import os
+from loguru import logger
+from runtime import lazy_import
+from run_ledger import write_csv_atomic
+import backends
+import degauss
+import ingest
+
+pd = lazy_import('pandas')
+
+# -------------------------------------------------------------------
+# Run-wide address union.
+# The same address often appears in several input files of one run (e.g. the
+# demo Fresno addresses in LOCATION.csv and two address files). Before any file
+# is processed, the addresses of every file that needs geocoding are built
+# exactly as generate_coordinates_degauss builds them, normalized to a key and
+# unioned; the distinct set is geocoded in one batched call. Each file's rows
+# then take their geocoder columns from that result by key instead of sending
+# the file to the geocoder again.
+# -------------------------------------------------------------------
+
+# Files that never go through the geocoder
+SKIPPED_TABLES = ['visit_occurrence', 'person', 'location_history']
+
+# Key column shared by the union input, its geocoder output and the lookup
+KEY_COLUMN = '_address_key'
+
+def build_address(df, columns):
+    """
+    Geocoder input text for every row of `df`, as sent to the geocoder backends.
+
+    Parameters:
+    df (pandas.DataFrame): Rows with the address columns
+    columns (list of str): ['address'] or ['street', 'city', 'state', 'zip']
+
+    Returns:
+    pandas.Series: Title-cased address with punctuation replaced by spaces
+    """
+    parts = df[columns].fillna('').astype(str)
+    for col in columns:
+        # If this is the Zip column, ensure no '.0' remains
+        if col.lower() == 'zip':
+            parts[col] = parts[col].apply(lambda x: x.split('.')[0] if '.' in x else x)
+    if len(columns) == 1:
+        address = parts[columns[0]].str.title()
+    else:
+        address = parts.apply(lambda row: ' '.join(row[columns]).lower(), axis=1).str.title()
+    return address.replace(r'[^a-zA-Z0-9 ]', ' ', regex=True)
+
+def address_key(addresses):
+    """Normalized key of geocoder input text: lower case, single spaces, no surrounding whitespace."""
+    return addresses.fillna('').astype(str).str.lower().str.split().str.join(' ')
+
+def location_address(df):
+    """Single address column of a LOCATION table (address_1, address_2, city, state, zip)."""
+    return (df['address_1'].fillna('') + ' ' + df['address_2'].fillna('') + ' ' + df['city'].fillna('') + ' ' + df['state'].fillna('') + ' ' + df['zip'].fillna('')).str.strip()
+
+def needs_geocoding(df):
+    """True if a LOCATION table has no usable latitude/longitude columns."""
+    return 'latitude' not in df.columns or df['latitude'].isnull().all() or 'longitude' not in df.columns or df['longitude'].isnull().all()
+
+def _file_addresses(file_path):
+    """Geocoder input text of one input file, or None if the file is not geocoded."""
+    stem = ingest.input_stem(os.path.basename(file_path)).lower()
+    if stem in SKIPPED_TABLES:
+        return None
+    schema = ingest.TableSchema(file_path)
+    if stem == 'location':
+        df = ingest.read_table(file_path, ['address_1', 'address_2', 'city', 'state', 'zip', 'latitude', 'longitude'], text_columns=['address_1', 'address_2', 'city', 'state', 'zip'], schema=schema)
+        if not needs_geocoding(df):
+            return None
+        return build_address(pd.DataFrame({'address': location_address(df)}), ['address'])
+    option = schema.location_option()
+    if option not in [1, 2]:
+        return None
+    columns = ['street', 'city', 'state', 'zip'] if option == 1 else ['address']
+    df = ingest.read_table(file_path, columns, text_columns=columns, schema=schema)
+    return build_address(df, columns)
+
+def geocode_union(input_folder, files, threshold, work_dir, is_done=None):
+    """
+    Geocode the distinct addresses of all `files` in one batched geocoder call.
+
+    Parameters:
+    input_folder (str): Folder containing the input files
+    files (list of str): Input file names
+    threshold (float): Threshold for the geocoder's score (accuracy)
+    work_dir (str): Folder for the union input and geocoder output
+    is_done (callable, optional): is_done(file) -> True for files whose results already exist
+
+    Returns:
+    pandas.DataFrame or None: Lookup of geocoder columns by KEY_COLUMN (None if no file needs geocoding)
+    """
+    frames = []
+    for file in files:
+        if is_done is not None and is_done(file):
+            continue
+        try:
+            addresses = _file_addresses(os.path.join(input_folder, file))
+        except Exception as e:
+            # The file is geocoded on its own later (and reports its own error)
+            logger.warning(f"Could not read addresses from {file} for the run-wide union: {e}")
+            continue
+        if addresses is not None and len(addresses):
+            frames.append(addresses)
+    if not frames:
+        return None
+
+    addresses = pd.concat(frames, ignore_index=True)
+    union = pd.DataFrame({'address': addresses, KEY_COLUMN: address_key(addresses)}).drop_duplicates(KEY_COLUMN, ignore_index=True)
+    logger.info(f"Address union: {len(addresses)} addresses in {len(frames)} files, {len(union)} distinct")
+
+    output_file = os.path.join(work_dir, f"addresses_geocoder_3.3.0_score_threshold_{threshold}.csv")
+    if os.path.exists(output_file):
+        logger.info(f"Union geocoder output already exists, reusing it: {output_file}")
+    else:
+        os.makedirs(work_dir, exist_ok=True)
+        backends.geocoder().geocode(union, threshold, work_dir, output_file)
+
+    return _read_lookup(output_file, work_dir)
+
+def _read_lookup(output_file, work_dir):
+    frames = [pd.read_csv(output_file, dtype={KEY_COLUMN: str})]
+    # Quarantined addresses stay in the lookup with empty results, so files do not send them again
+    quarantine_file = os.path.join(work_dir, f"geocoder{degauss.QUARANTINE_SUFFIX}")
+    if os.path.exists(quarantine_file):
+        quarantined = pd.read_csv(quarantine_file, dtype={KEY_COLUMN: str, 'address': str})
+        if KEY_COLUMN not in quarantined.columns:
+            quarantined[KEY_COLUMN] = address_key(quarantined['address'])
+        frames.append(quarantined[[KEY_COLUMN]])
+    geocoded = pd.concat(frames, ignore_index=True)
+    geocoded[KEY_COLUMN] = geocoded[KEY_COLUMN].fillna('')
+    return geocoded.drop(columns=['address', 'error'], errors='ignore').drop_duplicates(KEY_COLUMN)
+
+class AddressCache:
+    """
+    Geocoder results kept in memory across files (used by --watch).
+
+    Only addresses not seen before are sent to the geocoder; the oldest entries are
+    dropped once the cache holds more than `max_rows` addresses.
+    """
+
+    def __init__(self, threshold, max_rows=1000000):
+        self.threshold = threshold
+        self.max_rows = max_rows
+        self.lookup = None
+
+    def update(self, file_path, work_dir):
+        """
+        Geocode the new addresses of one input file, with geocoder files (and quarantine) in `work_dir`.
+
+        Returns:
+        pandas.DataFrame or None: The lookup for geocode_with_lookup() (None if the file is not geocoded)
+        """
+        addresses = _file_addresses(file_path)
+        if addresses is None or not len(addresses):
+            return None
+        new = pd.DataFrame({'address': addresses, KEY_COLUMN: address_key(addresses)}).drop_duplicates(KEY_COLUMN, ignore_index=True)
+        if self.lookup is not None:
+            new = new[~new[KEY_COLUMN].isin(self.lookup[KEY_COLUMN])]
+        logger.info(f"Address cache: {len(addresses)} addresses, {len(new)} not cached")
+        if len(new):
+            output_file = os.path.join(work_dir, f"addresses_geocoder_3.3.0_score_threshold_{self.threshold}.csv")
+            os.makedirs(work_dir, exist_ok=True)
+            backends.geocoder().geocode(new, self.threshold, work_dir, output_file)
+            found = _read_lookup(output_file, work_dir)
+            lookup = found if self.lookup is None else pd.concat([self.lookup, found], ignore_index=True)
+            # Quarantined addresses are only skipped for this file; a later file tries them again
+            geocoded = found[KEY_COLUMN].isin(pd.read_csv(output_file, usecols=[KEY_COLUMN], dtype={KEY_COLUMN: str})[KEY_COLUMN].fillna(''))
+            self.lookup = found[geocoded] if self.lookup is None else pd.concat([self.lookup, found[geocoded]], ignore_index=True)
+            if len(self.lookup) > self.max_rows:
+                self.lookup = self.lookup.iloc[-self.max_rows:].reset_index(drop=True)
+            return lookup
+        return self.lookup
+
+def geocode_with_lookup(df, lookup, threshold, output_folder, output_file):
+    """
+    Write the geocoder output for the preprocessed rows of one file, taking results from the union lookup.
+
+    Rows whose address is not in the lookup (e.g. the file could not be read during the union)
+    are sent to the geocoder backend as usual.
+
+    Parameters:
+    df (pandas.DataFrame): Preprocessed rows with an `address` column
+    lookup (pandas.DataFrame): Result of geocode_union()
+    threshold (float): Threshold for the geocoder's score (accuracy)
+    output_folder (str): Folder of the file being processed
+    output_file (str): Geocoder output CSV to write
+    """
+    keys = address_key(df['address'])
+    known = keys.isin(lookup[KEY_COLUMN])
+    parts = [df[known].assign(**{KEY_COLUMN: keys[known]}).merge(lookup, on=KEY_COLUMN, how='left').drop(columns=[KEY_COLUMN])]
+    if not known.all():
+        logger.info(f"{int((~known).sum())} addresses not in the run-wide union, geocoding them now")
+        missing_file = os.path.join(output_folder, f"union_missing_geocoder_3.3.0_score_threshold_{threshold}.csv")
+        backends.geocoder().geocode(df[~known], threshold, output_folder, missing_file)
+        parts.append(pd.read_csv(missing_file))
+    write_csv_atomic(pd.concat(parts, ignore_index=True), output_file)
+    logger.info(f"{int(known.sum())} of {len(df)} rows taken from the run-wide address union")
+    return output_file
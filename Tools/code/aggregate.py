@@ -0,0 +1,135 @@
+import os
+import threading
+from loguru import logger
+from runtime import lazy_import
+from run_ledger import write_csv_atomic
+
+pd = lazy_import('pandas')
+
+# -------------------------------------------------------------------
+# Aggregate-only output.
+# Instead of row-level <file>_with_fips.csv files, linked rows are folded
+# into (FIPS, year[, category]) counters as each file or batch finishes, and a
+# single summary table is written at the end:
+#   FIPS, year, [category,] n_rows, n_persons, suppressed
+# n_rows counts linked rows (visits in OMOP mode), n_persons distinct
+# person_id / entity_id values. Cells below a minimum size can be suppressed.
+# n_persons is exact because the counter keeps the set of person ids of every
+# cell in memory, so its memory grows with the number of distinct (cell, person)
+# pairs, not only with the number of cells. The per-batch partial counts of
+# OMOP mode likewise hold one row per cell and person (identifiers on disk);
+# they are deleted once the run's summary table is written.
+# -------------------------------------------------------------------
+
+# Columns identifying a person, in order of preference
+ENTITY_COLUMNS = ['person_id', 'entity_id']
+
+# Per-batch partial counts written in OMOP mode (kept in the run directory, so resumed runs keep them)
+PARTIAL_SUFFIX = '_fips_counts.csv'
+
+def partial_counts(df, category=None, year_column='year'):
+    """
+    Counts of one file or batch of linked rows, per cell and person.
+
+    Parameters:
+    df (pandas.DataFrame): Linked rows with a FIPS column (rows without FIPS count as unlinked)
+    category (str, optional): Category of the rows (file name, OMOP category)
+    year_column (str): Column holding the year of each row
+
+    Returns:
+    pandas.DataFrame: FIPS, year, category, entity, n_rows; one row per cell and person
+    """
+    entity = next((col for col in ENTITY_COLUMNS if col in df.columns), None)
+    cells = pd.DataFrame({
+        'FIPS': df['FIPS'].astype('string').str.replace(r'\.0$', '', regex=True).str.zfill(11) if 'FIPS' in df.columns else pd.Series(pd.NA, index=df.index, dtype='string'),
+        'year': pd.to_numeric(df[year_column], errors='coerce').astype('Int64') if year_column in df.columns else pd.Series(pd.NA, index=df.index, dtype='Int64'),
+        'category': category,
+        'entity': df[entity].astype('string') if entity else pd.Series(pd.NA, index=df.index, dtype='string'),
+    })
+    return cells.groupby(['FIPS', 'year', 'category', 'entity'], dropna=False).size().rename('n_rows').reset_index()
+
+class FipsCounter:
+    """
+    Thread-safe running totals per (FIPS, year, category) cell, fed with partial_counts() frames.
+
+    n_rows is a plain sum; n_persons is exact across files and batches because the distinct
+    person ids of every cell are kept in memory until summary().
+    """
+
+    def __init__(self, by_category=False):
+        self.by_category = by_category
+        self._rows = {}
+        self._entities = {}
+        self._lock = threading.Lock()
+
+    def add(self, partial):
+        keys = ['FIPS', 'year', 'category'] if self.by_category else ['FIPS', 'year']
+        rows = partial.groupby(keys, dropna=False)['n_rows'].sum()
+        entities = partial.dropna(subset=['entity']).groupby(keys, dropna=False)['entity'].agg(set)
+        with self._lock:
+            for key, n in rows.items():
+                key = key if isinstance(key, tuple) else (key,)
+                self._rows[key] = self._rows.get(key, 0) + int(n)
+            for key, ids in entities.items():
+                key = key if isinstance(key, tuple) else (key,)
+                self._entities.setdefault(key, set()).update(ids)
+
+    def add_frame(self, df, category=None, year_column='year'):
+        """Fold linked rows straight into the totals."""
+        self.add(partial_counts(df, category, year_column))
+
+    def add_file(self, path):
+        """Fold a partial counts CSV written by write_partial()."""
+        self.add(pd.read_csv(path, dtype={'FIPS': 'string', 'category': 'string', 'entity': 'string'}, keep_default_na=False, na_values=['']))
+
+    def summary(self, min_cell_size=0):
+        """
+        The totals as a table, with cells smaller than `min_cell_size` suppressed.
+
+        A cell is measured by n_persons when person ids were available, otherwise by n_rows;
+        suppressed cells keep their key but report no counts.
+        """
+        keys = ['FIPS', 'year', 'category'] if self.by_category else ['FIPS', 'year']
+        with self._lock:
+            records = [dict(zip(keys, key), n_rows=n, n_persons=len(self._entities[key]) if key in self._entities else None)
+                       for key, n in self._rows.items()]
+        table = pd.DataFrame(records, columns=keys + ['n_rows', 'n_persons'])
+        table['n_persons'] = table['n_persons'].astype('Int64')
+        table['n_rows'] = table['n_rows'].astype('Int64')
+        size = table['n_persons'].fillna(table['n_rows'])
+        table['suppressed'] = (size < min_cell_size) if min_cell_size else False
+        table.loc[table['suppressed'], ['n_rows', 'n_persons']] = pd.NA
+        return table.sort_values(keys, na_position='last').reset_index(drop=True)
+
+    def write(self, path, min_cell_size=0):
+        table = self.summary(min_cell_size)
+        write_csv_atomic(table, path)
+        logger.info(f"Aggregate counts written: {path} ({len(table)} cells, {int(table['suppressed'].sum())} suppressed)")
+        return path
+
+def write_partial(df, path, category=None, year_column='year'):
+    """Write the partial counts of one batch next to where its row-level file would have gone."""
+    return write_csv_atomic(partial_counts(df, category, year_column), path)
+
+def _partial_files(search_root):
+    for root, _, files in os.walk(search_root):
+        for name in sorted(files):
+            if name.endswith(PARTIAL_SUFFIX):
+                yield os.path.join(root, name)
+
+def collect_partials(search_root, by_category=False):
+    """FipsCounter over every partial counts file under `search_root`."""
+    counter = FipsCounter(by_category)
+    for path in _partial_files(search_root):
+        counter.add_file(path)
+    return counter
+
+def remove_partials(search_root):
+    """Delete the partial counts files under `search_root` (they hold person ids); returns how many."""
+    removed = 0
+    for path in list(_partial_files(search_root)):
+        os.remove(path)
+        removed += 1
+    if removed:
+        logger.info(f"Deleted {removed} partial counts files under {search_root}")
+    return removed
@@ -0,0 +1,300 @@
+import io
+import os
+import csv
+import datetime
+import decimal
+from loguru import logger
+from run_ledger import part_path, commit_part
+from runtime import lazy_import
+
+pa = lazy_import('pyarrow')
+
+# -------------------------------------------------------------------
+# Bounded-memory extraction sink.
+# SQL cursor batches are converted straight into Arrow record batches and
+# appended to Parquet or (optionally gzip-compressed) CSV files, so memory
+# stays constant no matter how large the source table is.
+# -------------------------------------------------------------------
+
+# Output format -> file extension
+SINK_FORMATS = {
+    "csv": ".csv",
+    "csv.gz": ".csv.gz",
+    "parquet": ".parquet",
+}
+
+# Rows pulled from the cursor per fetchmany() call
+FETCH_ROWS = 10000
+
+# pyodbc reports the column type in cursor.description as a Python class
+# (Arrow type factories are looked up by name so pyarrow is only imported when used)
+PY_TYPE_TO_ARROW = {
+    bool: ("bool_",),
+    int: ("int64",),
+    float: ("float64",),
+    decimal.Decimal: ("float64",),
+    str: ("string",),
+    bytes: ("binary",),
+    bytearray: ("binary",),
+    datetime.date: ("date32",),
+    datetime.datetime: ("timestamp", "us"),
+    datetime.time: ("time64", "us"),
+}
+
+
+def arrow_type_for(py_type):
+    """Arrow type for a Python column type from cursor.description, or None if unknown."""
+    spec = PY_TYPE_TO_ARROW.get(py_type)
+    if spec is None:
+        return None
+    return getattr(pa, spec[0])(*spec[1:])
+
+
+def schema_from_description(description):
+    """
+    Build the Arrow column types from a DB-API cursor description.
+
+    Parameters:
+    description (sequence): cursor.description (name, type_code, ...) tuples
+
+    Returns:
+    tuple: (list of column names, list of Arrow types or None when the driver type is unknown)
+    """
+    names = [col[0] for col in description]
+    types = [arrow_type_for(col[1]) if isinstance(col[1], type) else None for col in description]
+    return names, types
+
+
+def _widened_array(values, locked):
+    """
+    Array of `values` when they do not fit the column's locked type: float64 when numbers meet
+    a numeric column (e.g. 2.5 after integers), string otherwise (e.g. text after numbers).
+    """
+    try:
+        inferred = pa.array(values)
+        if (pa.types.is_integer(locked) or pa.types.is_floating(locked) or pa.types.is_decimal(locked)) \
+                and (pa.types.is_integer(inferred.type) or pa.types.is_floating(inferred.type) or pa.types.is_decimal(inferred.type)):
+            return inferred.cast(pa.float64())
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        pass
+    return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+def rows_to_record_batch(rows, names, types):
+    """
+    Convert a list of cursor rows to an Arrow record batch without going through pandas.
+
+    Column types that are still unknown (None) are inferred from this batch and written
+    back into `types`, so later batches are cast to the same schema. A batch whose values
+    do not fit a column's type widens it (to float64 for numbers, otherwise to string);
+    the wider type is written back as well.
+
+    Parameters:
+    rows (list of tuple): Rows returned by cursor.fetchmany()
+    names (list of str): Column names
+    types (list): Arrow types per column, None where not yet known (updated in place)
+
+    Returns:
+    pyarrow.RecordBatch: The typed batch
+    """
+    columns = list(zip(*rows)) if rows else [() for _ in names]
+    arrays = []
+    for i, values in enumerate(columns):
+        target = types[i]
+        if target is None:
+            try:
+                arr = pa.array(values)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # Mixed Python types in one column
+                arr = _widened_array(values, pa.string())
+            # A column that is entirely NULL in the first batch is kept as text
+            if pa.types.is_null(arr.type):
+                arr = arr.cast(pa.string())
+            types[i] = arr.type
+        else:
+            try:
+                # pa.array truncates 2.5 to 2 for an integer type; a safe cast raises instead
+                arr = pa.array(values).cast(target) if pa.types.is_integer(target) else pa.array(values, type=target)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                try:
+                    # e.g. Decimal -> float64: infer first, then cast to the locked type
+                    arr = pa.array(values).cast(target)
+                except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                    arr = _widened_array(values, target)
+                    logger.info(f"Column {names[i]} widened from {target} to {arr.type}")
+                    types[i] = arr.type
+        arrays.append(arr)
+    return pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+class BatchFileWriter:
+    """
+    Appends Arrow record batches to a single Parquet or CSV(.gz) file.
+
+    Data is written to `path`.part and renamed to `path` on close(), so a file that
+    exists under its final name is always complete.
+
+    CSV is written like pandas' to_csv: unquoted, except in batches that contain a
+    delimiter, quote or line break (Arrow's 'needed' quoting, which quotes every string).
+    A batch with a wider schema than the file (see rows_to_record_batch) is written as is
+    to CSV; a Parquet file is rewritten once with the wider schema.
+    """
+
+    def __init__(self, path, schema, fmt="csv"):
+        if fmt not in SINK_FORMATS:
+            raise ValueError(f"Unsupported sink format: {fmt}")
+        self.path = path
+        self.fmt = fmt
+        self.rows = 0
+        self.last_row = None
+        self.schema = schema
+        tmp_path = part_path(path)
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(tmp_path, schema)
+            self._stream = None
+        else:
+            import pyarrow.csv as pa_csv
+            self._csv = pa_csv
+            if fmt == "csv.gz":
+                self._stream = pa.CompressedOutputStream(tmp_path, "gzip")
+            else:
+                self._stream = pa.OSFile(tmp_path, "wb")
+            self._writer = None
+            # Arrow quotes header names in every quoting style
+            header = io.StringIO()
+            csv.writer(header, lineterminator="\n").writerow(schema.names)
+            self._stream.write(header.getvalue().encode())
+
+    def _write_csv(self, data):
+        # Rendered into a buffer first: the unquoted attempt fails on the first value that needs quotes.
+        # The quoted attempt is not guarded, so a batch Arrow cannot write raises instead of being lost.
+        buffer = pa.BufferOutputStream()
+        try:
+            self._csv.write_csv(data, buffer, self._csv.WriteOptions(include_header=False, quoting_style="none"))
+        except pa.ArrowInvalid:
+            buffer = pa.BufferOutputStream()
+            self._csv.write_csv(data, buffer, self._csv.WriteOptions(include_header=False, quoting_style="needed"))
+        self._stream.write(buffer.getvalue())
+
+    def _widen_parquet(self, schema):
+        import pyarrow.parquet as pq
+        self._writer.close()
+        tmp_path = part_path(self.path)
+        old_path = tmp_path + ".narrow"
+        os.replace(tmp_path, old_path)
+        self._writer = pq.ParquetWriter(tmp_path, schema)
+        for batch in pq.ParquetFile(old_path).iter_batches():
+            self._writer.write_batch(batch.cast(schema))
+        os.remove(old_path)
+
+    def write(self, batch):
+        if batch.schema != self.schema:
+            if self.fmt == "parquet":
+                self._widen_parquet(batch.schema)
+            self.schema = batch.schema
+        if self._writer is None:
+            self._write_csv(batch)
+        else:
+            self._writer.write(batch)
+        self.rows += batch.num_rows
+        if batch.num_rows:
+            self.last_row = batch.slice(batch.num_rows - 1).to_pylist()[0]
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._stream is not None:
+            self._stream.close()
+        commit_part(self.path)
+
+
+def stream_query_to_files(engine, query, path_template, fmt="csv", rows_per_file=100000, on_file=None, start_number=1):
+    """
+    Execute a query and stream its result set into one or more files.
+
+    Rows are fetched from the DB-API cursor FETCH_ROWS at a time and converted to Arrow
+    record batches; only one batch is held in memory at any moment.
+
+    Parameters:
+    engine (sqlalchemy.Engine): Engine to open a raw DB-API connection from
+    query (str): SQL to execute
+    path_template (str): Output path without extension; '{}' is replaced by the 1-based file
+                         number (a template without '{}' writes a single file)
+    fmt (str): One of SINK_FORMATS
+    rows_per_file (int or None): Roll over to a new file after this many rows (None = single file)
+    on_file (callable, optional): Called as on_file(path, rows, last_row) for every completed file,
+                                  with its last row as a dict (None for an empty file)
+    start_number (int): Number of the first file written (to continue a resumed extraction)
+
+    Returns:
+    list of str: Paths of the files written
+    """
+    extension = SINK_FORMATS[fmt]
+    single_file = "{}" not in path_template or not rows_per_file
+    written = []
+    writer = None
+    file_number = start_number - 1
+
+    def _finish(w):
+        w.close()
+        written.append(w.path)
+        logger.info(f"Saved {w.rows} rows to {w.path}")
+        if on_file is not None:
+            on_file(w.path, w.rows, w.last_row)
+
+    raw_conn = engine.raw_connection()
+    try:
+        cursor = raw_conn.cursor()
+        cursor.execute(query)
+        names, types = schema_from_description(cursor.description)
+        while True:
+            rows = cursor.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            batch = rows_to_record_batch(rows, names, types)
+            offset = 0
+            while offset < batch.num_rows:
+                if writer is None:
+                    file_number += 1
+                    path = path_template if single_file else path_template.format(file_number)
+                    writer = BatchFileWriter(path + extension, batch.schema, fmt)
+                take = batch.num_rows - offset
+                if not single_file:
+                    take = min(take, rows_per_file - writer.rows)
+                writer.write(batch.slice(offset, take))
+                offset += take
+                if not single_file and writer.rows >= rows_per_file:
+                    _finish(writer)
+                    writer = None
+        # An empty result still produces a header-only file in single-file mode
+        if writer is None and single_file:
+            batch = rows_to_record_batch([], names, types)
+            writer = BatchFileWriter(path_template + extension, batch.schema, fmt)
+        if writer is not None:
+            _finish(writer)
+        cursor.close()
+    finally:
+        raw_conn.close()
+    return written
+
+
+def strip_sink_extension(filename):
+    """Return the file name without any of the SINK_FORMATS extensions."""
+    for extension in sorted(SINK_FORMATS.values(), key=len, reverse=True):
+        if filename.endswith(extension):
+            return filename[: -len(extension)]
+    return os.path.splitext(filename)[0]
+
+
+def sink_extension(filename):
+    """Return the SINK_FORMATS extension of a file name ('.csv' if unknown)."""
+    return filename[len(strip_sink_extension(filename)):] or ".csv"
+
+
+def read_extracted(path):
+    """
+    Read a file written by this sink back into a pandas DataFrame.
+    """
+    from ingest import read_table
+    return read_table(path, text_columns=['zip'])
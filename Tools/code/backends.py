@@ -0,0 +1,131 @@
+from loguru import logger
+from runtime import lazy_import
+from run_ledger import write_csv_atomic
+import degauss
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# -------------------------------------------------------------------
+# Geocoder and FIPS backend selection.
+# Geocoders take the preprocessed frame (with an `address` column) and write a
+# DeGAUSS-compatible geocoded CSV; FIPS backends take lat/lon rows and write a
+# census_block_group-compatible CSV. The rest of the pipeline does not care
+# which one ran:
+#   degauss - ghcr.io/degauss-org containers (default)
+#   local   - in-process TIGER/Line address store (local_geocoder.py)
+#   postgis - spatial join against tract tables in a PostGIS database (postgis_fips.py; FIPS only)
+#   stub    - deterministic fake results, for tests and benchmarks without containers
+# -------------------------------------------------------------------
+
+GEOCODERS = ['degauss', 'local', 'stub']
+FIPS_BACKENDS = ['degauss', 'postgis', 'stub']
+
+class DegaussGeocoder:
+    """The DeGAUSS geocoder container, run in fault-isolated batches."""
+
+    name = 'degauss'
+
+    def geocode(self, df, threshold, output_folder, output_file):
+        return degauss.geocode(df, threshold, output_folder, output_file)
+
+class DegaussCensus:
+    """The DeGAUSS census_block_group container, run in fault-isolated batches."""
+
+    name = 'degauss'
+
+    def census(self, df, year, output_folder, output_file):
+        return degauss.census(df, year, output_folder, output_file)
+
+class StubGeocoder:
+    """
+    Fake geocoder: every address gets a precise match at coordinates derived from a hash of
+    its text, so the same address always lands on the same point inside the contiguous US.
+    """
+
+    name = 'stub'
+
+    def geocode(self, df, threshold, output_folder, output_file):
+        codes = pd.util.hash_pandas_object(df['address'].fillna('').astype(str).str.lower(), index=False).to_numpy()
+        output = df.assign(
+            matched_street='', matched_zip='', matched_city='', matched_state='',
+            lat=25 + (codes % 2400000) / 100000,
+            lon=-124 + (codes // 2400000 % 5700000) / 100000,
+            score=1.0, precision='range', geocode_result='geocoded',
+        )
+        write_csv_atomic(output, output_file)
+        return output_file, 0
+
+class StubCensus:
+    """Fake census lookup: 11-digit tract ids derived from a 0.1 degree grid cell of lat/lon."""
+
+    name = 'stub'
+
+    def census(self, df, year, output_folder, output_file):
+        lat = pd.to_numeric(df['lat'], errors='coerce')
+        lon = pd.to_numeric(df['lon'], errors='coerce')
+        valid = lat.notna() & lon.notna()
+        cell_lat = np.floor(lat.where(valid, 0) * 10).astype('int64')
+        cell_lon = np.floor(-lon.where(valid, 0) * 10).astype('int64')
+        tract = (10 + cell_lat % 80).astype(str).str.zfill(2) + (cell_lon % 1000).astype(str).str.zfill(3) + (cell_lat * 1000 + cell_lon).abs().mod(1000000).astype(str).str.zfill(6)
+        output = df.assign(**{
+            f'census_block_group_id_{year}': (tract + '1').where(valid),
+            f'census_tract_id_{year}': tract.where(valid),
+        })
+        write_csv_atomic(output, output_file)
+        return output_file, 0
+
+_active = {'geocoder': DegaussGeocoder(), 'census': DegaussCensus()}
+
+def configure(geocoder='degauss', tiger_db=None, fips='degauss', postgis_url=None, tract_table=None):
+    """
+    Select the geocoder and FIPS backends for this process.
+
+    Parameters:
+    geocoder (str): One of GEOCODERS
+    tiger_db (str, optional): Address store built with `local_geocoder.py build` (required for 'local')
+    fips (str): One of FIPS_BACKENDS
+    postgis_url (str, optional): SQLAlchemy URL of the tract database (required for 'postgis')
+    tract_table (str, optional): Tract table name with {year} for the vintage (default tract_{year})
+    """
+    if geocoder == 'degauss':
+        _active['geocoder'] = DegaussGeocoder()
+    elif geocoder == 'local':
+        if not tiger_db:
+            raise ValueError("The local geocoder needs --tiger-db <address store>")
+        from local_geocoder import LocalGeocoder
+        _active['geocoder'] = LocalGeocoder(tiger_db)
+    elif geocoder == 'stub':
+        _active['geocoder'] = StubGeocoder()
+    else:
+        raise ValueError(f"Unknown geocoder: {geocoder} (expected one of {GEOCODERS})")
+
+    if fips == 'degauss':
+        _active['census'] = DegaussCensus()
+    elif fips == 'postgis':
+        if not postgis_url:
+            raise ValueError("The postgis FIPS backend needs --postgis-url <database URL>")
+        from postgis_fips import PostgisCensus, DEFAULT_TABLE
+        _active['census'] = PostgisCensus(postgis_url, tract_table or DEFAULT_TABLE)
+    elif fips == 'stub':
+        _active['census'] = StubCensus()
+    else:
+        raise ValueError(f"Unknown FIPS backend: {fips} (expected one of {FIPS_BACKENDS})")
+    logger.info(f"Geocoder backend: {geocoder}, FIPS backend: {fips}")
+
+def attach_store(store):
+    """
+    Route the selected backends through a geocode_store.GeocodeStore: addresses are geocoded once,
+    at every score threshold, and known points are not sent for FIPS again. Call after configure().
+    """
+    _active['geocoder'] = store.geocoder(getattr(_active['geocoder'], 'backend', _active['geocoder']))
+    _active['census'] = store.census_backend(getattr(_active['census'], 'backend', _active['census']))
+    logger.info(f"Geocoder and FIPS results are kept in the geocode store {store.folder}")
+
+def geocoder():
+    """The geocoder backend selected with configure()."""
+    return _active['geocoder']
+
+def census():
+    """The FIPS backend selected with configure()."""
+    return _active['census']
@@ -0,0 +1,273 @@
+import os
+import json
+import zipfile
+from datetime import datetime
+from loguru import logger
+from runtime import lazy_import
+from run_ledger import RunLedger, part_path, commit_part
+
+pd = lazy_import('pandas')
+sqlalchemy = lazy_import('sqlalchemy')
+
+# -------------------------------------------------------------------
+# Change-data capture for incremental OMOP runs.
+# At the start of every OMOP_to_FIPS run the CDM is snapshotted:
+#   - the watermark: highest visit_occurrence_id and visit_start_date in VISIT_OCCURRENCE
+#     (extraction is bounded by it, so the next run starts exactly where this one ended)
+#   - a location fingerprint: one checksum per person over their LOCATION_HISTORY
+#     rows and the LOCATION rows they point to
+# Both are kept in the run directory (cdc_state.json, location_fingerprint.csv).
+# An --incremental run compares the fingerprint with a previous complete run's and
+# extracts only the visits past its watermark plus every visit of the persons
+# whose locations changed. The previous run's packaged rows that the delta does not
+# replace are carried over, so the new run's ZIPs and LOCATION.csv are complete.
+# Visits back-dated below the watermark or edited in place are not detected;
+# run a full extraction now and then (e.g. weekly).
+# -------------------------------------------------------------------
+
+STATE_FILE = 'cdc_state.json'
+FINGERPRINT_FILE = 'location_fingerprint.csv'
+CARRIED_PREFIX = 'carried_over'
+
+# Above this many changed persons the id list is too long for the extraction queries;
+# the run falls back to a full extraction
+MAX_CHANGED_PERSONS = 20000
+
+WATERMARK_QUERY = "SELECT MAX(visit_occurrence_id), MAX(visit_start_date) FROM {schema}.VISIT_OCCURRENCE"
+
+# Rows of every person's locations, in person order; the checksum is computed in pandas
+# (hash_pandas_object), so the query runs on every CDM dialect
+FINGERPRINT_QUERY = """
+    SELECT LS.entity_id, LS.location_id, LS.start_date, LS.end_date, L.address_1, L.address_2, L.city, L.state, L.zip, L.county,
+           L.location_source_value, L.country_concept_id, L.country_source_value, L.latitude, L.longitude
+    FROM {schema}.LOCATION_HISTORY LS
+    LEFT JOIN {schema}.LOCATION L ON L.location_id = LS.location_id
+    ORDER BY LS.entity_id"""
+
+FINGERPRINT_FETCH_ROWS = 100000
+
+class ChangeSet:
+    """
+    The visits one run extracts.
+
+    Parameters:
+    watermark (dict): visit_occurrence_id / visit_start_date snapshotted at the start of the run
+    since (dict, optional): Watermark of the previous run; None for a full extraction
+    changed_persons (list of int): Persons whose locations changed since the previous run
+    previous_run (str, optional): Run directory whose outputs the delta is merged into
+    """
+
+    def __init__(self, watermark, since=None, changed_persons=(), previous_run=None):
+        self.watermark = watermark
+        self.since = since
+        self.changed_persons = sorted(changed_persons)
+        self.previous_run = previous_run
+
+    @property
+    def incremental(self):
+        return self.since is not None
+
+    def visit_filter(self, alias='p'):
+        """SQL condition (for a WHERE ... AND) selecting this run's visits; '' selects all of them."""
+        clauses = []
+        if self.watermark.get('visit_occurrence_id') is not None:
+            clauses.append(f"{alias}.visit_occurrence_id <= {int(self.watermark['visit_occurrence_id'])}")
+        if self.incremental:
+            new = [f"{alias}.visit_occurrence_id > {int(self.since['visit_occurrence_id'])}"]
+            if self.since.get('visit_start_date'):
+                new.append(f"{alias}.visit_start_date > '{self.since['visit_start_date']}'")
+            if self.changed_persons:
+                new.append(f"{alias}.person_id IN ({', '.join(str(int(p)) for p in self.changed_persons)})")
+            clauses.append(f"({' OR '.join(new)})")
+        return " AND ".join(clauses)
+
+    def to_dict(self):
+        return {'watermark': self.watermark, 'since': self.since,
+                'changed_persons': self.changed_persons, 'previous_run': self.previous_run}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['watermark'], data.get('since'), data.get('changed_persons', []), data.get('previous_run'))
+
+def load(run_dir):
+    with open(os.path.join(run_dir, STATE_FILE)) as f:
+        return ChangeSet.from_dict(json.load(f))
+
+def save(run_dir, changes):
+    path = os.path.join(run_dir, STATE_FILE)
+    with open(part_path(path), 'w') as f:
+        json.dump(dict(changes.to_dict(), created=datetime.now().isoformat(timespec='seconds')), f, indent=2)
+    return commit_part(path)
+
+def check_previous(run_dir):
+    """
+    Make sure `run_dir` can be the base of an incremental run.
+
+    Raises:
+    ValueError: If the run did not finish, kept no watermark or only wrote aggregate counts
+    """
+    ledger = RunLedger(run_dir)
+    if not os.path.isfile(os.path.join(run_dir, STATE_FILE)):
+        raise ValueError(f"No {STATE_FILE} in {run_dir}; an incremental run needs a previous run that recorded a watermark.")
+    if not ledger.is_done('finalize'):
+        raise ValueError(f"The run in {run_dir} did not complete; finish it with --resume first.")
+    if ledger.config.get('aggregate'):
+        raise ValueError(f"The run in {run_dir} wrote aggregate counts only; its rows cannot be carried over.")
+
+def snapshot_watermark(engine, schema='CDM'):
+    with engine.connect() as conn:
+        max_id, max_date = conn.execute(sqlalchemy.text(WATERMARK_QUERY.format(schema=schema))).fetchone()
+    return {'visit_occurrence_id': None if max_id is None else int(max_id),
+            'visit_start_date': None if max_date is None else str(max_date)[:10]}
+
+def write_fingerprint(engine, output_file, schema='CDM', fetch_rows=FINGERPRINT_FETCH_ROWS):
+    """
+    Write one row per person: entity_id, location_rows and a checksum of their location rows.
+
+    Every row is hashed over its text values and a person's checksum is the sum of their row
+    hashes (mod 2^64), so it does not depend on the order of a person's rows. Rows arrive
+    ordered by person and are aggregated one fetch at a time; only the last person of a
+    fetch is held back, as their rows may continue in the next one.
+
+    Returns:
+    int: Number of persons written
+    """
+    persons = 0
+    pending = None  # (entity_id, rows, checksum) of the last person of the previous fetch
+    raw_conn = engine.raw_connection()
+    try:
+        cursor = raw_conn.cursor()
+        cursor.execute(FINGERPRINT_QUERY.format(schema=schema))
+        names = [d[0].lower() for d in cursor.description]
+        with open(part_path(output_file), 'w', newline='') as out:
+            out.write('entity_id,location_rows,checksum\n')
+            while True:
+                rows = cursor.fetchmany(fetch_rows)
+                if not rows:
+                    break
+                chunk = pd.DataFrame.from_records(rows, columns=names)
+                values = chunk.drop(columns=['entity_id']).astype(str)
+                chunk = pd.DataFrame({'entity_id': chunk['entity_id'], 'checksum': pd.util.hash_pandas_object(values, index=False).to_numpy()})
+                grouped = chunk.groupby('entity_id', sort=False)['checksum'].agg(['size', 'sum'])
+                persons_in_chunk = list(zip(grouped.index, grouped['size'].astype(int), grouped['sum'].astype('uint64')))
+                if pending is not None:
+                    if persons_in_chunk[0][0] == pending[0]:
+                        entity_id, size, checksum = persons_in_chunk[0]
+                        persons_in_chunk[0] = (entity_id, size + pending[1], (int(checksum) + int(pending[2])) % 2 ** 64)
+                    else:
+                        persons_in_chunk.insert(0, pending)
+                pending = persons_in_chunk.pop()
+                for entity_id, size, checksum in persons_in_chunk:
+                    out.write(f"{entity_id},{size},{int(checksum):016x}\n")
+                persons += len(persons_in_chunk)
+            if pending is not None:
+                out.write(f"{pending[0]},{pending[1]},{int(pending[2]):016x}\n")
+                persons += 1
+    finally:
+        raw_conn.close()
+    commit_part(output_file)
+    logger.info(f"Location fingerprint of {persons} persons written to {output_file}")
+    return persons
+
+def _read_fingerprint(run_dir):
+    path = os.path.join(run_dir, FINGERPRINT_FILE)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=['entity_id', 'location_rows', 'checksum'])
+    return pd.read_csv(path, dtype={'checksum': str})
+
+def changed_persons(previous_run, run_dir):
+    """Persons whose fingerprint differs between two runs, including persons added or removed."""
+    merged = _read_fingerprint(previous_run).merge(_read_fingerprint(run_dir), on='entity_id', how='outer', suffixes=('_old', '_new'), indicator=True)
+    changed = (merged['_merge'] != 'both') \
+        | (merged['checksum_old'] != merged['checksum_new']) \
+        | (merged['location_rows_old'] != merged['location_rows_new'])
+    return [int(entity_id) for entity_id in merged.loc[changed, 'entity_id']]
+
+def prepare(engine, run_dir, previous_run=None, schema='CDM', resumed=False):
+    """
+    Snapshot the CDM for a new run and decide what it extracts.
+
+    A resumed run keeps the change set it started with; a run resumed without one
+    (started before watermarks were recorded) extracts everything and records none.
+
+    Parameters:
+    engine (sqlalchemy.Engine): CDM connection
+    run_dir (str): Directory of this run; cdc_state.json and location_fingerprint.csv are written to it
+    previous_run (str, optional): Completed run to extract the delta against (see check_previous)
+    resumed (bool): Whether `run_dir` is an interrupted run being continued
+
+    Returns:
+    ChangeSet or None: What to extract
+    """
+    if os.path.exists(os.path.join(run_dir, STATE_FILE)):
+        changes = load(run_dir)
+        logger.info(f"Continuing with the change set recorded in {STATE_FILE}")
+        return changes
+    if resumed:
+        return None
+
+    watermark = snapshot_watermark(engine, schema)
+    write_fingerprint(engine, os.path.join(run_dir, FINGERPRINT_FILE), schema)
+    changes = ChangeSet(watermark)
+    if previous_run:
+        previous = load(previous_run)
+        changed = changed_persons(previous_run, run_dir)
+        if previous.watermark.get('visit_occurrence_id') is None:
+            logger.warning(f"The run in {previous_run} had no visits; extracting everything.")
+        elif len(changed) > MAX_CHANGED_PERSONS:
+            logger.warning(f"{len(changed)} persons have changed locations (more than {MAX_CHANGED_PERSONS}); extracting everything.")
+        else:
+            changes = ChangeSet(watermark, previous.watermark, changed, os.path.abspath(previous_run))
+            logger.info(f"Incremental run against {previous_run}: visits after {previous.watermark}, "
+                        f"up to {watermark}, plus all visits of {len(changed)} person(s) with changed locations")
+    save(run_dir, changes)
+    logger.info(f"Watermark recorded: {watermark}")
+    return changes
+
+def _carry_archive(archive, output_file, changes, chunksize):
+    """Write the rows of every CSV in `archive` that are not re-extracted by `changes`; returns (kept, total)."""
+    replaced = set(changes.changed_persons)
+    kept = total = 0
+    with zipfile.ZipFile(archive) as zf:
+        members = [name for name in zf.namelist() if name.endswith('.csv')]
+        # Batches may differ in columns; the carried file gets all of them
+        columns = []
+        for name in members:
+            with zf.open(name) as f:
+                columns.extend(c for c in pd.read_csv(f, nrows=0).columns if c not in columns)
+        with open(part_path(output_file), 'w', newline='') as out:
+            for name in members:
+                with zf.open(name) as f:
+                    for chunk in pd.read_csv(f, dtype=str, keep_default_na=False, chunksize=chunksize):
+                        total += len(chunk)
+                        if 'person_id' in chunk.columns and replaced:
+                            chunk = chunk[~pd.to_numeric(chunk['person_id'], errors='coerce').isin(replaced)]
+                        chunk.reindex(columns=columns).to_csv(out, header=kept == 0, index=False)
+                        kept += len(chunk)
+    if kept:
+        commit_part(output_file)
+    else:
+        os.remove(part_path(output_file))
+    return kept, total
+
+def carry_over(changes, process_type, output_dir, chunksize=100000):
+    """
+    Copy the previous run's packaged rows of a process type that this run does not
+    re-extract into carried_over_with_coordinates.csv / carried_over_with_fips.csv.
+
+    Returns:
+    tuple: (list of coordinate files, list of FIPS files) to package with the delta
+    """
+    if changes is None or not changes.incremental:
+        return [], []
+    carried = {}
+    for kind in ('coordinates', 'fips'):
+        archive = os.path.join(changes.previous_run, f'{process_type}_with_{kind}.zip')
+        if not os.path.exists(archive):
+            continue
+        output_file = os.path.join(output_dir, f'{CARRIED_PREFIX}_with_{kind}.csv')
+        kept, total = _carry_archive(archive, output_file, changes, chunksize)
+        logger.info(f"Carried over {kept} of {total} rows from {archive}")
+        if kept:
+            carried[kind] = [output_file]
+    return carried.get('coordinates', []), carried.get('fips', [])
@@ -0,0 +1,177 @@
+import os
+import glob
+from loguru import logger
+from runtime import lazy_import
+
+pd = lazy_import('pandas')
+sqlalchemy = lazy_import('sqlalchemy')
+
+# -------------------------------------------------------------------
+# Write-back of geocoded coordinates and FIPS codes into the OMOP CDM.
+# Results are bulk-loaded (batched executemany) into session temp staging
+# tables and applied with one set-based statement per target:
+#   - LOCATION.latitude/longitude are filled only where they are still blank
+#   - a location -> FIPS mapping table is upserted on (location_id, fips_vintage)
+# Both statements are idempotent, so re-running a write-back changes nothing.
+# SQL Server uses MERGE; SQLite (>= 3.33), PostgreSQL and DuckDB use
+# UPDATE ... FROM and INSERT ... ON CONFLICT.
+# -------------------------------------------------------------------
+
+WRITEBACK_BATCH_ROWS = 10000
+
+# Same "blank" values the extraction queries treat as missing coordinates
+BLANK_COORDINATE_VALUES = ('', 'na', 'null', 'none', 'nan', '0', '0.0', 'n/a')
+
+def qualify(schema, table):
+    return f"{schema}.{table}" if schema else table
+
+def collect_location_coordinates(fips_files):
+    """
+    Collect one geocoded (latitude, longitude) pair per location_id from address-category FIPS files.
+
+    Returns:
+    pandas.DataFrame: location_id, latitude, longitude
+    """
+    frames = []
+    for file in fips_files:
+        header = pd.read_csv(file, nrows=0).columns
+        if not {'location_id', 'latitude', 'longitude'}.issubset(header):
+            continue
+        df = pd.read_csv(file, usecols=['location_id', 'latitude', 'longitude'])
+        df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
+        df['longitude'] = pd.to_numeric(df['longitude'], errors='coerce')
+        df = df.dropna()
+        df = df[df['latitude'].between(-90, 90) & df['longitude'].between(-180, 180)]
+        frames.append(df.drop_duplicates(subset='location_id'))
+    if not frames:
+        return pd.DataFrame(columns=['location_id', 'latitude', 'longitude'])
+    return pd.concat(frames, ignore_index=True).drop_duplicates(subset='location_id')
+
+def collect_location_fips(fips_files):
+    """
+    Collect the (location_id, fips_vintage) -> FIPS mapping from FIPS files.
+
+    Returns:
+    pandas.DataFrame: location_id, fips_vintage, fips
+    """
+    frames = []
+    for file in fips_files:
+        header = pd.read_csv(file, nrows=0).columns
+        if not {'location_id', 'year_for_fips', 'FIPS'}.issubset(header):
+            continue
+        df = pd.read_csv(file, usecols=['location_id', 'year_for_fips', 'FIPS'], dtype={'FIPS': str})
+        df = df.dropna().rename(columns={'year_for_fips': 'fips_vintage', 'FIPS': 'fips'})
+        df['fips'] = df['fips'].str.replace(r'\.0$', '', regex=True).str.zfill(11)
+        frames.append(df.drop_duplicates(subset=['location_id', 'fips_vintage']))
+    if not frames:
+        return pd.DataFrame(columns=['location_id', 'fips_vintage', 'fips'])
+    return pd.concat(frames, ignore_index=True).drop_duplicates(subset=['location_id', 'fips_vintage'])
+
+def _temp_table(conn, name, columns_sql):
+    """Create a session-scoped staging table and return the name to use in SQL."""
+    if conn.dialect.name == 'mssql':
+        temp_name = f"#{name}"
+        conn.exec_driver_sql(f"IF OBJECT_ID('tempdb..{temp_name}') IS NOT NULL DROP TABLE {temp_name}")
+        conn.exec_driver_sql(f"CREATE TABLE {temp_name} ({columns_sql})")
+        return temp_name
+    # SQLite looks an unqualified name up in every attached database; reading the schema of
+    # `main` there deadlocks the commit when main and the CDM are the same file (synthetic_cdm)
+    drop_name = f"temp.{name}" if conn.dialect.name == 'sqlite' else name
+    conn.exec_driver_sql(f"DROP TABLE IF EXISTS {drop_name}")
+    conn.exec_driver_sql(f"CREATE TEMPORARY TABLE {name} ({columns_sql})")
+    return name
+
+def _bulk_insert(conn, table, df, batch_rows):
+    """Load a DataFrame into a staging table with batched executemany."""
+    columns = list(df.columns)
+    insert = sqlalchemy.text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})")
+    for start in range(0, len(df), batch_rows):
+        records = df.iloc[start:start + batch_rows].astype(object).to_dict('records')
+        conn.execute(insert, records)
+
+def _blank_condition(column):
+    values = ', '.join(f"'{v}'" for v in BLANK_COORDINATE_VALUES)
+    return f"({column} IS NULL OR LOWER(TRIM(CAST({column} AS VARCHAR(50)))) IN ({values}))"
+
+def _ensure_fips_table(conn, table):
+    columns_sql = "location_id BIGINT NOT NULL, fips_vintage INTEGER NOT NULL, fips VARCHAR(11) NOT NULL, PRIMARY KEY (location_id, fips_vintage)"
+    if conn.dialect.name == 'mssql':
+        conn.exec_driver_sql(f"IF OBJECT_ID(N'{table}', N'U') IS NULL CREATE TABLE {table} ({columns_sql})")
+    else:
+        conn.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {table} ({columns_sql})")
+
+def write_back(engine, coordinates_df, fips_df, schema='CDM', fips_table='LOCATION_FIPS', batch_rows=WRITEBACK_BATCH_ROWS):
+    """
+    Bulk-load geocodes and FIPS codes into the CDM in one transaction.
+
+    Parameters:
+    engine (sqlalchemy.Engine): Target database (for SQL Server create it with fast_executemany=True)
+    coordinates_df (pandas.DataFrame): location_id, latitude, longitude
+    fips_df (pandas.DataFrame): location_id, fips_vintage, fips
+    schema (str or None): CDM schema name (None for databases without schemas, e.g. SQLite)
+    fips_table (str): Name of the location -> FIPS mapping table (created if missing)
+    batch_rows (int): Rows per executemany batch
+
+    Returns:
+    tuple: (number of LOCATION rows updated, number of mapping rows upserted)
+    """
+    location_table = qualify(schema, 'LOCATION')
+    mapping_table = qualify(schema, fips_table)
+    updated = upserted = 0
+
+    with engine.begin() as conn:
+        mssql = conn.dialect.name == 'mssql'
+
+        if not coordinates_df.empty:
+            stage = _temp_table(conn, 'exposome_location_stage', "location_id BIGINT PRIMARY KEY, latitude FLOAT, longitude FLOAT")
+            _bulk_insert(conn, stage, coordinates_df[['location_id', 'latitude', 'longitude']], batch_rows)
+            if mssql:
+                result = conn.exec_driver_sql(f"""
+                    MERGE {location_table} AS T
+                    USING {stage} AS S ON T.location_id = S.location_id
+                    WHEN MATCHED AND {_blank_condition('T.latitude')} AND {_blank_condition('T.longitude')}
+                        THEN UPDATE SET T.latitude = S.latitude, T.longitude = S.longitude;""")
+            else:
+                result = conn.exec_driver_sql(f"""
+                    UPDATE {location_table} AS T
+                    SET latitude = S.latitude, longitude = S.longitude
+                    FROM {stage} AS S
+                    WHERE T.location_id = S.location_id
+                      AND {_blank_condition('T.latitude')}
+                      AND {_blank_condition('T.longitude')}""")
+            updated = max(result.rowcount, 0)
+            logger.info(f"Updated coordinates for {updated} LOCATION rows")
+
+        if not fips_df.empty:
+            _ensure_fips_table(conn, mapping_table)
+            stage = _temp_table(conn, 'exposome_fips_stage', "location_id BIGINT NOT NULL, fips_vintage INTEGER NOT NULL, fips VARCHAR(11) NOT NULL")
+            _bulk_insert(conn, stage, fips_df[['location_id', 'fips_vintage', 'fips']], batch_rows)
+            if mssql:
+                result = conn.exec_driver_sql(f"""
+                    MERGE {mapping_table} AS T
+                    USING {stage} AS S ON T.location_id = S.location_id AND T.fips_vintage = S.fips_vintage
+                    WHEN MATCHED AND T.fips <> S.fips THEN UPDATE SET T.fips = S.fips
+                    WHEN NOT MATCHED THEN INSERT (location_id, fips_vintage, fips) VALUES (S.location_id, S.fips_vintage, S.fips);""")
+            else:
+                result = conn.exec_driver_sql(f"""
+                    INSERT INTO {mapping_table} (location_id, fips_vintage, fips)
+                    SELECT location_id, fips_vintage, fips FROM {stage} WHERE true
+                    ON CONFLICT (location_id, fips_vintage) DO UPDATE SET fips = excluded.fips""")
+            upserted = max(result.rowcount, 0)
+            logger.info(f"Upserted {upserted} rows into {mapping_table}")
+
+    return updated, upserted
+
+def write_back_results(engine, fips_result_dir, schema='CDM', fips_table='LOCATION_FIPS'):
+    """
+    Write the results of an OMOP_to_FIPS run back to the CDM.
+
+    Coordinates are taken from the address category only (latlong rows already have them);
+    the FIPS mapping is taken from every *_with_fips.csv under `fips_result_dir`.
+    """
+    address_files = sorted(glob.glob(os.path.join(fips_result_dir, 'address', '**', '*_with_fips.csv'), recursive=True))
+    all_files = sorted(glob.glob(os.path.join(fips_result_dir, '**', '*_with_fips.csv'), recursive=True))
+    coordinates_df = collect_location_coordinates(address_files)
+    fips_df = collect_location_fips(all_files)
+    logger.info(f"Writing back {len(coordinates_df)} geocoded locations and {len(fips_df)} FIPS mappings")
+    return write_back(engine, coordinates_df, fips_df, schema=schema, fips_table=fips_table)
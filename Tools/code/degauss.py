@@ -0,0 +1,368 @@
+import os
+import time
+import glob
+import shutil
+import tempfile
+import threading
+import uuid
+import subprocess
+from loguru import logger
+from runtime import lazy_import, get_host_base
+from run_ledger import write_csv_atomic
+
+pd = lazy_import('pandas')
+
+# -------------------------------------------------------------------
+# Fault-isolated DeGAUSS container calls.
+# Rows are sent to the geocoder / census containers in bounded batches, each
+# in its own batch directory. A batch that fails or times out is retried with
+# exponential backoff; if it still fails it is bisected until the offending
+# rows are isolated. Those rows go to a quarantine file and every other row
+# completes, so one malformed address no longer costs the whole file.
+#
+# Batches reach the container through one of three transports:
+#   file  - CSV files in the workspace (HOST_PWD) bind mount (default)
+#   tmpfs - CSV files in a tmpfs-backed scratch folder mounted as /scratch,
+#           so container I/O never touches persistent disk
+#   fifo  - named pipes in the scratch folder: rows are streamed into the
+#           container and its output is parsed while it is written. If a
+#           container cannot use pipes, the batch is re-run through tmpfs
+#           files and the process stays on tmpfs.
+# The tmpfs and fifo transports need the scratch folder at the same path on
+# the host running Docker. Before the first batch a sentinel file is read
+# back by a trivial container run; if that fails the process switches to the
+# file transport instead of quarantining every row.
+# -------------------------------------------------------------------
+
+GEOCODER_IMAGE = 'ghcr.io/degauss-org/geocoder:3.3.0'
+CENSUS_IMAGE = 'ghcr.io/degauss-org/census_block_group:0.6.0'
+
+# Quarantined rows are written to <name>_quarantine.csv next to the normal output
+QUARANTINE_SUFFIX = '_quarantine.csv'
+
+# Defaults, overridable from the command line through configure()
+SETTINGS = {
+    'batch_rows': 50000,   # rows per container invocation
+    'timeout': 3600,       # seconds before a container run is killed
+    'retries': 2,          # extra attempts for a failing full batch
+    'backoff': 5,          # seconds before the first retry, doubled every attempt
+    'transport': 'file',   # one of TRANSPORTS
+    'scratch': '/dev/shm/exposome',  # scratch folder of the tmpfs and fifo transports
+}
+
+TRANSPORTS = ['file', 'tmpfs', 'fifo']
+
+# Scratch folders a container has been seen to read (see scratch_root)
+_visible_scratch = set()
+_probe_lock = threading.Lock()
+
+class ContainerError(RuntimeError):
+    """A container run failed (non-zero exit, timeout or missing output) after all retries."""
+
+def configure(**settings):
+    """Override SETTINGS; None values are ignored."""
+    for key, value in settings.items():
+        if key not in SETTINGS:
+            raise KeyError(f"Unknown container setting: {key}")
+        if key == 'transport' and value is not None and value not in TRANSPORTS:
+            raise ValueError(f"Unknown container transport: {value} (expected one of {TRANSPORTS})")
+        if value is not None:
+            SETTINGS[key] = value
+
+def container_path(path):
+    """Path of a workspace file as seen from inside a container (workspace mounted at /workspace)."""
+    rel_path = os.path.relpath(os.path.abspath(path), os.getcwd()).replace("\\", "/")
+    return f'/workspace/{rel_path}'
+
+def _probe_mount(scratch, image):
+    """
+    Check that a container mounting `scratch` as /scratch sees the files written there.
+
+    Returns:
+    str or None: Why the check failed, None if the container read the sentinel file back
+    """
+    token = uuid.uuid4().hex
+    fd, sentinel = tempfile.mkstemp(prefix='mount_probe_', suffix='.txt', dir=scratch)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token)
+    docker_command = [
+        'docker', 'run', '--rm',
+        '-v', f'{scratch}:/scratch',
+        '--entrypoint', 'cat',
+        image,
+        '/scratch/' + os.path.basename(sentinel)
+    ]
+    try:
+        result = subprocess.run(docker_command, capture_output=True, text=True, timeout=SETTINGS['timeout'])
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return str(e)
+    finally:
+        os.remove(sentinel)
+    if result.stdout.strip() == token:
+        return None
+    return (result.stderr or '').strip()[-500:] or f"the container read {result.stdout.strip()[:80]!r} instead of the sentinel"
+
+def scratch_root(image=None):
+    """
+    Folder for batch directories of the tmpfs and fifo transports, or None for the file transport.
+
+    Falls back to the file transport (for the rest of the process) when the scratch folder cannot be used,
+    or when a container run on `image` cannot read a sentinel file from it (the folder is not shared with
+    the Docker host at the same path). The check runs once per scratch folder.
+
+    Parameters:
+    image (str, optional): Container image used for the mount check (skipped when omitted)
+    """
+    if SETTINGS['transport'] == 'file':
+        return None
+    scratch = SETTINGS['scratch']
+    try:
+        os.makedirs(scratch, exist_ok=True)
+        if not os.access(scratch, os.W_OK):
+            raise PermissionError(f"{scratch} is not writable")
+    except OSError as e:
+        logger.warning(f"Scratch folder unusable ({e}); container batches fall back to workspace files")
+        SETTINGS['transport'] = 'file'
+        return None
+    if image is None:
+        return scratch
+    with _probe_lock:
+        if SETTINGS['transport'] != 'file' and scratch not in _visible_scratch:
+            error = _probe_mount(scratch, image)
+            if error:
+                logger.error(f"Containers cannot read {scratch} mounted as /scratch ({error}). The {SETTINGS['transport']} "
+                             f"transport needs the scratch folder at the same path on the Docker host; "
+                             f"container batches fall back to workspace files")
+                SETTINGS['transport'] = 'file'
+            else:
+                _visible_scratch.add(scratch)
+    return scratch if SETTINGS['transport'] != 'file' else None
+
+def run_container(image, input_path, args, timeout=None, retries=0, backoff=None, mount=None):
+    """
+    Run a DeGAUSS container on one input file, retrying failures with exponential backoff.
+
+    Parameters:
+    image (str): Container image
+    input_path (str): Input CSV inside the mounted workspace (or inside `mount`)
+    args (list of str): Extra arguments after the input path (threshold, year)
+    timeout (int, optional): Seconds per attempt (SETTINGS['timeout'] by default)
+    retries (int): Extra attempts after the first failure
+    backoff (float, optional): Seconds before the first retry (SETTINGS['backoff'] by default)
+    mount (str, optional): Folder mounted as /scratch instead of the workspace (tmpfs and fifo transports)
+
+    Raises:
+    ContainerError: If every attempt failed
+    """
+    timeout = SETTINGS['timeout'] if timeout is None else timeout
+    backoff = SETTINGS['backoff'] if backoff is None else backoff
+    if mount:
+        volume = f'{mount}:/scratch'
+        path = '/scratch/' + os.path.relpath(input_path, mount).replace("\\", "/")
+    else:
+        volume = f'{get_host_base()}:/workspace'
+        path = container_path(input_path)
+    docker_command = [
+        'docker', 'run', '--rm',
+        '-v', volume,
+        image,
+        path,
+        *[str(arg) for arg in args]
+    ]
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            delay = backoff * 2 ** (attempt - 1)
+            logger.warning(f"Retrying {image} in {delay}s (attempt {attempt + 1} of {retries + 1})")
+            time.sleep(delay)
+        try:
+            result = subprocess.run(docker_command, check=True, capture_output=True, text=True, timeout=timeout)
+            logger.debug(result.stdout)
+            return
+        except subprocess.TimeoutExpired:
+            error = f"timed out after {timeout}s"
+        except subprocess.CalledProcessError as e:
+            error = f"exit code {e.returncode}: {(e.stderr or '').strip()[-500:]}"
+        logger.error(f"{image} failed on {input_path}: {error}")
+    raise ContainerError(f"{image} failed on {input_path}: {error}")
+
+def run_batched(df, run_batch, work_dir, output_file, quarantine_file, batch_rows=None, retries=None, image=None):
+    """
+    Feed `df` to a container in batches and write the combined output.
+
+    Every batch runs in its own subdirectory of `work_dir`, so container output names never
+    collide and the final file name does not depend on how the container names its output.
+    A batch that still fails after `retries` is split in half; each half is tried once and
+    split again on failure, down to single rows, which are quarantined.
+
+    Parameters:
+    df (pandas.DataFrame): Rows to process
+    run_batch (callable): run_batch(batch_df, batch_dir, retries) -> output DataFrame, raises ContainerError
+    work_dir (str): Folder for the batch subdirectories
+    output_file (str): Combined output CSV
+    quarantine_file (str): CSV receiving the rows that could not be processed (with an `error` column)
+    batch_rows (int, optional): Rows per batch (SETTINGS['batch_rows'] by default)
+    retries (int, optional): Retries of a full batch (SETTINGS['retries'] by default)
+    image (str, optional): Container image run by `run_batch`, used to check the scratch mount (see scratch_root)
+
+    Returns:
+    tuple: (output_file, number of quarantined rows)
+    """
+    batch_rows = batch_rows or SETTINGS['batch_rows']
+    retries = SETTINGS['retries'] if retries is None else retries
+    results = []
+    quarantined = []
+
+    def attempt(part, part_retries):
+        # Unique per call, so concurrent runs (e.g. both FIPS vintages) can share `work_dir`
+        os.makedirs(work_dir, exist_ok=True)
+        batch_dir = tempfile.mkdtemp(prefix='batch_', dir=scratch_root(image) or work_dir)
+        try:
+            results.append(run_batch(part, batch_dir, part_retries))
+        except ContainerError as e:
+            if len(part) == 1:
+                logger.warning(f"Quarantining row {part.index[0]}: {e}")
+                quarantined.append(part.assign(error=str(e)))
+                return
+            logger.warning(f"Batch of {len(part)} rows failed, bisecting to isolate the offending rows")
+            middle = len(part) // 2
+            # Halves are tried once: the full batch was already retried, so the failure is in the data
+            attempt(part.iloc[:middle], 0)
+            attempt(part.iloc[middle:], 0)
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+    for start in range(0, len(df), batch_rows):
+        attempt(df.iloc[start:start + batch_rows], retries)
+
+    if results:
+        write_csv_atomic(pd.concat(results, ignore_index=True), output_file)
+    else:
+        write_csv_atomic(df.iloc[0:0], output_file)
+    if quarantined:
+        write_csv_atomic(pd.concat(quarantined), quarantine_file)
+        logger.warning(f"{sum(len(q) for q in quarantined)} rows quarantined: {quarantine_file}")
+    elif os.path.exists(quarantine_file):
+        os.remove(quarantine_file)  # left over from an earlier attempt
+    return output_file, sum(len(q) for q in quarantined)
+
+def _run_files(image, part, batch_dir, input_name, output_name, args, retries, mount=None):
+    input_path = os.path.join(batch_dir, input_name)
+    part.to_csv(input_path, index=False)
+    run_container(image, input_path, args, retries=retries, mount=mount)
+    output_path = os.path.join(batch_dir, output_name)
+    if not os.path.exists(output_path):
+        raise ContainerError(f"{image} produced no output for {input_path}")
+    return pd.read_csv(output_path)
+
+def _run_fifo(image, part, batch_dir, input_name, output_name, args):
+    """One container run fed and drained through named pipes in `batch_dir` (no retries)."""
+    input_path = os.path.join(batch_dir, input_name)
+    output_path = os.path.join(batch_dir, output_name)
+    for path in (input_path, output_path):
+        if os.path.lexists(path):
+            os.remove(path)
+        os.mkfifo(path, 0o666)
+    outcome = {}
+
+    def feed():
+        try:
+            with open(input_path, 'w', newline='') as pipe:
+                part.to_csv(pipe, index=False)
+        except OSError as e:  # container stopped reading
+            outcome['feed_error'] = e
+
+    def drain():
+        try:
+            with open(output_path) as pipe:
+                outcome['output'] = pd.read_csv(pipe)
+        except Exception as e:
+            outcome['drain_error'] = e
+
+    threads = [threading.Thread(target=feed, daemon=True), threading.Thread(target=drain, daemon=True)]
+    for thread in threads:
+        thread.start()
+    try:
+        run_container(image, input_path, args, retries=0, mount=batch_dir)
+    finally:
+        # Wake whichever side is still waiting for the (finished) container to open its pipe
+        if threads[0].is_alive():
+            fd = os.open(input_path, os.O_RDONLY | os.O_NONBLOCK)
+            threads[0].join(1)
+            os.close(fd)
+        if threads[1].is_alive():
+            try:
+                os.close(os.open(output_path, os.O_WRONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+        for thread in threads:
+            thread.join()
+        # A fallback run in the same batch directory must not open the pipes
+        for path in (input_path, output_path):
+            if os.path.lexists(path) and not os.path.isfile(path):
+                os.remove(path)
+    if 'output' not in outcome:
+        raise ContainerError(f"{image} streamed no output for {input_path}: {outcome.get('drain_error')}")
+    if 'feed_error' in outcome:
+        raise ContainerError(f"{image} did not read all of {input_path}: {outcome['feed_error']}")
+    return outcome['output']
+
+def _container_batch(image, input_name, output_name, args):
+    def run_batch(part, batch_dir, retries):
+        transport = SETTINGS['transport']
+        if transport == 'file':
+            return _run_files(image, part, batch_dir, input_name, output_name, args, retries)
+        if transport == 'fifo':
+            try:
+                return _run_fifo(image, part, batch_dir, input_name, output_name, args)
+            except ContainerError as e:
+                logger.warning(f"Named pipe run failed ({e}); retrying the batch through tmpfs files")
+        output = _run_files(image, part, batch_dir, input_name, output_name, args, retries, mount=batch_dir)
+        if transport == 'fifo' and SETTINGS['transport'] == 'fifo':
+            # Files worked where pipes did not: the container cannot stream, stop trying
+            logger.warning(f"{image} does not accept named pipes; using the tmpfs transport from now on")
+            SETTINGS['transport'] = 'tmpfs'
+        return output
+    return run_batch
+
+def geocode(df, threshold, output_folder, output_file):
+    """
+    Geocode the `address` column of `df` with the DeGAUSS geocoder, batch by batch.
+
+    Returns:
+    tuple: (output_file, number of quarantined rows)
+    """
+    run_batch = _container_batch(GEOCODER_IMAGE, 'geocoder_input.csv', f'geocoder_input_geocoder_3.3.0_score_threshold_{threshold}.csv', [threshold])
+    quarantine_file = os.path.join(output_folder, f"geocoder{QUARANTINE_SUFFIX}")
+    return run_batched(df, run_batch, output_folder, output_file, quarantine_file, image=GEOCODER_IMAGE)
+
+def census(df, year, output_folder, output_file):
+    """
+    Assign census block groups for one vintage to the lat/lon rows of `df`, batch by batch.
+
+    Returns:
+    tuple: (output_file, number of quarantined rows)
+    """
+    run_batch = _container_batch(CENSUS_IMAGE, 'census_input.csv', f'census_input_census_block_group_0.6.0_{year}.csv', [year])
+    quarantine_file = os.path.join(output_folder, f"census_{year}{QUARANTINE_SUFFIX}")
+    return run_batched(df, run_batch, output_folder, output_file, quarantine_file, image=CENSUS_IMAGE)
+
+def collect_quarantine(search_root, destination):
+    """
+    Copy every quarantine file under `search_root` into `destination` before working folders are removed.
+
+    Returns:
+    list of str: The copied files
+    """
+    copied = []
+    for path in sorted(glob.glob(os.path.join(search_root, '**', f'*{QUARANTINE_SUFFIX}'), recursive=True)):
+        if os.path.dirname(os.path.abspath(path)) == os.path.abspath(destination):
+            continue
+        os.makedirs(destination, exist_ok=True)
+        name = os.path.relpath(path, search_root).replace(os.sep, '_')
+        target = os.path.join(destination, name)
+        shutil.copy(path, target)
+        copied.append(target)
+    if copied:
+        logger.warning(f"{len(copied)} quarantine files saved to {destination}")
+    return copied
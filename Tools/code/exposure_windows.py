@@ -0,0 +1,349 @@
+import os
+import sys
+import glob
+import zipfile
+import argparse
+import tempfile
+from loguru import logger
+from runtime import lazy_import
+from run_ledger import part_path, commit_part
+from interval_join import parse_dates
+from cdm_writeback import collect_location_fips
+import ingest
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# -------------------------------------------------------------------
+# Residential-history exposure windows.
+# For every anchor (a visit, by default) and every window of W years before it,
+# the time-weighted mean of yearly FIPS-keyed variables over the residences the
+# person lived at during the window:
+#   1. LOCATION_HISTORY periods are sorted by (entity_id, start_date) and split
+#      where they overlap, so each day has one residence (the latest-starting
+#      period covering it); a chunk of anchors picks its persons' pieces with
+#      np.searchsorted
+#   2. periods are split at 1 January, so each segment has one FIPS (the 2010
+#      vintage before 2020, the 2020 vintage from 2020 on, as in the linkage) and
+#      one variable year; values come from a hash lookup on (FIPS, year)
+#   3. cumulative sums of value x days over the sorted segments turn every window
+#      into two binary searches and a subtraction: integral(end) - integral(start),
+#      with the segment cut by each bound pro-rated
+# Anchors are streamed in chunks, so memory is bounded by the chunk and the
+# periods of its persons, not by the number of persons.
+#
+#   python exposure_windows.py --anchors VISIT_OCCURRENCE.csv --history LOCATION_HISTORY.csv \
+#       --fips address_with_fips.zip latlong_with_fips.zip --variables sdoh_by_tract_year.csv \
+#       --windows 1 5 10 --output exposures.csv
+# -------------------------------------------------------------------
+
+ANCHOR_COLUMNS = ['person_id', 'visit_occurrence_id', 'visit_start_date']
+HISTORY_COLUMNS = ['location_id', 'entity_id', 'start_date', 'end_date']
+FIPS_COLUMNS = ['fips', 'geoid', 'fips_code']  # accepted names of the variable table's FIPS column
+
+# Composite key = person code * _KEY_STRIDE + (days since 1970 + _DAY_OFFSET)
+_DAY_OFFSET = 2 ** 21
+_KEY_STRIDE = 2 ** 22
+_FIPS_DIGITS = 11
+
+def _days(dates):
+    return dates.values.astype('datetime64[D]').astype(np.int64)
+
+def _year_of(days):
+    return days.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970
+
+def _january_first(years):
+    return (years - 1970).astype('datetime64[Y]').astype('datetime64[D]').astype(np.int64)
+
+def _fips_int(values):
+    """11-digit tract FIPS as int64 (-1 where missing)."""
+    text = values.astype(str).str.replace(r'\.0$', '', regex=True).str.strip()
+    return pd.to_numeric(text.where(text.str.fullmatch(r'\d+')), errors='coerce').fillna(-1).astype(np.int64).values
+
+def load_location_fips(paths):
+    """
+    Location -> FIPS mapping from linkage results.
+
+    Parameters:
+    paths (list of str): *_with_fips.csv files, result ZIPs, folders holding either, or a
+        location-to-FIPS table with location_id, fips_vintage, fips (e.g. exported LOCATION_FIPS)
+
+    Returns:
+    pandas.DataFrame: location_id, fips_vintage, fips
+    """
+    frames, files = [], []
+    with tempfile.TemporaryDirectory(prefix='exposure_fips_') as tmp:
+        for path in paths:
+            if os.path.isdir(path):
+                files += sorted(glob.glob(os.path.join(path, '**', '*_with_fips.csv'), recursive=True))
+                archives = sorted(glob.glob(os.path.join(path, '**', '*_with_fips.zip'), recursive=True))
+            elif path.lower().endswith('.zip'):
+                archives = [path]
+            else:
+                header = pd.read_csv(path, nrows=0).columns.str.lower()
+                if {'location_id', 'fips_vintage', 'fips'}.issubset(header):
+                    frames.append(pd.read_csv(path, dtype={'fips': str}).rename(columns=str.lower)[['location_id', 'fips_vintage', 'fips']])
+                else:
+                    files.append(path)
+                archives = []
+            for i, archive in enumerate(archives):
+                with zipfile.ZipFile(archive) as zf:
+                    folder = os.path.join(tmp, f'{len(files)}_{i}')
+                    zf.extractall(folder, [name for name in zf.namelist() if name.endswith('.csv')])
+                files += sorted(glob.glob(os.path.join(folder, '**', '*.csv'), recursive=True))
+        frames.append(collect_location_fips(files))
+    mapping = pd.concat(frames, ignore_index=True).drop_duplicates(subset=['location_id', 'fips_vintage'])
+    logger.info(f"FIPS known for {mapping['location_id'].nunique()} locations ({len(files)} result file(s))")
+    return mapping
+
+class VariableTable:
+    """
+    Yearly variables keyed by FIPS: a FIPS column (fips, geoid or fips_code), a year column and
+    one numeric column per variable. County (5-digit) or tract (11-digit) keys are both accepted;
+    tract FIPS are truncated to the table's length.
+
+    Parameters:
+    df (pandas.DataFrame): The table
+    variables (list of str, optional): Variables to use (default: every numeric column but the keys)
+    """
+
+    def __init__(self, df, variables=None):
+        df = df.rename(columns=str.lower)
+        fips_column = next((col for col in FIPS_COLUMNS if col in df.columns), None)
+        if fips_column is None or 'year' not in df.columns:
+            raise ValueError(f"The variable table needs a FIPS column ({', '.join(FIPS_COLUMNS)}) and a year column")
+        text = df[fips_column].astype(str).str.replace(r'\.0$', '', regex=True).str.strip()
+        self.digits = int(text.str.len().max())
+        if self.digits > _FIPS_DIGITS:
+            raise ValueError(f"FIPS in the variable table have {self.digits} digits; tract (11) or coarser keys are supported")
+        if variables is None:
+            variables = [col for col in df.columns if col not in (fips_column, 'year') and pd.api.types.is_numeric_dtype(df[col])]
+        missing = [col for col in variables if col not in df.columns]
+        if missing:
+            raise ValueError(f"Variables not in the table: {missing}")
+        self.variables = list(variables)
+        keys = _fips_int(text) * 10000 + pd.to_numeric(df['year'], errors='coerce').fillna(0).astype(np.int64).values
+        first = ~pd.Index(keys).duplicated()
+        if not first.all():
+            logger.warning("The variable table has several rows for some (FIPS, year); the first one is used")
+        self.index = pd.Index(keys[first])
+        self.values = df[self.variables].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)[first]
+        logger.info(f"Variable table: {len(df)} rows, {self.digits}-digit FIPS, variables {self.variables}")
+
+    def lookup(self, tract_fips, years):
+        """Values (rows x variables, NaN where unknown) for 11-digit tract FIPS ints and years."""
+        keys = (tract_fips // 10 ** (_FIPS_DIGITS - self.digits)) * 10000 + years
+        rows = self.index.get_indexer(keys)
+        found = (rows >= 0) & (tract_fips >= 0)
+        values = np.full((len(keys), len(self.variables)), np.nan)
+        values[found] = self.values[rows[found]]
+        return values
+
+def _visible_pieces(entity, start, end):
+    """
+    Split the periods of each person (sorted by entity, start) so every day belongs to one of them:
+    the latest-starting period that covers it. An outer period resumes after a nested one ends.
+
+    Returns:
+    tuple of arrays: entity, start, end (exclusive) and period row of the pieces, sorted by entity and start
+    """
+    if len(entity) == 0:
+        return entity, start, end, np.zeros(0, dtype=np.int64)
+    persons, code = np.unique(entity, return_inverse=True)
+    code = code.astype(np.int64)
+    keys = code * _KEY_STRIDE + start + _DAY_OFFSET
+    # Latest end among the person's periods up to each one, to stop walking back early
+    max_end = pd.Series(end).groupby(code).cummax().values
+
+    # Elementary pieces between consecutive distinct start/end days of each person
+    b_code = np.concatenate([code, code])
+    b_day = np.concatenate([start, end])
+    order = np.lexsort((b_day, b_code))
+    b_code, b_day = b_code[order], b_day[order]
+    distinct = np.append(True, (b_code[1:] != b_code[:-1]) | (b_day[1:] != b_day[:-1]))
+    b_code, b_day = b_code[distinct], b_day[distinct]
+    pair = b_code[1:] == b_code[:-1]
+    p_code, p_start, p_end = b_code[:-1][pair], b_day[:-1][pair], b_day[1:][pair]
+
+    # Walk back from the last period starting on or before each piece to the first one still running
+    row = np.full(len(p_code), -1, dtype=np.int64)
+    first = np.searchsorted(keys, p_code * _KEY_STRIDE, side='left')
+    idx = np.searchsorted(keys, p_code * _KEY_STRIDE + p_start + _DAY_OFFSET, side='right') - 1
+    todo = np.flatnonzero(idx >= first)
+    while len(todo):
+        covers = end[idx[todo]] > p_start[todo]
+        row[todo[covers]] = idx[todo[covers]]
+        todo = todo[~covers]
+        idx[todo] -= 1
+        todo = todo[idx[todo] >= first[todo]]
+        todo = todo[max_end[idx[todo]] > p_start[todo]]
+
+    # Drop gaps and merge adjacent pieces of the same period
+    keep = row >= 0
+    p_code, p_start, p_end, row = p_code[keep], p_start[keep], p_end[keep], row[keep]
+    starts = np.flatnonzero(np.append(True, (row[1:] != row[:-1]) | (p_start[1:] != p_end[:-1])))
+    ends = np.append(starts[1:], len(row)) - 1
+    return persons[p_code[starts]], p_start[starts], p_end[ends], row[starts]
+
+class ResidenceTimeline:
+    """
+    LOCATION_HISTORY periods sorted by person, each with the FIPS of both vintages.
+
+    A missing end_date is an open-ended (current) residence. When periods of one person
+    overlap, each day counts for the latest-starting period that covers it, so the days of
+    an outer period before and after a nested one are both kept.
+    """
+
+    def __init__(self, history, location_fips):
+        history = history[HISTORY_COLUMNS].copy()
+        history['entity_id'] = pd.to_numeric(history['entity_id'], errors='coerce')
+        history['start_date'] = parse_dates(history['start_date'])
+        history['end_date'] = parse_dates(history['end_date'])
+        history = history.dropna(subset=['entity_id', 'start_date']).sort_values(['entity_id', 'start_date'], kind='stable')
+        entity = history['entity_id'].astype(np.int64).values
+        start = _days(history['start_date'])
+        # Inclusive end date -> exclusive end day; open periods run to the end of the data
+        end = np.where(history['end_date'].isna().values, np.iinfo(np.int32).max, _days(history['end_date'].fillna(history['start_date'])) + 1)
+        self.entity, self.start, self.end, rows = _visible_pieces(entity, start, end)
+
+        vintages = {}
+        for vintage in (2010, 2020):
+            part = location_fips[location_fips['fips_vintage'].astype(int) == vintage]
+            by_location = pd.Series(_fips_int(part['fips']), index=pd.to_numeric(part['location_id'], errors='coerce').values)
+            by_location = by_location[~by_location.index.duplicated()]
+            vintages[vintage] = by_location.reindex(pd.to_numeric(history['location_id'], errors='coerce').values).fillna(-1).astype(np.int64).values
+        # A location linked for one vintage only gets that FIPS for the other vintage's years too
+        self.fips_2010 = np.where(vintages[2010] >= 0, vintages[2010], vintages[2020])[rows]
+        self.fips_2020 = np.where(vintages[2020] >= 0, vintages[2020], vintages[2010])[rows]
+        logger.info(f"Residence timeline: {len(history)} periods in {len(self.entity)} non-overlapping pieces, "
+                    f"{np.count_nonzero(self.fips_2010 >= 0)} with a FIPS")
+
+    def segments(self, persons, lo, hi):
+        """
+        Residence segments of `persons` (sorted unique ids) within [lo, hi), split at 1 January.
+
+        Returns:
+        dict of arrays: code (index into persons), start, end (exclusive days), year, fips
+        """
+        left = np.searchsorted(self.entity, persons, side='left')
+        counts = np.searchsorted(self.entity, persons, side='right') - left
+        rows = np.repeat(left - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        code = np.repeat(np.arange(len(persons)), counts)
+        # Pieces of a person never overlap (see _visible_pieces)
+        start, end = np.maximum(self.start[rows], lo), np.minimum(self.end[rows], hi)
+        keep = end > start
+        code, start, end, rows = code[keep], start[keep], end[keep], rows[keep]
+
+        # One segment per calendar year of each period
+        first_year, last_year = _year_of(start), _year_of(end - 1)
+        pieces = last_year - first_year + 1
+        repeat = np.repeat(np.arange(len(start)), pieces)
+        year = first_year[repeat] + np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        seg_start = np.maximum(start[repeat], _january_first(year))
+        seg_end = np.minimum(end[repeat], _january_first(year + 1))
+        fips = np.where(year < 2020, self.fips_2010[rows[repeat]], self.fips_2020[rows[repeat]])
+        return {'code': code[repeat], 'start': seg_start, 'end': seg_end, 'year': year, 'fips': fips}
+
+def window_exposures(anchors, timeline, table, windows):
+    """
+    Time-weighted exposure of each anchor over each window before it.
+
+    Parameters:
+    anchors (pandas.DataFrame): person_id and visit_start_date (other columns are kept)
+    timeline (ResidenceTimeline): Residence periods with FIPS
+    table (VariableTable): Yearly variables
+    windows (list of int): Window lengths in years; window W covers [anchor - W years, anchor)
+
+    Returns:
+    pandas.DataFrame: the anchors plus <variable>_<W>y (mean over the days with a known value)
+        and coverage_<W>y (share of the window spent at a residence with a known FIPS)
+    """
+    person = pd.to_numeric(anchors['person_id'], errors='coerce')
+    anchor_dates = parse_dates(anchors['visit_start_date'])
+    valid = (person.notna() & anchor_dates.notna()).values
+    result = anchors.copy()
+    for w in windows:
+        for variable in table.variables:
+            result[f'{variable}_{w}y'] = np.nan
+        result[f'coverage_{w}y'] = np.nan
+    if not valid.any():
+        return result
+
+    person = person[valid].astype(np.int64).values
+    anchor_dates = anchor_dates[valid]
+    bounds = {w: _days(anchor_dates - pd.DateOffset(years=w)) for w in windows}
+    anchor_days = _days(anchor_dates)
+    persons = np.unique(person)
+    code = np.searchsorted(persons, person)
+    seg = timeline.segments(persons, min(b.min() for b in bounds.values()), anchor_days.max())
+
+    # Per-day rates of every segment: variable values (0 when unknown), days with a value, days with a FIPS
+    values = table.lookup(seg['fips'], seg['year'])
+    known = ~np.isnan(values)
+    rates = np.hstack([np.where(known, values, 0.0), known.astype(np.float64), (seg['fips'] >= 0).astype(np.float64)[:, None]])
+    seg_keys = seg['code'] * _KEY_STRIDE + seg['start'] + _DAY_OFFSET
+    prefix = np.vstack([np.zeros((1, rates.shape[1])), np.cumsum(rates * (seg['end'] - seg['start'])[:, None], axis=0)])
+
+    def integral(days):
+        # Sum over the person's segments starting at or before `days`, minus the part of the last one after it
+        pos = np.searchsorted(seg_keys, code * _KEY_STRIDE + days + _DAY_OFFSET, side='right')
+        total = prefix[pos]
+        last = np.maximum(pos - 1, 0)
+        cut = (pos > 0) & (seg['code'][last] == code) & (seg['end'][last] > days) if len(seg_keys) else np.zeros(len(days), dtype=bool)
+        if cut.any():
+            total[cut] -= rates[last[cut]] * (seg['end'][last[cut]] - days[cut])[:, None]
+        return total
+
+    at_anchor = integral(anchor_days)
+    k = len(table.variables)
+    for w in windows:
+        sums = at_anchor - integral(bounds[w])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums[:, :k] / sums[:, k:2 * k]
+        for j, variable in enumerate(table.variables):
+            result.loc[valid, f'{variable}_{w}y'] = means[:, j]
+        result.loc[valid, f'coverage_{w}y'] = sums[:, 2 * k] / (anchor_days - bounds[w])
+    return result
+
+def run(anchor_path, history_path, fips_paths, variables_path, windows, output_path, variables=None, chunksize=1000000):
+    """
+    Stream the anchors in chunks and write their window exposures.
+
+    Returns:
+    int: Anchors written
+    """
+    table = VariableTable(ingest.read_table(variables_path, text_columns=FIPS_COLUMNS), variables)
+    timeline = ResidenceTimeline(ingest.read_table(history_path, HISTORY_COLUMNS, text_columns=['start_date', 'end_date']), load_location_fips(fips_paths))
+    written = 0
+    for chunk in ingest.iter_batches(anchor_path, ANCHOR_COLUMNS, text_columns=['visit_start_date'], rows=chunksize):
+        window_exposures(chunk, timeline, table, windows).to_csv(part_path(output_path), mode='w' if written == 0 else 'a', header=written == 0, index=False)
+        written += len(chunk)
+        logger.info(f"Exposure windows computed for {written} anchors")
+    if written == 0:
+        window_exposures(pd.DataFrame(columns=ANCHOR_COLUMNS), timeline, table, windows).to_csv(part_path(output_path), index=False)
+    commit_part(output_path)
+    logger.info(f"Written: {output_path}")
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description='Time-weighted exposures over residential history windows before each visit')
+    parser.add_argument('--anchors', required=True, help='VISIT_OCCURRENCE (person_id, visit_occurrence_id, visit_start_date); CSV(.gz/.zst) or Parquet')
+    parser.add_argument('--history', required=True, help='LOCATION_HISTORY (location_id, entity_id, start_date, end_date)')
+    parser.add_argument('--fips', nargs='+', required=True, help='Linkage results: *_with_fips.csv files, result ZIPs, folders, or a location_id/fips_vintage/fips table')
+    parser.add_argument('--variables', required=True, help='Yearly variables by FIPS: a fips (or geoid) column, a year column and the variables')
+    parser.add_argument('--use', nargs='+', default=None, help='Variables to compute (default: every numeric column)')
+    parser.add_argument('--windows', nargs='+', type=int, default=[1, 5, 10], help='Window lengths in years before each anchor (default: 1 5 10)')
+    parser.add_argument('--output', required=True, help='CSV to write')
+    parser.add_argument('--chunk-rows', type=int, default=1000000, help='Anchors processed per chunk (default 1000000)')
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, format="{time} {level} {message}", level="INFO")
+    try:
+        run(args.anchors, args.history, args.fips, args.variables, args.windows, args.output, args.use, args.chunk_rows)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
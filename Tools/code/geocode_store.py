@@ -0,0 +1,271 @@
+import os
+import shutil
+import sqlite3
+import threading
+from loguru import logger
+from runtime import lazy_import
+from run_ledger import write_csv_atomic
+import address_union
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# -------------------------------------------------------------------
+# Threshold-independent geocode storage.
+# The geocoder backends are called once per address with a score threshold
+# of 0, so every candidate comes back with its coordinates, score and
+# precision. The candidates are kept by normalized address key in a store
+# folder; the run's score threshold and accepted precisions are applied
+# afterwards as a vectorized filter, with the geocoder's own semantics
+# (coordinates only for precise matches at or above the threshold).
+# Census results are kept in the same folder by coordinates and vintage.
+# A later run against the same store with another --score-threshold sends
+# no address to the geocoder; rows whose status does not change keep their
+# coordinates and find their FIPS in the store, so only rows that become
+# geocoded reach the FIPS backend.
+#   <store>/store.sqlite - candidates by address key, census results by point
+#                          key and year; both tables are indexed on their key,
+#                          each batch inserts only its own rows and lookups
+#                          read only the keys of the batch
+# Stores written as candidates.csv / census.csv are imported once.
+# A store may be shared by runs made one after another (not concurrently).
+# Without --geocode-store the scripts use a store inside the run's output and
+# delete it when the run completes, as they do with other intermediates.
+# -------------------------------------------------------------------
+
+STORE_FILE = 'store.sqlite'
+
+# Files of stores written before store.sqlite, imported when it is created
+CANDIDATES_FILE = 'candidates.csv'
+CENSUS_FILE = 'census.csv'
+
+# Threshold the backends are called with, so no candidate is dropped
+RAW_THRESHOLD = 0
+
+# Precisions (DeGAUSS naming) that can count as geocoded
+PRECISIONS = ['range', 'street']
+
+# Geocoder output columns kept per address
+RESULT_COLUMNS = ['matched_street', 'matched_zip', 'matched_city', 'matched_state', 'lat', 'lon', 'score', 'precision', 'geocode_result']
+NUMERIC_COLUMNS = ['lat', 'lon', 'score']
+
+# Key columns added to frames sent through the store
+ADDRESS_KEY = '_store_address_key'
+POINT_KEY = '_store_point_key'
+
+# Coordinates are matched to 6 decimals (about 0.1 m)
+POINT_DECIMALS = 6
+
+def point_key(lat, lon):
+    """Key of rounded coordinates ('29.646310,-82.415280'); NaN where either is missing."""
+    lat = pd.to_numeric(lat, errors='coerce').round(POINT_DECIMALS)
+    lon = pd.to_numeric(lon, errors='coerce').round(POINT_DECIMALS)
+    key = lat.map(f'{{:.{POINT_DECIMALS}f}}'.format) + ',' + lon.map(f'{{:.{POINT_DECIMALS}f}}'.format)
+    return key.where(lat.notna() & lon.notna())
+
+def apply_policy(candidates, threshold, precisions=PRECISIONS):
+    """
+    Geocoder output for a score threshold, from candidates geocoded at RAW_THRESHOLD.
+
+    Rows keep their coordinates and become 'geocoded' only with a precision in `precisions`
+    and a score at or above `threshold`; other candidates become 'imprecise_geocode' without
+    coordinates. Results without a candidate (e.g. 'po_box') are left as they are.
+
+    Parameters:
+    candidates (pandas.DataFrame): Rows with RESULT_COLUMNS
+    threshold (float): Score threshold
+    precisions (list of str): Accepted precisions
+
+    Returns:
+    pandas.DataFrame: A copy of `candidates` with lat, lon and geocode_result set
+    """
+    output = candidates.copy()
+    lat = pd.to_numeric(output['lat'], errors='coerce')
+    lon = pd.to_numeric(output['lon'], errors='coerce')
+    score = pd.to_numeric(output['score'], errors='coerce')
+    accepted = lat.notna() & lon.notna() & (score >= threshold) & output['precision'].isin(precisions)
+    raw = output['geocode_result'].astype(object)
+    candidate = raw.isin(['geocoded', 'imprecise_geocode']) | (lat.notna() & lon.notna())
+    output['geocode_result'] = np.where(accepted, 'geocoded', np.where(candidate, 'imprecise_geocode', raw))
+    output['lat'] = lat.where(accepted)
+    output['lon'] = lon.where(accepted)
+    return output
+
+class GeocodeStore:
+    """
+    Geocoder candidates by address key and census results by point, kept in `folder`/store.sqlite.
+
+    Parameters:
+    folder (str): Store folder (created if missing); an existing store is opened
+    precisions (list of str): Precisions accepted as geocoded (see apply_policy)
+    """
+
+    def __init__(self, folder, precisions=PRECISIONS):
+        self.folder = folder
+        self.precisions = list(precisions)
+        os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        path = os.path.join(folder, STORE_FILE)
+        created = not os.path.exists(path)
+        # One connection shared by the worker threads; every use holds the lock
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        result_columns = ', '.join(f"{c} {'REAL' if c in NUMERIC_COLUMNS else 'TEXT'}" for c in RESULT_COLUMNS)
+        self._con.execute(f"CREATE TABLE IF NOT EXISTS candidates ({ADDRESS_KEY} TEXT PRIMARY KEY, {result_columns})")
+        self._con.execute(f"""CREATE TABLE IF NOT EXISTS census ({POINT_KEY} TEXT, year INTEGER, census_block_group_id TEXT,
+                              census_tract_id TEXT, PRIMARY KEY ({POINT_KEY}, year))""")
+        self._con.execute("CREATE TEMP TABLE query_keys (key TEXT PRIMARY KEY)")
+        if created:
+            self._import_csv()
+        self.geocoded = self.census_calls = self.census_reused = 0
+        addresses, points = self.counts()
+        logger.info(f"Geocode store {folder}: {addresses} addresses, {points} points")
+
+    def _import_csv(self):
+        # Stores written before store.sqlite; an interrupted append can leave a broken last line, later rows for a key win
+        for name, table, columns in [(CANDIDATES_FILE, 'candidates', [ADDRESS_KEY] + RESULT_COLUMNS),
+                                     (CENSUS_FILE, 'census', [POINT_KEY, 'year', 'census_block_group_id', 'census_tract_id'])]:
+            path = os.path.join(self.folder, name)
+            if os.path.exists(path):
+                frame = pd.read_csv(path, dtype={c: str for c in columns if c not in NUMERIC_COLUMNS + ['year']}, on_bad_lines='skip')
+                frame = frame.reindex(columns=columns)
+                frame[columns[0]] = frame[columns[0]].fillna('')  # the key of a blank address is ''
+                self._insert(table, frame)
+                logger.info(f"Imported {len(frame)} rows of {path} into {STORE_FILE}")
+
+    def _insert(self, table, rows):
+        # Called with the lock held (or from __init__); replaces the rows of keys already stored
+        rows = rows.astype(object).where(rows.notna(), None)
+        with self._con:
+            self._con.executemany(f"INSERT OR REPLACE INTO {table} ({', '.join(rows.columns)}) VALUES ({', '.join('?' * len(rows.columns))})",
+                                  rows.itertuples(index=False, name=None))
+
+    def _select(self, table, key_column, keys, where='', params=()):
+        # Called with the lock held: rows of `table` whose key is one of `keys`
+        self._con.execute("DELETE FROM query_keys")
+        self._con.executemany("INSERT OR IGNORE INTO query_keys VALUES (?)", ((key,) for key in keys.dropna().unique()))
+        return pd.read_sql_query(f"SELECT t.* FROM {table} t JOIN query_keys q ON t.{key_column} = q.key {where}", self._con, params=params)
+
+    def geocoder(self, backend):
+        return StoredGeocoder(backend, self)
+
+    def census_backend(self, backend):
+        return StoredCensus(backend, self)
+
+    def counts(self):
+        """Number of stored addresses and (point, year) pairs."""
+        with self._lock:
+            return tuple(self._con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ('candidates', 'census'))
+
+    def add_candidates(self, geocoded):
+        rows = geocoded.reindex(columns=[ADDRESS_KEY] + RESULT_COLUMNS)
+        rows[ADDRESS_KEY] = rows[ADDRESS_KEY].fillna('')  # read back as NaN for a blank address
+        rows = rows.drop_duplicates(ADDRESS_KEY, keep='last')
+        with self._lock:
+            self._insert('candidates', rows)
+
+    def add_census(self, rows):
+        with self._lock:
+            self._insert('census', rows.drop_duplicates([POINT_KEY, 'year'], keep='last')[[POINT_KEY, 'year', 'census_block_group_id', 'census_tract_id']])
+
+    def candidates_for(self, keys):
+        """Stored candidates (ADDRESS_KEY + RESULT_COLUMNS) of the address keys in `keys`."""
+        with self._lock:
+            return self._select('candidates', ADDRESS_KEY, keys)
+
+    def census_for(self, keys, year):
+        """Stored census rows (POINT_KEY, year, census_block_group_id, census_tract_id) of the point keys in `keys`."""
+        with self._lock:
+            return self._select('census', POINT_KEY, keys, 'WHERE t.year = ?', (int(year),))
+
+    def known_addresses(self, keys):
+        return keys.isin(self.candidates_for(keys)[ADDRESS_KEY])
+
+    def report(self):
+        logger.info(f"Geocode store: {self.geocoded} new addresses geocoded, {self.census_calls} points sent to the FIPS backend, "
+                    f"{self.census_reused} point lookups answered from {self.folder}")
+
+    def remove(self):
+        """Close the store and delete its folder (the raw addresses and candidates it holds are PHI)."""
+        with self._lock:
+            self._con.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+        logger.info(f"Deleted the run's geocode store {self.folder}")
+
+class StoredGeocoder:
+    """A geocoder backend whose results go through a GeocodeStore; same call shape as the backends."""
+
+    def __init__(self, backend, store):
+        self.backend = backend
+        self.store = store
+        self.name = backend.name
+
+    def geocode(self, df, threshold, output_folder, output_file):
+        """
+        Write the geocoder output of `df` for `threshold`, geocoding only addresses not in the store.
+
+        Rows whose new address failed in the backend (quarantined) are left out, as by the backend.
+
+        Returns:
+        tuple: (output_file, number of quarantined rows)
+        """
+        keys = address_union.address_key(df['address'])
+        new = ~self.store.known_addresses(keys)
+        quarantined = 0
+        if new.any():
+            # The caller's columns go along, so quarantined rows keep them (e.g. address_union's key)
+            todo = df.loc[new].assign(**{ADDRESS_KEY: keys[new]}).drop_duplicates(ADDRESS_KEY)
+            raw_file = os.path.join(output_folder, 'store_geocoder_raw.csv')
+            _, quarantined = self.backend.geocode(todo, RAW_THRESHOLD, output_folder, raw_file)
+            self.store.add_candidates(pd.read_csv(raw_file, dtype={c: str for c in [ADDRESS_KEY] + RESULT_COLUMNS if c not in NUMERIC_COLUMNS}))
+            os.remove(raw_file)
+            self.store.geocoded += len(todo) - quarantined
+            logger.info(f"Geocoded {len(todo)} new addresses at threshold {RAW_THRESHOLD} into the geocode store")
+        candidates = self.store.candidates_for(keys)
+        rows = df.drop(columns=[c for c in RESULT_COLUMNS if c in df.columns]).assign(**{ADDRESS_KEY: keys})
+        output = rows.merge(apply_policy(candidates, threshold, self.store.precisions), on=ADDRESS_KEY, how='inner')
+        write_csv_atomic(output.drop(columns=[ADDRESS_KEY]), output_file)
+        logger.info(f"{len(output)} of {len(df)} rows at score threshold {threshold}: {int((output['geocode_result'] == 'geocoded').sum())} geocoded")
+        return output_file, quarantined
+
+class StoredCensus:
+    """A FIPS backend whose results go through a GeocodeStore; same call shape as the backends."""
+
+    def __init__(self, backend, store):
+        self.backend = backend
+        self.store = store
+        self.name = backend.name
+
+    def census(self, df, year, output_folder, output_file):
+        """
+        Write `df` with census_block_group_id_<year> / census_tract_id_<year>, sending only points
+        not in the store to the backend. Rows without coordinates get empty ids; rows whose new
+        point failed in the backend (quarantined) are left out, as by the backend.
+
+        Returns:
+        tuple: (output_file, number of quarantined rows)
+        """
+        keys = point_key(df['lat'], df['lon'])
+        known = self.store.census_for(keys, year)
+        new = keys.notna() & ~keys.isin(known[POINT_KEY])
+        quarantined = 0
+        if new.any():
+            todo = df.loc[new, ['lat', 'lon']].assign(**{POINT_KEY: keys[new]}).drop_duplicates(POINT_KEY)
+            raw_file = os.path.join(output_folder, f'store_census_raw_{year}.csv')
+            _, quarantined = self.backend.census(todo, year, output_folder, raw_file)
+            found = pd.read_csv(raw_file, dtype=str)
+            os.remove(raw_file)
+            found = found.rename(columns={f'census_block_group_id_{year}': 'census_block_group_id', f'census_tract_id_{year}': 'census_tract_id'})
+            self.store.add_census(found.reindex(columns=[POINT_KEY, 'census_block_group_id', 'census_tract_id']).assign(year=year))
+            self.store.census_calls += len(todo) - quarantined
+            known = self.store.census_for(keys, year)
+        self.store.census_reused += int((keys.notna() & ~new).sum())
+
+        lookup = known.drop_duplicates(POINT_KEY).set_index(POINT_KEY)
+        output = df.assign(**{
+            f'census_block_group_id_{year}': keys.map(lookup['census_block_group_id']),
+            f'census_tract_id_{year}': keys.map(lookup['census_tract_id']),
+        })
+        # Points that failed in the backend are missing from the store
+        output = output[keys.isna() | keys.isin(lookup.index)]
+        write_csv_atomic(output, output_file)
+        return output_file, quarantined
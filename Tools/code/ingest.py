@@ -0,0 +1,189 @@
+import os
+from loguru import logger
+from runtime import lazy_import
+
+pa = lazy_import('pyarrow')
+pd = lazy_import('pandas')
+
+# -------------------------------------------------------------------
+# Input layer shared by both tools.
+# The header of every input is read once (TableSchema) and used both to
+# validate required columns and to choose what to load. Reads go through the
+# multithreaded pyarrow CSV reader with column projection, so only the columns
+# a stage needs are parsed. gzip / zstd compressed CSV and Parquet inputs are
+# accepted wherever a plain CSV is.
+# -------------------------------------------------------------------
+
+# Longest first, so 'x.csv.gz' is not mistaken for 'x.csv'
+INPUT_EXTENSIONS = ['.csv.gz', '.csv.zst', '.parquet', '.csv']
+
+# Columns read for the OMOP tables the tools understand
+LOCATION_COLUMNS = ['location_id', 'address_1', 'address_2', 'city', 'state', 'zip', 'county', 'location_source_value', 'country_concept_id', 'country_source_value', 'latitude', 'longitude']
+LOCATION_HISTORY_COLUMNS = ['location_id', 'relationship_type_concept_id', 'domain_id', 'entity_id', 'start_date', 'end_date']
+
+def input_extension(filename):
+    """Supported extension of `filename`, or None if it is not an input file."""
+    lower = filename.lower()
+    for extension in INPUT_EXTENSIONS:
+        if lower.endswith(extension):
+            return extension
+    return None
+
+def is_input_file(filename):
+    return input_extension(filename) is not None
+
+def input_stem(filename):
+    """File name without its input extension ('VISIT_OCCURRENCE.csv.gz' -> 'VISIT_OCCURRENCE')."""
+    extension = input_extension(filename)
+    return filename[:-len(extension)] if extension else os.path.splitext(filename)[0]
+
+def find_input(folder, stem):
+    """Path of the input named `stem` (any supported extension, case-insensitive) in `folder`, or None."""
+    if not os.path.isdir(folder):
+        return None
+    for name in sorted(os.listdir(folder)):
+        if is_input_file(name) and input_stem(name).lower() == stem.lower():
+            return os.path.join(folder, name)
+    return None
+
+def _csv_stream(path):
+    return pa.input_stream(path, compression='detect')
+
+class TableSchema:
+    """
+    Column names of an input file, read once from its header (or Parquet footer).
+
+    Lookups are case-insensitive and ignore surrounding whitespace, as in the rest of the tools.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if path.lower().endswith('.parquet'):
+            import pyarrow.parquet as pq
+            self.columns = list(pq.read_schema(path).names)
+        else:
+            import pyarrow.csv as pa_csv
+            with _csv_stream(path) as stream:
+                self.columns = list(pa_csv.open_csv(stream).schema.names)
+        self._by_name = {col.lower().strip(): col for col in self.columns}
+
+    @property
+    def names(self):
+        """Normalized (lower-case, stripped) column names."""
+        return list(self._by_name)
+
+    def __contains__(self, name):
+        return name.lower().strip() in self._by_name
+
+    def has_all(self, names):
+        return all(name in self for name in names)
+
+    def missing(self, names):
+        return [name for name in names if name not in self]
+
+    def resolve(self, names):
+        """Original header names for the normalized `names` that exist in the file."""
+        return [self._by_name[n.lower().strip()] for n in names if n in self]
+
+    def location_option(self):
+        """
+        Linkage option for a generic input file:
+        3 = latitude/longitude, 2 = single address column, 1 = street/city/state/zip, None = no location columns.
+        """
+        if 'latitude' in self and 'longitude' in self:
+            return 3
+        if 'address' in self:
+            return 2
+        if self.has_all(['street', 'city', 'state', 'zip']):
+            return 1
+        return None
+
+def _normalize(df):
+    df.rename(columns={col: col.lower().strip() for col in df.columns}, inplace=True)
+    return df
+
+def read_table(path, columns=None, text_columns=(), schema=None):
+    """
+    Read an input file into a pandas DataFrame with lower-case column names.
+
+    Parameters:
+    path (str): CSV, CSV.gz, CSV.zst or Parquet file
+    columns (list of str, optional): Normalized names of the columns to read (all when omitted);
+                                     names absent from the file are ignored
+    text_columns (iterable of str): Normalized names kept as text (e.g. ZIP codes, dates)
+    schema (TableSchema, optional): Header already read for this file
+
+    Returns:
+    pandas.DataFrame
+    """
+    schema = schema or TableSchema(path)
+    include = schema.resolve(columns) if columns is not None else None
+    text = schema.resolve(text_columns)
+    if include == []:
+        return pd.DataFrame()
+    if path.lower().endswith('.parquet'):
+        df = pd.read_parquet(path, columns=include)
+        for col in text:
+            if col in df.columns:
+                df[col] = df[col].astype('string').astype(object)
+        return _normalize(df)
+
+    import pyarrow.csv as pa_csv
+    convert = pa_csv.ConvertOptions(include_columns=include, column_types={col: pa.string() for col in text}, strings_can_be_null=True)
+    try:
+        with _csv_stream(path) as stream:
+            table = pa_csv.read_csv(stream, convert_options=convert)
+        return _normalize(table.to_pandas())
+    except pa.ArrowInvalid as e:
+        # Columns whose type changes past the first block (e.g. '12' then 'A3'): let pandas sort it out
+        logger.debug(f"pyarrow could not parse {path} ({e}); falling back to pandas")
+        df = pd.read_csv(path, usecols=include, dtype={col: str for col in text}, low_memory=False)
+        return _normalize(df)
+
+def iter_batches(path, columns=None, text_columns=(), rows=1000000, schema=None):
+    """
+    Stream an input file as pandas DataFrames of roughly `rows` rows, reading only `columns`.
+
+    Text columns are kept as strings; every other projected column is converted to a number
+    when all of its values in the chunk are numeric.
+    """
+    schema = schema or TableSchema(path)
+    include = schema.resolve(columns) if columns is not None else None
+    text = schema.resolve(text_columns)
+    if path.lower().endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=rows, columns=include):
+            df = _normalize(batch.to_pandas())
+            for col in text:
+                key = col.lower().strip()
+                df[key] = df[key].astype('string').astype(object)
+            yield df
+        return
+
+    # Every projected column is streamed as text and typed per chunk, so a type change
+    # between CSV blocks never aborts a long stream
+    import pyarrow.csv as pa_csv
+    names = include if include is not None else schema.columns
+    convert = pa_csv.ConvertOptions(include_columns=include, column_types={col: pa.string() for col in names}, strings_can_be_null=True)
+    pending, pending_rows = [], 0
+    with _csv_stream(path) as stream:
+        for batch in pa_csv.open_csv(stream, convert_options=convert):
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            if pending_rows >= rows:
+                yield _typed(pa.Table.from_batches(pending).to_pandas(), text)
+                pending, pending_rows = [], 0
+    if pending:
+        yield _typed(pa.Table.from_batches(pending).to_pandas(), text)
+
+def _typed(df, text):
+    """Convert text columns that are entirely numeric (like pandas would), except `text` columns."""
+    keep = {col.lower().strip() for col in text}
+    df = _normalize(df)
+    for col in df.columns:
+        if col in keep:
+            continue
+        converted = pd.to_numeric(df[col], errors='coerce')
+        if converted.notna().sum() == df[col].notna().sum():
+            df[col] = converted
+    return df
@@ -0,0 +1,167 @@
+from loguru import logger
+from runtime import lazy_import
+from run_ledger import part_path, commit_part
+from ingest import iter_batches
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# -------------------------------------------------------------------
+# Visit <-> residence interval join for file-based OMOP inputs.
+# Mirrors the SQL used in OMOP mode:
+#   visit_start_date BETWEEN start_date AND end_date
+#   AND visit_end_date BETWEEN start_date AND end_date
+# LOCATION_HISTORY is sorted once by (entity_id, start_date) into a composite
+# int64 key; every visit finds the person's periods starting on or before it
+# with one binary search (np.searchsorted) against that key and walks back
+# from there, stopping as soon as the running max of end dates shows that no
+# earlier period can cover it. The join never builds the cartesian
+# visits x periods product. Visits are streamed in chunks, so VISIT_OCCURRENCE
+# files of any size can be joined with memory bounded by the chunk size.
+# -------------------------------------------------------------------
+
+VISIT_COLUMNS = ['visit_occurrence_id', 'person_id', 'visit_start_date', 'visit_end_date']
+HISTORY_COLUMNS = ['location_id', 'entity_id', 'start_date', 'end_date']
+
+# Composite key = entity_code * _KEY_STRIDE + (days since 1970 + _DAY_OFFSET)
+_DAY_OFFSET = 2 ** 21
+_KEY_STRIDE = 2 ** 22
+_OPEN_END = 2 ** 63 - 1
+
+def parse_dates(values):
+    """
+    Parse ISO (2013-12-16, 2013-12-16 08:00:00) and US (12/16/2013) dates, vectorized.
+
+    Returns:
+    pandas.Series of datetime64 (NaT where unparseable)
+    """
+    text = values.astype('string').str.strip()
+    parsed = pd.to_datetime(text, format='ISO8601', errors='coerce')
+    retry = parsed.isna() & text.notna()
+    if retry.any():
+        us = text[retry].str.split(' ').str[0]
+        parsed[retry] = pd.to_datetime(us, format='%m/%d/%Y', errors='coerce')
+    return parsed
+
+def _to_days(dates):
+    return dates.values.astype('datetime64[D]').astype(np.int64)
+
+class ResidenceIndex:
+    """
+    LOCATION_HISTORY periods sorted by (entity_id, start_date) for binary-search lookups.
+
+    A missing end_date is treated as an open-ended (current) residence. When periods of one
+    person overlap or nest, a visit is matched to every period that covers it, as the SQL
+    join does.
+    """
+
+    def __init__(self, history):
+        history = history[HISTORY_COLUMNS].copy()
+        history['start_date'] = parse_dates(history['start_date'])
+        history['end_date'] = parse_dates(history['end_date'])
+        history = history.dropna(subset=['entity_id', 'start_date'])
+
+        self.entities = pd.Index(history['entity_id'].unique())
+        codes = self.entities.get_indexer(history['entity_id']).astype(np.int64)
+        keys = codes * _KEY_STRIDE + _to_days(history['start_date']) + _DAY_OFFSET
+        order = np.argsort(keys, kind='stable')
+
+        self.keys = keys[order]
+        self.codes = codes[order]
+        end_days = np.where(history['end_date'].isna().values, _OPEN_END, _to_days(history['end_date'].fillna(history['start_date'])) + _DAY_OFFSET)
+        self.start_days = (keys - codes * _KEY_STRIDE)[order]
+        self.end_days = end_days[order]
+        # Latest end date of the entity's periods up to and including this one
+        self.max_end_days = pd.Series(self.end_days).groupby(self.codes).cummax().values
+        self.location_ids = history['location_id'].values[order]
+        logger.info(f"Indexed {len(self.keys)} residence periods for {len(self.entities)} entities")
+
+    def match(self, person_ids, start_dates, end_dates):
+        """
+        Find the residence periods covering each visit.
+
+        Returns:
+        tuple: (position of the visit, location_id) per match, ordered by visit and then by
+               period start; a visit covered by several periods appears once per period
+        """
+        codes = self.entities.get_indexer(person_ids).astype(np.int64)
+        start_days = _to_days(start_dates) + _DAY_OFFSET
+        end_days = np.where(end_dates.isna().values, start_days, _to_days(end_dates.fillna(start_dates)) + _DAY_OFFSET)
+        valid = (codes >= 0) & start_dates.notna().values
+        if len(self.keys) == 0 or not valid.any():
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=object)
+
+        # Candidate periods of visit v: the entity's periods in [first[v], idx[v]]
+        visits = np.flatnonzero(valid)
+        codes, start_days, end_days = codes[visits], start_days[visits], end_days[visits]
+        first = np.searchsorted(self.keys, codes * _KEY_STRIDE, side='left')
+        idx = np.searchsorted(self.keys, codes * _KEY_STRIDE + start_days, side='right') - 1
+
+        found_visits, found_periods = [], []
+        active = idx >= first
+        while active.any():
+            visits, codes, start_days, end_days, first, idx = (a[active] for a in (visits, codes, start_days, end_days, first, idx))
+            covers = (start_days <= self.end_days[idx]) & (end_days <= self.end_days[idx]) & (end_days >= self.start_days[idx])
+            found_visits.append(visits[covers])
+            found_periods.append(idx[covers])
+            # Step back while an earlier period of the person may still reach the visit's end
+            idx = idx - 1
+            active = idx >= first
+            active[active] = self.max_end_days[idx[active]] >= end_days[active]
+
+        found_visits = np.concatenate(found_visits) if found_visits else np.empty(0, dtype=np.int64)
+        found_periods = np.concatenate(found_periods) if found_periods else np.empty(0, dtype=np.int64)
+        order = np.lexsort((found_periods, found_visits))
+        return found_visits[order], self.location_ids[found_periods[order]]
+
+def join_visits(visits, index):
+    """
+    Attach location_id to a chunk of VISIT_OCCURRENCE rows.
+
+    Returns:
+    pandas.DataFrame: person_id, visit_occurrence_id, visit_start_date, visit_end_date, year, location_id
+                      (one row per covering residence period; visits without one are dropped)
+    """
+    start_dates = parse_dates(visits['visit_start_date'])
+    end_dates = parse_dates(visits['visit_end_date'])
+    rows, location_ids = index.match(visits['person_id'], start_dates, end_dates)
+    result = pd.DataFrame({
+        'person_id': visits['person_id'].values[rows],
+        'visit_occurrence_id': visits['visit_occurrence_id'].values[rows],
+        'visit_start_date': start_dates.values[rows],
+        'visit_end_date': end_dates.values[rows],
+        'location_id': location_ids,
+    })
+    result['year'] = result['visit_start_date'].dt.year
+    result['visit_start_date'] = result['visit_start_date'].dt.date
+    result['visit_end_date'] = result['visit_end_date'].dt.date
+    return result[['person_id', 'visit_occurrence_id', 'visit_start_date', 'visit_end_date', 'year', 'location_id']]
+
+def join_visit_file(visit_path, history, output_path, chunksize=1000000):
+    """
+    Stream VISIT_OCCURRENCE.csv in chunks, match each visit to its residence and write the result.
+
+    Parameters:
+    visit_path (str): VISIT_OCCURRENCE file, CSV(.gz/.zst) or Parquet (only the four linkage columns are read)
+    history (pandas.DataFrame): LOCATION_HISTORY rows (location_id, entity_id, start_date, end_date)
+    output_path (str): CSV to write
+    chunksize (int): Visits processed per chunk
+
+    Returns:
+    tuple: (visits read, visit-residence rows written)
+    """
+    index = ResidenceIndex(history)
+
+    total = matched = 0
+    first = True
+    for chunk in iter_batches(visit_path, VISIT_COLUMNS, text_columns=['visit_start_date', 'visit_end_date'], rows=chunksize):
+        joined = join_visits(chunk, index)
+        joined.to_csv(part_path(output_path), mode='w' if first else 'a', header=first, index=False)
+        first = False
+        total += len(chunk)
+        matched += len(joined)
+    if first:
+        pd.DataFrame(columns=['person_id', 'visit_occurrence_id', 'visit_start_date', 'visit_end_date', 'year', 'location_id']).to_csv(part_path(output_path), index=False)
+    commit_part(output_path)
+    logger.info(f"Wrote {matched} visit-residence rows for {total} visits")
+    return total, matched
@@ -0,0 +1,197 @@
+import os
+import shutil
+import tempfile
+from loguru import logger
+from runtime import lazy_import
+
+import Address_to_FIPS
+
+pd = lazy_import('pandas')
+
+# -------------------------------------------------------------------
+# In-process library API for address / coordinate -> FIPS linkage.
+# Notebooks and Airflow tasks can call these functions directly instead of
+# spawning the CLI and round-tripping through folders of CSV files.
+# Importing this module has no side effects: no environment variables are read,
+# no directories are created and no log handlers are attached.
+#
+#   from linkage import link_addresses, link_coordinates, geocode_addresses
+#   result = link_addresses(df)            # street/city/state/zip or address columns
+#   result = geocode_addresses(df)         # coordinates only, no FIPS
+#   result = link_coordinates(df)          # latitude/longitude columns
+#
+# DeGAUSS containers still need HOST_PWD and a working directory inside the
+# mounted workspace (the current directory by default).
+# -------------------------------------------------------------------
+
+DEFAULT_THRESHOLD = 0.7
+FIPS_VINTAGES = [2010, 2020]
+
+# Position of each input row, carried through the geocoder and the FIPS vintages
+# (no leading underscore: the geocoder post-processing drops those)
+ROW_COLUMN = 'linkage_row'
+GEOCODE_COLUMNS = ['latitude', 'longitude', 'geocode_result', 'reason']
+
+def _to_pandas(data):
+    """Accept a pandas DataFrame or a pyarrow Table; remember which one it was."""
+    if isinstance(data, pd.DataFrame):
+        return data.copy(), False
+    if hasattr(data, 'to_pandas'):
+        return data.to_pandas(), True
+    raise TypeError(f"Expected a pandas DataFrame or pyarrow Table, got {type(data).__name__}")
+
+def _from_pandas(df, as_arrow):
+    if as_arrow:
+        import pyarrow as pa
+        return pa.Table.from_pandas(df, preserve_index=False)
+    return df
+
+def _prepare(df):
+    """Lower-cased copy of the caller's rows, numbered by position."""
+    work = df.rename(columns={col: col.lower().strip() for col in df.columns}).reset_index(drop=True)
+    return work.assign(**{ROW_COLUMN: range(len(work))})
+
+def _restore(df, result, columns):
+    """
+    The caller's rows, in their order and with their index and columns, plus `columns` from `result`.
+
+    Parameters:
+    df (pandas.DataFrame): Rows as passed in by the caller
+    result (pandas.DataFrame): Backend output with ROW_COLUMN, in any order (rows may be missing)
+    columns (list of str): Result columns to attach (empty where a row has no result)
+    """
+    result = result.drop_duplicates(ROW_COLUMN).set_index(ROW_COLUMN).reindex(range(len(df)))
+    added = result.reindex(columns=columns)
+    added.index = df.index
+    return pd.concat([df.drop(columns=columns, errors='ignore'), added], axis=1)
+
+def _year_for_fips(df, year_column):
+    if year_column in df.columns:
+        years = pd.to_numeric(df[year_column], errors='coerce')
+        return years.apply(lambda x: 2010 if x < 2020 else 2020)
+    return pd.Series(2020, index=df.index)
+
+def _assign_fips(df, year_column, work_dir):
+    """Run the census container once per FIPS vintage and return the rows with a FIPS column, grouped by vintage."""
+    df = df.rename(columns={'latitude': 'lat', 'longitude': 'lon'})
+    df['year_for_fips'] = _year_for_fips(df, year_column)
+    generated = []
+    for year in FIPS_VINTAGES:
+        year_df = df[df['year_for_fips'] == year].copy()
+        if year_df.empty:
+            continue
+        year_dir = os.path.join(work_dir, str(year))
+        os.makedirs(year_dir, exist_ok=True)
+        fips_file = Address_to_FIPS.generate_fips_degauss(year_df, year, year_dir)
+        if fips_file is None:
+            raise RuntimeError(f"FIPS generation failed for vintage {year}")
+        generated.append(pd.read_csv(fips_file, dtype={'FIPS': str}))
+    if not generated:
+        return df.iloc[0:0].rename(columns={'lat': 'latitude', 'lon': 'longitude'}).drop(columns=['year_for_fips'])
+    result = pd.concat(generated, ignore_index=True)
+    result = result.drop(columns=['year_for_fips'], errors='ignore')
+    return result.rename(columns={'lat': 'latitude', 'lon': 'longitude'})
+
+class _WorkDir:
+    """Scratch directory inside the mounted workspace, removed on exit unless keep=True."""
+
+    def __init__(self, parent=None, keep=False):
+        self.parent = parent or os.getcwd()
+        self.keep = keep
+        self.path = None
+
+    def __enter__(self):
+        os.makedirs(self.parent, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix='linkage_', dir=self.parent)
+        return self.path
+
+    def __exit__(self, *exc):
+        if not self.keep:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+def _address_columns(df, columns):
+    if columns is not None:
+        return columns
+    if all(col in df.columns for col in ['street', 'city', 'state', 'zip']):
+        return ['street', 'city', 'state', 'zip']
+    if 'address' in df.columns:
+        return ['address']
+    raise ValueError("No address columns found: expected street/city/state/zip or address")
+
+def _geocode(df, columns, threshold, folder):
+    """Run the geocoder backend and return the rows with lat, lon, geocode_result and reason."""
+    geocoded_file = Address_to_FIPS.generate_coordinates_degauss(df, columns, threshold, folder)
+    geocoded = pd.read_csv(geocoded_file)
+    geocoded.drop(columns=['matched_street', 'matched_zip', 'matched_city', 'matched_state', 'score', 'precision', 'address'], inplace=True, errors='ignore')
+    return geocoded
+
+def geocode_addresses(data, columns=None, threshold=DEFAULT_THRESHOLD, work_dir=None, keep_work_dir=False):
+    """
+    Geocode addresses without assigning FIPS codes.
+
+    Parameters:
+    data (pandas.DataFrame or pyarrow.Table): Rows with either street/city/state/zip or a single address column
+    columns (list of str, optional): Address columns; detected from the data when omitted
+    threshold (float): Geocoder score threshold
+    work_dir (str, optional): Parent of the scratch directory; must be inside the HOST_PWD workspace
+    keep_work_dir (bool): Keep intermediate files for inspection
+
+    Returns:
+    Same type as `data`: the input rows (same order, index and columns) plus latitude, longitude, geocode_result and reason
+    """
+    df, as_arrow = _to_pandas(data)
+    work = _prepare(df)
+    columns = _address_columns(work, columns)
+
+    with _WorkDir(work_dir, keep_work_dir) as folder:
+        logger.info(f"Geocoding {len(df)} addresses in {folder}")
+        result = _geocode(work, columns, threshold, folder)
+    result = result.rename(columns={'lat': 'latitude', 'lon': 'longitude'})
+    return _from_pandas(_restore(df, result, GEOCODE_COLUMNS), as_arrow)
+
+def link_addresses(data, columns=None, threshold=DEFAULT_THRESHOLD, year_column='year', work_dir=None, keep_work_dir=False):
+    """
+    Geocode addresses and assign census tract FIPS codes.
+
+    Parameters:
+    data (pandas.DataFrame or pyarrow.Table): Rows with either street/city/state/zip or a single address column
+    columns (list of str, optional): Address columns; detected from the data when omitted
+    threshold (float): Geocoder score threshold
+    year_column (str): Column used to pick the 2010 or 2020 FIPS vintage (2020 when absent)
+    work_dir (str, optional): Parent of the scratch directory; must be inside the HOST_PWD workspace
+    keep_work_dir (bool): Keep intermediate files for inspection
+
+    Returns:
+    Same type as `data`: the input rows (same order, index and columns) plus latitude, longitude, geocode_result, reason and FIPS
+    """
+    df, as_arrow = _to_pandas(data)
+    work = _prepare(df)
+    columns = _address_columns(work, columns)
+
+    with _WorkDir(work_dir, keep_work_dir) as folder:
+        logger.info(f"Linking {len(df)} addresses in {folder}")
+        result = _assign_fips(_geocode(work, columns, threshold, folder), year_column, folder)
+    return _from_pandas(_restore(df, result, GEOCODE_COLUMNS + ['FIPS']), as_arrow)
+
+def link_coordinates(data, year_column='year', work_dir=None, keep_work_dir=False):
+    """
+    Assign census tract FIPS codes to latitude/longitude rows.
+
+    Parameters:
+    data (pandas.DataFrame or pyarrow.Table): Rows with latitude and longitude (or lat/lon) columns
+    year_column (str): Column used to pick the 2010 or 2020 FIPS vintage (2020 when absent)
+    work_dir (str, optional): Parent of the scratch directory; must be inside the HOST_PWD workspace
+    keep_work_dir (bool): Keep intermediate files for inspection
+
+    Returns:
+    Same type as `data`: the input rows (same order, index and columns) plus FIPS
+    """
+    df, as_arrow = _to_pandas(data)
+    work = _prepare(df)
+    if not ({'latitude', 'longitude'} <= set(work.columns) or {'lat', 'lon'} <= set(work.columns)):
+        raise ValueError("No coordinate columns found: expected latitude/longitude")
+
+    with _WorkDir(work_dir, keep_work_dir) as folder:
+        logger.info(f"Linking {len(df)} coordinates in {folder}")
+        result = _assign_fips(work, year_column, folder)
+    return _from_pandas(_restore(df, result, ['FIPS']), as_arrow)
@@ -0,0 +1,359 @@
+import os
+import re
+import json
+import sqlite3
+import argparse
+from loguru import logger
+from runtime import lazy_import
+from run_ledger import write_csv_atomic, part_path, commit_part
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# -------------------------------------------------------------------
+# In-process address geocoder built from local TIGER/Line data.
+# An alternative to the DeGAUSS geocoder container: no Docker, no HOST_PWD
+# mount, no network. TIGER/Line address-range features (ADDRFEAT, exported to
+# CSV with a WKT geometry column) are loaded once into a SQLite store indexed
+# on (zip, street, house number range). Addresses are parsed in bulk, matched
+# to their range with one indexed join per batch, and positioned by linear
+# interpolation along the edge geometry, vectorized over the whole batch.
+#
+#   python local_geocoder.py build --edges addrfeat.csv [--zips zips.csv] --db tiger.sqlite
+#
+# Output columns and threshold semantics follow the DeGAUSS geocoder:
+# matched_street, matched_zip, matched_city, matched_state, lat, lon, score,
+# precision, geocode_result ('geocoded' or 'imprecise_geocode', which has no
+# coordinates).
+# -------------------------------------------------------------------
+
+# Precisions (DeGAUSS naming) that can count as 'geocoded'
+PRECISE = ('range', 'street')
+
+# Score per match type
+SCORE_RANGE = 1.0          # house number inside a range on the matching side of the street
+SCORE_RANGE_PARITY = 0.9   # house number inside a range, but on the other side's parity
+SCORE_STREET = 0.8         # street found in the ZIP, number outside every range (nearest end used)
+SCORE_ZIP = 0.5            # only the ZIP could be matched (ZIP centroid)
+
+RESULT_COLUMNS = ['matched_street', 'matched_zip', 'matched_city', 'matched_state', 'lat', 'lon', 'score', 'precision', 'geocode_result']
+
+# USPS street suffix and directional abbreviations (most common forms)
+SUFFIXES = {
+    'ALLEY': 'ALY', 'AVENUE': 'AVE', 'AV': 'AVE', 'BOULEVARD': 'BLVD', 'CIRCLE': 'CIR', 'COURT': 'CT',
+    'CROSSING': 'XING', 'DRIVE': 'DR', 'EXPRESSWAY': 'EXPY', 'FREEWAY': 'FWY', 'HIGHWAY': 'HWY',
+    'LANE': 'LN', 'PARKWAY': 'PKWY', 'PLACE': 'PL', 'PLAZA': 'PLZ', 'ROAD': 'RD', 'SQUARE': 'SQ',
+    'STREET': 'ST', 'TERRACE': 'TER', 'TRAIL': 'TRL', 'TURNPIKE': 'TPKE', 'WAY': 'WAY', 'LOOP': 'LOOP',
+}
+DIRECTIONALS = {
+    'NORTH': 'N', 'SOUTH': 'S', 'EAST': 'E', 'WEST': 'W',
+    'NORTHEAST': 'NE', 'NORTHWEST': 'NW', 'SOUTHEAST': 'SE', 'SOUTHWEST': 'SW',
+}
+STATES = {
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY',
+    'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND', 'OH',
+    'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY', 'PR',
+}
+
+_ADDRESS_RE = re.compile(r'^\s*(\d+)[A-Z]?\s+(.+?)\s+(\d{5})(?:\s*\d{4})?\s*$')
+
+def normalize_street(name):
+    """Upper-case street name with USPS suffix / directional abbreviations ('North Main Street' -> 'N MAIN ST')."""
+    tokens = re.sub(r'[^A-Z0-9 ]', ' ', str(name).upper()).split()
+    return ' '.join(SUFFIXES.get(t, DIRECTIONALS.get(t, t)) for t in tokens)
+
+# -------------------------------------------------------------------
+# Store
+# -------------------------------------------------------------------
+
+def _parse_linestring(wkt):
+    """Coordinates of a LINESTRING / MULTILINESTRING WKT as [[lon, lat], ...] (parts concatenated)."""
+    numbers = re.findall(r'-?\d+(?:\.\d+)?(?:[eE]-?\d+)?\s+-?\d+(?:\.\d+)?(?:[eE]-?\d+)?', str(wkt))
+    return [[float(v) for v in pair.split()[:2]] for pair in numbers]
+
+def _house_number(values):
+    return pd.to_numeric(values.astype(str).str.extract(r'(\d+)', expand=False), errors='coerce')
+
+def build_store(edges_csv, db_path, zips_csv=None, chunksize=100000):
+    """
+    Build the SQLite address-range store from a TIGER/Line ADDRFEAT CSV export.
+
+    Parameters:
+    edges_csv (str): CSV with FULLNAME, LFROMHN, LTOHN, RFROMHN, RTOHN, ZIPL, ZIPR and a WKT geometry
+                     column (e.g. `ogr2ogr -f CSV -lco GEOMETRY=AS_WKT out.csv tl_2020_12001_addrfeat.shp`)
+    db_path (str): SQLite file to create (replaced if it exists)
+    zips_csv (str, optional): ZIP reference with zip, city, state[, lat, lon]; centroids are derived from
+                              the edges when lat/lon are not given
+    chunksize (int): Edges read per chunk
+
+    Returns:
+    int: Number of address ranges stored
+    """
+    tmp_path = part_path(db_path)
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    con = sqlite3.connect(tmp_path)
+    con.execute("""CREATE TABLE ranges (street TEXT, zip TEXT, lo INTEGER, hi INTEGER, from_hn INTEGER,
+                   to_hn INTEGER, parity INTEGER, street_label TEXT, coords TEXT)""")
+    con.execute("CREATE TABLE zips (zip TEXT PRIMARY KEY, city TEXT, state TEXT, lat REAL, lon REAL)")
+
+    total = 0
+    zip_sums = {}
+    for chunk in pd.read_csv(edges_csv, dtype=str, chunksize=chunksize):
+        chunk.columns = [c.upper() for c in chunk.columns]
+        chunk = chunk.dropna(subset=['FULLNAME', 'WKT'])
+        coords = chunk['WKT'].map(_parse_linestring)
+        for side in ('L', 'R'):
+            ranges = pd.DataFrame({
+                'street': chunk['FULLNAME'].map(normalize_street),
+                'street_label': chunk['FULLNAME'],
+                'zip': chunk[f'ZIP{side}'].str[:5],
+                'from_hn': _house_number(chunk[f'{side}FROMHN']),
+                'to_hn': _house_number(chunk[f'{side}TOHN']),
+                'coords': coords,
+            }).dropna(subset=['zip', 'from_hn', 'to_hn'])
+            ranges = ranges[ranges['coords'].map(len) >= 2]
+            if ranges.empty:
+                continue
+            ranges['lo'] = ranges[['from_hn', 'to_hn']].min(axis=1).astype(int)
+            ranges['hi'] = ranges[['from_hn', 'to_hn']].max(axis=1).astype(int)
+            ranges['parity'] = ranges['from_hn'].astype(int) % 2
+            # ZIP centroid = mean of edge midpoints
+            for zip_code, pts in ranges.groupby('zip')['coords']:
+                mids = np.array([p[len(p) // 2] for p in pts])
+                acc = zip_sums.setdefault(zip_code, [0.0, 0.0, 0])
+                acc[0] += mids[:, 0].sum()
+                acc[1] += mids[:, 1].sum()
+                acc[2] += len(mids)
+            ranges['coords'] = ranges['coords'].map(json.dumps)
+            ranges[['street', 'zip', 'lo', 'hi', 'from_hn', 'to_hn', 'parity', 'street_label', 'coords']].astype(
+                {'from_hn': int, 'to_hn': int}).to_sql('ranges', con, if_exists='append', index=False)
+            total += len(ranges)
+
+    zips = pd.DataFrame([(z, s[1] / s[2], s[0] / s[2]) for z, s in zip_sums.items()], columns=['zip', 'lat', 'lon'])
+    if zips_csv:
+        reference = pd.read_csv(zips_csv, dtype={'zip': str})
+        reference.columns = [c.lower() for c in reference.columns]
+        reference['zip'] = reference['zip'].str.zfill(5)
+        if {'lat', 'lon'} <= set(reference.columns):
+            zips = zips[~zips['zip'].isin(reference['zip'])]
+            zips = pd.concat([reference[['zip', 'city', 'state', 'lat', 'lon']], zips], ignore_index=True)
+        else:
+            zips = zips.merge(reference[['zip', 'city', 'state']], on='zip', how='left')
+    for col in ['city', 'state']:
+        if col not in zips.columns:
+            zips[col] = None
+    zips[['zip', 'city', 'state', 'lat', 'lon']].to_sql('zips', con, if_exists='append', index=False)
+
+    con.execute("CREATE INDEX idx_ranges_lookup ON ranges (zip, street, lo, hi)")
+    con.commit()
+    con.close()
+    commit_part(db_path)
+    logger.info(f"Address store built: {db_path} ({total} ranges, {len(zips)} ZIP codes)")
+    return total
+
+# -------------------------------------------------------------------
+# Geocoding
+# -------------------------------------------------------------------
+
+def parse_addresses(addresses):
+    """
+    Split one-line addresses into house number, street/city text and ZIP, vectorized.
+
+    Returns:
+    pandas.DataFrame: number (float, NaN if absent), middle (street + city + state text), zip
+    """
+    text = addresses.fillna('').astype(str).str.upper().str.replace(r'[^A-Z0-9 ]', ' ', regex=True)
+    text = text.str.replace(r'\s+', ' ', regex=True).str.strip()
+    parts = text.str.extract(_ADDRESS_RE)
+    parts.columns = ['number', 'middle', 'zip']
+    # Address without house number: keep ZIP for a ZIP-level match
+    missing = parts['zip'].isna()
+    parts.loc[missing, 'zip'] = text[missing].str.extract(r'(\d{5})(?:\s*\d{4})?\s*$', expand=False)
+    parts['number'] = pd.to_numeric(parts['number'], errors='coerce')
+    return parts
+
+def _split_street(middle, streets):
+    """Longest leading token run of `middle` that is a known street of the ZIP (state / city follow it)."""
+    tokens = normalize_street(middle).split()
+    if tokens and tokens[-1] in STATES:
+        tokens = tokens[:-1]
+    for end in range(len(tokens), 0, -1):
+        candidate = ' '.join(tokens[:end])
+        if candidate in streets:
+            return candidate
+    return None
+
+def interpolate(coords_list, fractions):
+    """
+    Points at `fractions` (0..1) of the length of each polyline, vectorized over all polylines.
+
+    Parameters:
+    coords_list (list of list): Polylines as [[lon, lat], ...]
+    fractions (array-like): Position along each polyline
+
+    Returns:
+    tuple of numpy arrays: (lat, lon)
+    """
+    fractions = np.clip(np.asarray(fractions, dtype=float), 0.0, 1.0)
+    counts = np.array([len(c) for c in coords_list])
+    points = np.array([p for c in coords_list for p in c], dtype=float)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    # Segments: every point except the last point of each polyline
+    seg_mask = np.ones(len(points), dtype=bool)
+    seg_mask[starts + counts - 1] = False
+    seg_start = points[:-1][seg_mask[:-1]]
+    seg_end = points[1:][seg_mask[:-1]]
+    scale = np.cos(np.radians(seg_start[:, 1]))
+    seg_len = np.hypot((seg_end[:, 0] - seg_start[:, 0]) * scale, seg_end[:, 1] - seg_start[:, 1])
+    cum_end = np.cumsum(seg_len)
+    seg_counts = counts - 1
+    first_seg = np.concatenate([[0], np.cumsum(seg_counts)[:-1]])
+    last_seg = first_seg + seg_counts - 1
+    offset = np.where(first_seg > 0, cum_end[first_seg - 1], 0.0)
+    total = cum_end[last_seg] - offset
+    target = offset + fractions * total
+
+    seg = np.clip(np.searchsorted(cum_end, target, side='left'), first_seg, last_seg)
+    seg_begin = cum_end[seg] - seg_len[seg]
+    t = np.where(seg_len[seg] > 0, (target - seg_begin) / np.where(seg_len[seg] > 0, seg_len[seg], 1), 0.0)
+    lon = seg_start[seg, 0] + t * (seg_end[seg, 0] - seg_start[seg, 0])
+    lat = seg_start[seg, 1] + t * (seg_end[seg, 1] - seg_start[seg, 1])
+    return lat, lon
+
+class LocalGeocoder:
+    """
+    Geocoder backed by the SQLite store written by build_store().
+    """
+
+    def __init__(self, db_path):
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"Address store not found: {db_path} (build it with: local_geocoder.py build)")
+        self.db_path = db_path
+        self._streets = {}
+
+    def _connect(self):
+        # One connection per call: geocoding may run on several worker threads
+        return sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+
+    def _streets_for(self, con, zips):
+        missing = [z for z in zips if z not in self._streets]
+        if missing:
+            con.execute("CREATE TEMP TABLE IF NOT EXISTS q_zip (zip TEXT)")
+            con.execute("DELETE FROM q_zip")
+            con.executemany("INSERT INTO q_zip VALUES (?)", [(z,) for z in missing])
+            found = {z: set() for z in missing}
+            for zip_code, street in con.execute("SELECT DISTINCT r.zip, r.street FROM ranges r JOIN q_zip q ON r.zip = q.zip"):
+                found[zip_code].add(street)
+            self._streets.update(found)
+        return self._streets
+
+    def geocode_frame(self, addresses, threshold):
+        """
+        Geocode a Series of one-line addresses.
+
+        Returns:
+        pandas.DataFrame: RESULT_COLUMNS, aligned with `addresses`
+        """
+        parsed = parse_addresses(addresses).reset_index(drop=True)
+        n = len(parsed)
+        result = pd.DataFrame({
+            'matched_street': pd.Series([None] * n, dtype=object),
+            'matched_zip': parsed['zip'],
+            'matched_city': None,
+            'matched_state': None,
+            'lat': np.nan,
+            'lon': np.nan,
+            'score': 0.0,
+            'precision': None,
+        })
+        con = self._connect()
+        try:
+            zips = [z for z in parsed['zip'].dropna().unique()]
+            streets = self._streets_for(con, zips)
+            keys = parsed[['zip', 'middle']].dropna().drop_duplicates()
+            street_map = {(z, m): _split_street(m, streets.get(z, ())) for z, m in keys.itertuples(index=False)}
+            parsed['street'] = [street_map.get((z, m)) if isinstance(m, str) else None for z, m in zip(parsed['zip'], parsed['middle'])]
+
+            # Range candidates for every row with street + number, one indexed join for the batch
+            query = parsed.dropna(subset=['street', 'number'])
+            if not query.empty:
+                con.execute("CREATE TEMP TABLE IF NOT EXISTS q_addr (qid INTEGER, zip TEXT, street TEXT, number INTEGER)")
+                con.execute("DELETE FROM q_addr")
+                con.executemany("INSERT INTO q_addr VALUES (?, ?, ?, ?)",
+                                list(zip(query.index.tolist(), query['zip'], query['street'], query['number'].astype(int).tolist())))
+                candidates = pd.read_sql_query(
+                    """SELECT q.qid, q.number, r.lo, r.hi, r.from_hn, r.to_hn, r.parity, r.street_label, r.coords,
+                              CASE WHEN q.number < r.lo THEN r.lo - q.number WHEN q.number > r.hi THEN q.number - r.hi ELSE 0 END AS gap
+                       FROM q_addr q JOIN ranges r ON r.zip = q.zip AND r.street = q.street""", con)
+                if not candidates.empty:
+                    candidates['parity_ok'] = (candidates['number'] % 2) == candidates['parity']
+                    # Best candidate: inside the range, then matching parity, then smallest gap
+                    candidates = candidates.sort_values(['qid', 'gap', 'parity_ok'], ascending=[True, True, False])
+                    best = candidates.drop_duplicates('qid').reset_index(drop=True)
+                    span = (best['to_hn'] - best['from_hn']).astype(float)
+                    position = np.where(span != 0, (best['number'] - best['from_hn']) / span.where(span != 0, 1), 0.5)
+                    lat, lon = interpolate([json.loads(c) for c in best['coords']], position)
+                    rows = best['qid'].values
+                    result.loc[rows, 'lat'] = lat
+                    result.loc[rows, 'lon'] = lon
+                    result.loc[rows, 'matched_street'] = best['street_label'].values
+                    inside = (best['gap'] == 0).values
+                    result.loc[rows, 'precision'] = np.where(inside, 'range', 'street')
+                    result.loc[rows, 'score'] = np.where(inside, np.where(best['parity_ok'], SCORE_RANGE, SCORE_RANGE_PARITY), SCORE_STREET)
+
+            # ZIP reference: city/state for every row, centroid for rows still unmatched
+            zip_rows = pd.read_sql_query("SELECT zip, city, state, lat, lon FROM zips", con) if zips else pd.DataFrame(columns=['zip', 'city', 'state', 'lat', 'lon'])
+        finally:
+            con.close()
+
+        zip_rows = zip_rows.set_index('zip')
+        known_zip = parsed['zip'].isin(zip_rows.index)
+        result.loc[known_zip, 'matched_city'] = parsed.loc[known_zip, 'zip'].map(zip_rows['city']).values
+        result.loc[known_zip, 'matched_state'] = parsed.loc[known_zip, 'zip'].map(zip_rows['state']).values
+        zip_only = known_zip & result['precision'].isna()
+        result.loc[zip_only, 'lat'] = parsed.loc[zip_only, 'zip'].map(zip_rows['lat']).values
+        result.loc[zip_only, 'lon'] = parsed.loc[zip_only, 'zip'].map(zip_rows['lon']).values
+        result.loc[zip_only, 'precision'] = 'zip'
+        result.loc[zip_only, 'score'] = SCORE_ZIP
+
+        # DeGAUSS threshold semantics: only precise matches at or above the threshold keep coordinates
+        geocoded = result['precision'].isin(PRECISE) & (result['score'] >= threshold)
+        result['geocode_result'] = np.where(geocoded, 'geocoded', 'imprecise_geocode')
+        result.loc[~geocoded, ['lat', 'lon']] = np.nan
+        result.index = addresses.index
+        return result[RESULT_COLUMNS]
+
+    def geocode(self, df, threshold, output_folder, output_file, batch_rows=100000):
+        """
+        Geocode the `address` column of `df` and write input + RESULT_COLUMNS to `output_file`.
+
+        Same call shape as degauss.geocode(), so the two backends are interchangeable.
+
+        Returns:
+        tuple: (output_file, number of quarantined rows; always 0)
+        """
+        results = []
+        for start in range(0, len(df), batch_rows):
+            part = df.iloc[start:start + batch_rows]
+            results.append(pd.concat([part, self.geocode_frame(part['address'], threshold)], axis=1))
+        output = pd.concat(results) if results else df.reindex(columns=list(df.columns) + RESULT_COLUMNS)
+        write_csv_atomic(output, output_file)
+        geocoded = int((output['geocode_result'] == 'geocoded').sum()) if len(output) else 0
+        logger.info(f"Local geocoder: {geocoded} of {len(output)} addresses geocoded")
+        return output_file, 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Local TIGER/Line address store')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='Build the SQLite address store from a TIGER/Line ADDRFEAT CSV export')
+    build.add_argument('--edges', required=True, help='ADDRFEAT CSV with a WKT geometry column')
+    build.add_argument('--zips', help='Optional ZIP reference CSV (zip, city, state[, lat, lon])')
+    build.add_argument('--db', required=True, help='SQLite file to write')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_store(args.edges, args.db, args.zips)
+
+if __name__ == "__main__":
+    main()
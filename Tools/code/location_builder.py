@@ -0,0 +1,148 @@
+import os
+import csv
+import heapq
+import shutil
+import tempfile
+from loguru import logger
+from concurrent.futures import ThreadPoolExecutor
+from run_ledger import part_path, commit_part
+from runtime import lazy_import
+
+pd = lazy_import('pandas')
+
+# -------------------------------------------------------------------
+# Streaming LOCATION.csv builder.
+# Each *_with_fips.csv is read in chunks (location columns only), deduplicated
+# on location_id with a hash set and spilled to sorted run files; the runs are
+# then k-way merged into one sorted, de-duplicated LOCATION.csv. Peak memory is
+# bounded by `run_rows` per reader instead of the total number of visits.
+# At most MERGE_FAN_IN runs are open at once; with more runs they are merged
+# in several passes through intermediate run files.
+# -------------------------------------------------------------------
+
+LOCATION_COLUMNS = ['location_id', 'address_1', 'address_2', 'city', 'state', 'zip', 'county', 'location_source_value', 'country_concept_id', 'country_source_value', 'latitude', 'longitude']
+
+def _location_key(location_id):
+    """Sort numerically when location_id is an integer, otherwise as text after all integers."""
+    value = location_id.strip()
+    if value.lstrip('-').isdigit():
+        return (0, int(value), '')
+    try:
+        number = float(value)
+        if number.is_integer():
+            return (0, int(number), '')
+    except ValueError:
+        pass
+    return (1, 0, value)
+
+# Run files merged (and so open) at once, well below the usual limit of 1024 open files
+MERGE_FAN_IN = 64
+
+def _row_key(row):
+    return _location_key(row[0])
+
+def _write_run(rows, spill_dir, prefix, run_number):
+    rows.sort(key=_row_key)
+    run_path = os.path.join(spill_dir, f"{prefix}_run_{run_number}.csv")
+    with open(run_path, 'w', newline='') as f:
+        csv.writer(f).writerows(rows)
+    return run_path
+
+def _file_to_sorted_runs(file_index, path, spill_dir, chunksize, run_rows):
+    """
+    Read one FIPS file in chunks and return the paths of its sorted, de-duplicated run files.
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    if not all(col in header for col in LOCATION_COLUMNS):
+        logger.info(f"Skipping {path}: location columns not present")
+        return []
+
+    seen = set()
+    buffer = []
+    runs = []
+    reader = pd.read_csv(path, usecols=LOCATION_COLUMNS, dtype=str, keep_default_na=False, chunksize=chunksize)
+    for chunk in reader:
+        chunk = chunk[LOCATION_COLUMNS].drop_duplicates(subset='location_id')
+        chunk = chunk[~chunk['location_id'].isin(seen)]
+        if chunk.empty:
+            continue
+        seen.update(chunk['location_id'])
+        buffer.extend(chunk.itertuples(index=False, name=None))
+        if len(buffer) >= run_rows:
+            runs.append(_write_run(buffer, spill_dir, f"f{file_index}", len(runs)))
+            buffer = []
+    if buffer:
+        runs.append(_write_run(buffer, spill_dir, f"f{file_index}", len(runs)))
+    logger.info(f"Collected {len(seen)} unique locations from {path}")
+    return runs
+
+def _read_run(run_path):
+    with open(run_path, newline='') as f:
+        for row in csv.reader(f):
+            yield row
+
+def _merge_unique(runs):
+    """Rows of sorted run files in key order, keeping the first row of every location_id (earlier runs win)."""
+    last_key = None
+    for row in heapq.merge(*[_read_run(run) for run in runs], key=_row_key):
+        key = _row_key(row)
+        if key == last_key:
+            continue
+        last_key = key
+        yield row
+
+def _reduce_runs(runs, spill_dir, fan_in):
+    """Merge consecutive groups of `fan_in` runs into intermediate runs until at most `fan_in` are left."""
+    merge_pass = 0
+    while len(runs) > fan_in:
+        merge_pass += 1
+        merged = []
+        for group_start in range(0, len(runs), fan_in):
+            group = runs[group_start:group_start + fan_in]
+            run_path = os.path.join(spill_dir, f"p{merge_pass}_run_{len(merged)}.csv")
+            with open(run_path, 'w', newline='') as f:
+                csv.writer(f).writerows(_merge_unique(group))
+            for run in group:
+                os.remove(run)
+            merged.append(run_path)
+        logger.info(f"Merge pass {merge_pass}: {len(runs)} runs merged into {len(merged)}")
+        runs = merged
+    return runs
+
+def build_location_csv(fips_files, output_path, chunksize=100000, run_rows=500000, max_workers=4, fan_in=MERGE_FAN_IN):
+    """
+    Build LOCATION.csv (one row per location_id, sorted by location_id) from the FIPS files.
+
+    Parameters:
+    fips_files (list of str): Paths of the *_with_fips.csv files
+    output_path (str): Path of the LOCATION.csv to write
+    chunksize (int): Rows read from a FIPS file at a time
+    run_rows (int): Unique rows buffered per file before a sorted run is spilled to disk
+    max_workers (int): Number of FIPS files read in parallel
+    fan_in (int): Run files merged at once
+
+    Returns:
+    int: Number of locations written (0 if no FIPS file had the location columns)
+    """
+    spill_dir = tempfile.mkdtemp(prefix='location_runs_', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_file_to_sorted_runs, i, path, spill_dir, chunksize, run_rows) for i, path in enumerate(fips_files)]
+            # Keep runs in file order so the first occurrence of a location wins on ties
+            runs = [run for future in futures for run in future.result()]
+
+        if not runs:
+            return 0
+
+        runs = _reduce_runs(runs, spill_dir, fan_in)
+        written = 0
+        with open(part_path(output_path), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(LOCATION_COLUMNS)
+            for row in _merge_unique(runs):
+                writer.writerow(row)
+                written += 1
+        commit_part(output_path)
+        return written
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
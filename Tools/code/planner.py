@@ -0,0 +1,495 @@
+import os
+import math
+import time
+import shutil
+import tempfile
+from loguru import logger
+from runtime import lazy_import
+import backends
+import degauss
+import ingest
+import address_union
+from scratch import FOOTPRINT_FACTOR, format_size
+
+pd = lazy_import('pandas')
+sqlalchemy = lazy_import('sqlalchemy')
+
+# -------------------------------------------------------------------
+# Dry-run capacity planner (--plan).
+# Before a long run, the inputs are profiled without processing them:
+#   - Address_to_FIPS: every input file is counted and a sample of its first
+#     rows read, giving the location kind, the distinct address and
+#     coordinate ratios and the 2010/2020 vintage split
+#   - OMOP_to_FIPS: COUNT queries over the extraction categories, plus a
+#     small sample of each
+# The configured geocoder and FIPS backends are then timed on a tiny and a
+# sample-sized call (giving a cost per call and per row), and the pandas
+# work on the sample. Wall time, peak memory and disk use are extrapolated
+# for the chosen workers and batch sizes, and better settings are suggested.
+# The estimates assume the sampled rows are typical of the whole input.
+# -------------------------------------------------------------------
+
+# Rows read from every input (or category) for the profile and the timings
+SAMPLE_ROWS = 2000
+
+# Rows of the small backend call whose time is taken as the cost per call
+CALIBRATION_ROWS = 20
+
+# A frame in linkage, its untouched copy and the merged result are alive at once
+MEMORY_COPIES = 3
+
+# Final files carry the input columns plus coordinates and FIPS columns
+OUTPUT_FACTOR = 1.5
+
+# Container batches are suggested large enough that starting the container is at most
+# this share of a batch's time, within these bounds
+CALL_OVERHEAD_SHARE = 0.1
+CONTAINER_BATCH_BOUNDS = (5000, 200000)
+
+# --batch-rows sizes tried for OMOP runs
+BATCH_ROWS_CHOICES = (25000, 50000, 100000, 250000, 500000)
+
+# COUNT summary of one extraction category; build_extraction_queries(summary=...) runs it over `extracted`
+COUNT_SUMMARY = "SELECT COUNT(*) AS row_count, COUNT(DISTINCT location_id) AS locations, SUM(CASE WHEN year < 2020 THEN 1 ELSE 0 END) AS rows_2010 FROM extracted"
+
+def sample_summary(engine, rows=SAMPLE_ROWS):
+    """First `rows` extracted rows, in the dialect of `engine` (TOP for SQL Server, LIMIT elsewhere)."""
+    if engine.dialect.name == 'mssql':
+        return f"SELECT TOP ({int(rows)}) * FROM extracted"
+    return f"SELECT * FROM extracted LIMIT {int(rows)}"
+
+def count_rows(path):
+    """Data rows of an input file: from the Parquet footer, or by counting the lines of a (compressed) CSV."""
+    if path.lower().endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    pa = lazy_import('pyarrow')
+    lines, last = 0, b'\n'
+    with pa.input_stream(path, compression='detect') as stream:
+        while True:
+            block = stream.read(1 << 24)
+            if not block:
+                break
+            lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        lines += 1  # no newline after the last row
+    return max(lines - 1, 0)
+
+def _share_2010(sample):
+    """Share of rows assigned the 2010 vintage, with the rule of the linkage stages (year < 2020)."""
+    if sample.empty:
+        return 0.0
+    if 'year_for_fips' in sample.columns:
+        return float((pd.to_numeric(sample['year_for_fips'], errors='coerce') == 2010).mean())
+    if 'year' in sample.columns:
+        return float((pd.to_numeric(sample['year'], errors='coerce') < 2020).mean())
+    return 0.0
+
+def _distinct_ratio(values):
+    return float(values.nunique(dropna=False) / len(values)) if len(values) else 0.0
+
+def _unit(name, kind, rows, nbytes, sample, count=1):
+    """Workload of one input file (or of `count` extracted batches of one category)."""
+    row_bytes = float(sample.memory_usage(deep=True).sum() / len(sample)) if len(sample) else 0.0
+    return {'name': name, 'kind': kind, 'rows': int(rows), 'total_rows': int(rows) * count, 'bytes': int(nbytes), 'count': count,
+            'row_bytes': row_bytes, 'share_2010': _share_2010(sample),
+            'distinct_addresses': 0.0, 'distinct_points': 0.0}
+
+def profile_files(input_folder, sample_rows=SAMPLE_ROWS):
+    """
+    Profile the input files of an Address_to_FIPS run.
+
+    The sample is the first `sample_rows` rows of each file; its distinct address ratio,
+    extrapolated to the file, errs on the high side for files with many repeats.
+
+    Parameters:
+    input_folder (str): Input folder of the run
+    sample_rows (int): Rows read from every file
+
+    Returns:
+    tuple: (list of unit dicts, sample addresses DataFrame, sample lat/lon DataFrame)
+    """
+    units, addresses, points = [], [], []
+    for name in sorted(f for f in os.listdir(input_folder) if ingest.is_input_file(f)):
+        path = os.path.join(input_folder, name)
+        stem = ingest.input_stem(name).lower()
+        if stem == 'person':
+            continue
+        schema = ingest.TableSchema(path)
+        sample = next(ingest.iter_batches(path, rows=sample_rows, text_columns=['street', 'city', 'state', 'zip', 'address', 'address_1', 'address_2'], schema=schema), pd.DataFrame()).head(sample_rows)
+        rows = count_rows(path)
+        if stem == 'visit_occurrence':
+            kind = 'visits'
+        elif stem == 'location_history':
+            kind = 'copy'
+        elif stem == 'location':
+            kind = 'address' if address_union.needs_geocoding(sample) else 'coordinates'
+            if kind == 'address':
+                sample = sample.assign(address=address_union.location_address(sample.reindex(columns=['address_1', 'address_2', 'city', 'state', 'zip']).astype(object)))
+        else:
+            option = schema.location_option()
+            if option is None:
+                logger.warning(f"{name}: no location columns, left out of the plan")
+                continue
+            kind = 'coordinates' if option == 3 else 'address'
+        unit = _unit(name, kind, rows, os.path.getsize(path), sample)
+        if kind == 'address' and len(sample):
+            columns = ['street', 'city', 'state', 'zip'] if 'address' not in sample.columns else ['address']
+            built = address_union.build_address(sample, columns)
+            unit['distinct_addresses'] = _distinct_ratio(address_union.address_key(built)) * rows
+            addresses.append(pd.DataFrame({'address': built}))
+        elif kind == 'coordinates' and len(sample):
+            lat, lon = ('latitude', 'longitude') if 'latitude' in sample.columns else ('lat', 'lon')
+            unit['distinct_points'] = _distinct_ratio(sample[lat].astype(str) + ',' + sample[lon].astype(str)) * rows
+            points.append(sample[[lat, lon]].set_axis(['lat', 'lon'], axis=1))
+        units.append(unit)
+    return units, _head(addresses, sample_rows), _head(points, sample_rows)
+
+def profile_cdm(engine, build_queries, batch_rows, sample_rows=SAMPLE_ROWS):
+    """
+    Profile the extraction categories of an OMOP_to_FIPS run with COUNT queries and small samples.
+
+    Extraction time is the COUNT query's time (the joins are paid once) plus the rows at the
+    time per row of fetching a sample, taken between a CALIBRATION_ROWS and a full sample so
+    the cost of starting the query is left out.
+
+    Parameters:
+    engine (sqlalchemy.Engine): CDM connection
+    build_queries (callable): build_queries(summary) -> category -> query, e.g. OMOP_to_FIPS.build_extraction_queries
+    batch_rows (int): Rows per extracted batch file
+    sample_rows (int): Rows sampled per category
+
+    Returns:
+    tuple: (list of unit dicts, sample addresses DataFrame, sample lat/lon DataFrame, extraction seconds per category)
+    """
+    units, addresses, points, extraction = [], None, None, {}
+    kinds = {'Latlong': 'coordinates', 'Address': 'address', 'Invalid': 'copy'}
+    small_queries = build_queries(sample_summary(engine, CALIBRATION_ROWS))
+    sample_queries = build_queries(sample_summary(engine, sample_rows))
+    with engine.connect() as conn:
+        for category, query in build_queries(COUNT_SUMMARY).items():
+            start = time.perf_counter()
+            row_count, locations, rows_2010 = conn.execute(sqlalchemy.text(query)).fetchone()
+            scan_seconds = time.perf_counter() - start
+            row_count, locations, rows_2010 = int(row_count or 0), int(locations or 0), int(rows_2010 or 0)
+            timings = []
+            for sample_query in (small_queries[category], sample_queries[category]):
+                start = time.perf_counter()
+                sample = pd.read_sql(sqlalchemy.text(sample_query), conn)
+                timings.append((len(sample), time.perf_counter() - start))
+            extraction[category] = scan_seconds + row_count * _fit(*timings)[1]
+            logger.info(f"{category}: {row_count} rows, {locations} locations ({scan_seconds:.1f}s to count)")
+
+            rows = min(batch_rows, row_count)
+            batch_bytes = len(sample.to_csv(index=False).encode()) / max(len(sample), 1) * rows
+            unit = _unit(category, kinds[category], rows, batch_bytes, sample, count=math.ceil(row_count / batch_rows))
+            unit['total_rows'] = row_count
+            unit['share_2010'] = rows_2010 / row_count if row_count else 0.0
+            # Locations repeat across visits; each batch sends its share of them
+            distinct = rows * min(locations / row_count, 1.0) if row_count else 0.0
+            unit['distinct_addresses' if kinds[category] == 'address' else 'distinct_points'] = distinct
+            units.append(unit)
+            if category == 'Address' and len(sample):
+                addresses = pd.DataFrame({'address': address_union.build_address(sample, ['address_1', 'city', 'state', 'zip'])})
+            elif category == 'Latlong' and len(sample):
+                points = sample[['latitude', 'longitude']].set_axis(['lat', 'lon'], axis=1)
+    return units, addresses, points, extraction
+
+def _head(frames, rows):
+    frames = [f for f in frames if f is not None and len(f)]
+    return pd.concat(frames, ignore_index=True).head(rows) if frames else None
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def _fit(small, large):
+    """(seconds per call, seconds per row) through two (rows, seconds) measurements."""
+    (n1, t1), (n2, t2) = small, large
+    per_row = max((t2 - t1) / (n2 - n1), 0.0) if n2 > n1 else t2 / max(n2, 1)
+    return max(t1 - per_row * n1, 0.0), per_row
+
+def calibrate(addresses, points, work_dir):
+    """
+    Time the configured backends and the pandas work on sample rows.
+
+    Each backend is called twice, on CALIBRATION_ROWS rows and on the whole sample, and a
+    straight line through both timings gives its cost per call and per row. Without sample
+    points the census backend is timed on the geocoded sample addresses.
+
+    Parameters:
+    addresses (pandas.DataFrame or None): Sample `address` column
+    points (pandas.DataFrame or None): Sample `lat` / `lon` columns
+    work_dir (str): Folder for the backend outputs
+
+    Returns:
+    dict: 'geocoder' / 'census' / 'cpu' -> (seconds per call, seconds per row); None for stages without a sample
+    """
+    rates = {'geocoder': None, 'census': None, 'cpu': None}
+    if addresses is not None and len(addresses):
+        geocoder = backends.geocoder()
+        output_file = os.path.join(work_dir, 'geocoded.csv')
+        small = addresses.head(CALIBRATION_ROWS)
+        timings = []
+        for part in (small, addresses):
+            timings.append((len(part), _timed(lambda part=part: geocoder.geocode(part, 0.7, work_dir, output_file))))
+        rates['geocoder'] = _fit(*timings)
+        if points is None or not len(points):
+            geocoded = pd.read_csv(output_file)
+            points = geocoded.loc[geocoded['lat'].notna(), ['lat', 'lon']] if 'lat' in geocoded.columns else None
+    if points is not None and len(points):
+        census = backends.census()
+        output_file = os.path.join(work_dir, 'census.csv')
+        sample = points.assign(year_for_fips=2020)
+        timings = []
+        for part in (sample.head(CALIBRATION_ROWS), sample):
+            timings.append((len(part), _timed(lambda part=part: census.census(part, 2020, work_dir, output_file))))
+        rates['census'] = _fit(*timings)
+    frames = [f for f in (addresses, points) if f is not None and len(f)]
+    if frames:
+        sample = pd.concat(frames, axis=1)
+        path = os.path.join(work_dir, 'cpu.csv')
+        # Linkage reads and writes every row about twice (input or container output, final file)
+        seconds = 2 * _timed(lambda: (sample.to_csv(path, index=False), pd.read_csv(path)))
+        rates['cpu'] = (0.0, seconds / len(sample))
+    return rates
+
+def _stage_seconds(rate, rows, batch_rows):
+    if not rows or rate is None:
+        return 0.0
+    overhead, per_row = rate
+    return overhead * math.ceil(rows / batch_rows) + per_row * rows
+
+def _unit_seconds(unit, rates, batch_rows, union=False):
+    """(geocoder, census, cpu) seconds of one unit; census vintages run side by side."""
+    rows = unit['rows']
+    geocode = _stage_seconds(rates['geocoder'], rows, batch_rows) if unit['kind'] == 'address' and not union else 0.0
+    census = 0.0
+    if unit['kind'] in ('address', 'coordinates'):
+        rows_2010 = round(rows * unit['share_2010'])
+        census = max(_stage_seconds(rates['census'], rows_2010, batch_rows), _stage_seconds(rates['census'], rows - rows_2010, batch_rows))
+    cpu = _stage_seconds(rates['cpu'], rows, batch_rows)
+    return geocode, census, cpu
+
+def estimate(units, rates, settings, extraction=None):
+    """
+    Extrapolate wall time, peak memory and disk use of a run.
+
+    Parameters:
+    units (list of dict): From profile_files / profile_cdm
+    rates (dict): From calibrate
+    settings (dict): 'tool' ('address' or 'omop'), 'limits' (resource -> workers),
+                     'container_batch_rows', and for OMOP 'batch_rows', 'queue_size', 'sequential';
+                     'address_union' for Address_to_FIPS
+    extraction (dict, optional): Extraction seconds per category (OMOP)
+
+    Returns:
+    dict: seconds per resource, wall_seconds, memory_bytes, scratch_bytes, output_bytes
+    """
+    limits, batch_rows = settings['limits'], settings['container_batch_rows']
+    union = settings.get('address_union', False)
+    totals = {'geocoder': 0.0, 'census': 0.0, 'cpu': 0.0}
+    longest = 0.0
+    visits = 0.0
+    for unit in units:
+        geocode, census, cpu = _unit_seconds(unit, rates, batch_rows, union)
+        for resource, seconds in zip(totals, (geocode, census, cpu)):
+            totals[resource] += seconds * unit['count']
+        if unit['kind'] == 'visits':
+            visits += cpu
+        else:
+            longest = max(longest, geocode + census + cpu)
+    # The union geocodes the distinct addresses of all files once, before any file is linked
+    union_seconds = _stage_seconds(rates['geocoder'], sum(u['distinct_addresses'] for u in units if u['kind'] == 'address'), batch_rows) if union else 0.0
+    totals['geocoder'] += union_seconds
+
+    by_size = sorted(units, key=lambda u: u['rows'] * u['row_bytes'], reverse=True)
+    in_flight = sum(limits.values())
+    if settings['tool'] == 'omop':
+        workers = limits['cpu']
+        link = sum(sum(_unit_seconds(u, rates, batch_rows)) * u['count'] for u in units)
+        linkage = max(link / workers, longest)
+        extract = max((extraction or {}).values(), default=0.0)
+        # Pipelined, batches are linked while the database streams; sequentially, after it
+        wall = extract + linkage if settings.get('sequential') else max(extract + longest, linkage)
+        memory = max((u['rows'] * u['row_bytes'] for u in units), default=0) * MEMORY_COPIES * workers
+        total_bytes = sum(u['bytes'] / max(u['rows'], 1) * u['total_rows'] for u in units)
+        batch_bytes = max((u['bytes'] for u in units), default=0)
+        if settings.get('sequential'):
+            scratch_bytes = total_bytes + batch_bytes * FOOTPRINT_FACTOR * workers
+        else:
+            scratch_bytes = batch_bytes * FOOTPRINT_FACTOR * (workers + settings.get('queue_size', 0))
+        output_bytes = total_bytes * OUTPUT_FACTOR
+    else:
+        # Visits are linked after every other file, on their own
+        wall = union_seconds + visits + max(longest, totals['census'] / limits['census'], (totals['cpu'] - visits) / limits['cpu'],
+                                            (totals['geocoder'] - union_seconds) / limits['geocoder'])
+        # Assumes at most one file per worker is in memory or on scratch at a time
+        memory = sum(u['rows'] * u['row_bytes'] for u in by_size[:in_flight]) * MEMORY_COPIES
+        scratch_bytes = sum(u['bytes'] for u in by_size[:in_flight]) * FOOTPRINT_FACTOR
+        output_bytes = sum(u['bytes'] for u in units) * OUTPUT_FACTOR
+    if settings.get('scratch_budget'):
+        scratch_bytes = min(scratch_bytes, max(settings['scratch_budget'], max((u['bytes'] for u in units), default=0) * FOOTPRINT_FACTOR))
+    return {'seconds': totals, 'wall_seconds': wall, 'memory_bytes': memory,
+            'scratch_bytes': scratch_bytes, 'output_bytes': output_bytes}
+
+def machine(path):
+    """CPU count, physical memory and free disk space at `path` (None where unknown)."""
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        memory = None
+    while path and not os.path.exists(path):
+        path = os.path.dirname(path)
+    free = shutil.disk_usage(path or '.').free
+    return {'cpus': os.cpu_count() or 1, 'memory': memory, 'free_disk': free}
+
+def _round(rows):
+    magnitude = 10 ** max(len(str(int(rows))) - 2, 0)
+    return int(round(rows / magnitude) * magnitude)
+
+def rebatch(units, batch_rows):
+    """OMOP units as extracted with another --batch-rows."""
+    rebatched = []
+    for unit in units:
+        rows = min(batch_rows, unit['total_rows'])
+        rebatched.append(dict(unit, rows=rows, count=math.ceil(unit['total_rows'] / batch_rows),
+                              bytes=unit['bytes'] / max(unit['rows'], 1) * rows,
+                              distinct_addresses=unit['distinct_addresses'] / max(unit['rows'], 1) * rows,
+                              distinct_points=unit['distinct_points'] / max(unit['rows'], 1) * rows))
+    return rebatched
+
+def recommend(units, rates, settings, host, extraction=None):
+    """
+    Suggest workers and batch sizes.
+
+    Container batches are sized so starting a container stays a small share of the batch.
+    For OMOP runs every BATCH_ROWS_CHOICES size is estimated; then workers are added one at a
+    time to the busiest resource while there are CPUs for them. A change is only kept when it
+    shortens the estimated wall time by 5% and the peak memory stays under half the machine's.
+
+    Returns:
+    dict: Suggested settings (same keys as `settings`) with their estimate under 'estimate'
+    """
+    suggested = dict(settings, limits=dict(settings['limits']))
+    low, high = CONTAINER_BATCH_BOUNDS
+    container_rows = [rates[stage][0] / rates[stage][1] / CALL_OVERHEAD_SHARE for stage in ('geocoder', 'census')
+                      if rates.get(stage) and rates[stage][1] > 0 and getattr(backends, stage)().name == 'degauss']
+    if container_rows:
+        suggested['container_batch_rows'] = _round(min(max(max(container_rows), low), high))
+
+    def shaped(candidate):
+        return rebatch(units, candidate['batch_rows']) if candidate['tool'] == 'omop' else units
+
+    def better(result, best):
+        fits = not host['memory'] or result['memory_bytes'] <= host['memory'] / 2
+        return fits and result['wall_seconds'] < best['wall_seconds'] * 0.95
+
+    best = estimate(shaped(suggested), rates, suggested, extraction)
+    if settings['tool'] == 'omop':
+        for batch_rows in BATCH_ROWS_CHOICES:
+            trial = dict(suggested, batch_rows=batch_rows)
+            result = estimate(shaped(trial), rates, trial, extraction)
+            if better(result, best):
+                suggested, best = trial, result
+
+    resources = ['cpu'] if settings['tool'] == 'omop' else (['census', 'cpu'] + ([] if settings.get('address_union') else ['geocoder']))
+    while sum(suggested['limits'][r] for r in resources) < host['cpus']:
+        busiest = max(resources, key=lambda r: best['seconds'][r] / suggested['limits'][r])
+        trial = dict(suggested, limits=dict(suggested['limits']))
+        trial['limits'][busiest] += 1
+        if settings['tool'] == 'omop':
+            # --workers sets every resource
+            trial['limits'] = {r: trial['limits']['cpu'] for r in trial['limits']}
+        result = estimate(shaped(trial), rates, trial, extraction)
+        if not better(result, best):
+            break
+        suggested, best = trial, result
+    suggested['estimate'] = best
+    return suggested
+
+def _duration(seconds):
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    return f"{hours}h {rest // 60:02d}m" if hours else f"{rest // 60}m {rest % 60:02d}s"
+
+def report(units, rates, settings, result, suggestion, host):
+    """Log the profile, the estimate for the chosen settings and the suggested settings."""
+    logger.info("Capacity plan (dry run, nothing was processed)")
+    for unit in units:
+        batches = f" in {unit['count']} batch(es)" if settings['tool'] == 'omop' else ''
+        distinct = {'address': f", ~{unit['distinct_addresses'] * unit['count']:.0f} distinct addresses",
+                    'coordinates': f", ~{unit['distinct_points'] * unit['count']:.0f} distinct coordinates"}.get(unit['kind'], '')
+        logger.info(f"  {unit['name']}: {unit['total_rows']} rows{batches}, {unit['kind']}{distinct}, "
+                    f"{unit['share_2010']:.0%} 2010 vintage, {format_size(int(unit['row_bytes']))}/row in memory")
+    for stage, rate in rates.items():
+        if rate:
+            logger.info(f"  {stage}: {rate[0]:.2f}s per call + {rate[1] * 1000:.3f}ms per row")
+    memory = format_size(host['memory']) if host['memory'] else 'unknown'
+    logger.info(f"  Machine: {host['cpus']} CPUs, {memory} memory, {format_size(host['free_disk'])} free disk")
+
+    def describe(label, chosen, estimated):
+        limits = ', '.join(f"{r} {n}" for r, n in chosen['limits'].items()) if chosen['tool'] == 'address' else f"workers {chosen['limits']['cpu']}"
+        batch = f", batch rows {chosen['batch_rows']}" if chosen['tool'] == 'omop' else ''
+        logger.info(f"{label}: {limits}{batch}, container batch rows {chosen['container_batch_rows']}")
+        busy = ', '.join(f"{r} {_duration(s)}" for r, s in estimated['seconds'].items() if s)
+        logger.info(f"  wall time ~{_duration(estimated['wall_seconds'])} (work: {busy or 'none'}), "
+                    f"peak memory ~{format_size(int(estimated['memory_bytes']))}, "
+                    f"scratch ~{format_size(int(estimated['scratch_bytes']))}, outputs ~{format_size(int(estimated['output_bytes']))}")
+
+    describe("Chosen settings", settings, result)
+    describe("Suggested settings", suggestion, suggestion['estimate'])
+    disk = result['scratch_bytes'] + result['output_bytes']
+    if disk > host['free_disk']:
+        logger.warning(f"The run needs ~{format_size(disk)} of disk but only {format_size(host['free_disk'])} is free; "
+                       f"cap the working files with --scratch-budget {format_size(max(host['free_disk'] - result['output_bytes'], 0) * 0.8).replace(' ', '').rstrip('B')}")
+    if host['memory'] and result['memory_bytes'] > host['memory'] * 0.8:
+        logger.warning("The estimated peak memory is close to the machine's memory; use fewer workers or smaller batches.")
+
+def _plan(units, addresses, points, settings, output_path, extraction=None):
+    host = machine(output_path)
+    work_dir = tempfile.mkdtemp(prefix='plan_')
+    try:
+        rates = calibrate(addresses, points, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    result = estimate(units, rates, settings, extraction)
+    suggestion = recommend(units, rates, settings, host, extraction)
+    report(units, rates, settings, result, suggestion, host)
+    return {'units': units, 'rates': rates, 'estimate': result, 'suggested': suggestion, 'machine': host}
+
+def plan_address_run(input_folder, settings, sample_rows=SAMPLE_ROWS):
+    """
+    Plan an Address_to_FIPS run over `input_folder` without processing it.
+
+    Parameters:
+    input_folder (str): Input folder of the run
+    settings (dict): 'limits' (geocoder / census / cpu workers), 'address_union', 'scratch_budget'
+    sample_rows (int): Rows sampled from every file
+
+    Returns:
+    dict: Profile, stage rates, estimate and suggested settings
+    """
+    settings = dict(settings, tool='address', container_batch_rows=degauss.SETTINGS['batch_rows'])
+    units, addresses, points = profile_files(input_folder, sample_rows)
+    return _plan(units, addresses, points, settings, os.path.dirname(os.path.abspath(input_folder)))
+
+def plan_omop_run(engine, build_queries, settings, output_path, sample_rows=SAMPLE_ROWS):
+    """
+    Plan an OMOP_to_FIPS run against the CDM behind `engine` without extracting it.
+
+    Parameters:
+    engine (sqlalchemy.Engine): CDM connection
+    build_queries (callable): build_queries(summary) -> category -> query (see profile_cdm)
+    settings (dict): 'limits' (workers per resource), 'batch_rows', 'queue_size', 'sequential', 'scratch_budget'
+    output_path (str): Where the run directory would be created (for the free disk space)
+    sample_rows (int): Rows sampled per category
+
+    Returns:
+    dict: Profile, stage rates, estimate and suggested settings
+    """
+    settings = dict(settings, tool='omop', container_batch_rows=degauss.SETTINGS['batch_rows'])
+    units, addresses, points, extraction = profile_cdm(engine, build_queries, settings['batch_rows'], sample_rows)
+    return _plan(units, addresses, points, settings, output_path, extraction)
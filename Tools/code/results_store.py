@@ -0,0 +1,337 @@
+import os
+import sys
+import sqlite3
+import zipfile
+import argparse
+from datetime import datetime
+from loguru import logger
+from runtime import lazy_import
+
+pd = lazy_import('pandas')
+
+# -------------------------------------------------------------------
+# Queryable store of row-level linkage results across runs.
+# With --results-db, Address_to_FIPS and OMOP_to_FIPS bulk-append the rows of
+# their *_with_fips.csv files to one SQLite file (or DuckDB, for a .duckdb
+# path) when a run is packaged, so a person's FIPS history or everybody in a
+# tract is one indexed lookup instead of unzipping the archives of every run.
+# The rows of a run are staged first and copied to the linkage table sorted
+# by FIPS and then by a Z-order key of the coordinates, so rows of the same
+# tract and of neighbouring points sit next to each other on disk.
+# Loading a run again replaces its rows.
+#
+#   python results_store.py load --db results.sqlite --run-id RUN archive.zip [...]
+#   python results_store.py query --db results.sqlite --person 12 [--year 2015]
+#   python results_store.py query --db results.sqlite --fips 12001 --year 2015 --output rows.csv
+#   python results_store.py runs --db results.sqlite
+# -------------------------------------------------------------------
+
+TABLE = 'linkage'
+RUNS_TABLE = 'runs'
+STAGING_TABLE = 'linkage_staging'
+
+# Stored columns; identifiers are kept as text as they appear in the input files
+COLUMNS = {
+    'run_id': 'TEXT',
+    'source': 'TEXT',
+    'entity_id': 'TEXT',
+    'person_id': 'TEXT',
+    'visit_occurrence_id': 'TEXT',
+    'location_id': 'TEXT',
+    'year': 'INTEGER',
+    'latitude': 'DOUBLE',
+    'longitude': 'DOUBLE',
+    'fips': 'TEXT',
+    'geocode_result': 'TEXT',
+    'spatial_key': 'BIGINT',
+}
+ID_COLUMNS = ['entity_id', 'person_id', 'visit_occurrence_id', 'location_id']
+
+# Result file columns read into the store, by stored column
+SOURCE_COLUMNS = {
+    'entity_id': ['entity_id'],
+    'person_id': ['person_id'],
+    'visit_occurrence_id': ['visit_occurrence_id'],
+    'location_id': ['location_id'],
+    'year': ['year'],
+    'latitude': ['latitude', 'lat'],
+    'longitude': ['longitude', 'lon'],
+    'fips': ['FIPS'],
+    'geocode_result': ['geocode_result'],
+}
+
+INDEXES = {
+    'idx_linkage_entity': '(entity_id, year)',
+    'idx_linkage_person': '(person_id, year)',
+    'idx_linkage_location': '(location_id)',
+    'idx_linkage_fips': '(fips, year)',
+    'idx_linkage_year': '(year)',
+    'idx_linkage_run': '(run_id)',
+}
+
+# Rows read from a result file at a time
+CHUNK_ROWS = 100000
+
+# Coordinates are placed on a 2^16 x 2^16 grid for the Z-order key
+GRID_BITS = 16
+
+RESULT_SUFFIX = '_with_fips.csv'
+
+def _spread_bits(values):
+    # Put the 16 low bits of every value on the even bit positions of a 32-bit code
+    values = values & 0xFFFF
+    values = (values | (values << 8)) & 0x00FF00FF
+    values = (values | (values << 4)) & 0x0F0F0F0F
+    values = (values | (values << 2)) & 0x33333333
+    return (values | (values << 1)) & 0x55555555
+
+def spatial_key(lat, lon):
+    """
+    Z-order (Morton) code of coordinates: nearby points mostly get nearby codes.
+
+    Parameters:
+    lat (pandas.Series): Latitudes
+    lon (pandas.Series): Longitudes
+
+    Returns:
+    pandas.Series: Int64 codes, missing where a coordinate is missing or out of range
+    """
+    lat = pd.to_numeric(lat, errors='coerce')
+    lon = pd.to_numeric(lon, errors='coerce')
+    valid = lat.between(-90, 90) & lon.between(-180, 180)
+    cells = (1 << GRID_BITS) - 1
+    y = ((lat.where(valid, 0) + 90) / 180 * cells).round().to_numpy(dtype='int64')
+    x = ((lon.where(valid, 0) + 180) / 360 * cells).round().to_numpy(dtype='int64')
+    code = _spread_bits(x) | (_spread_bits(y) << 1)
+    return pd.Series(code, index=lat.index).where(valid).astype('Int64')
+
+def normalize(frame, run_id, source):
+    """
+    Stored columns of one chunk of a *_with_fips.csv file (read with dtype=str).
+
+    Columns the file does not have are left empty; 'lat'/'lon' are accepted for the coordinates.
+
+    Returns:
+    pandas.DataFrame: Rows with the COLUMNS of the linkage table
+    """
+    output = pd.DataFrame(index=frame.index)
+    for column, candidates in SOURCE_COLUMNS.items():
+        found = next((c for c in candidates if c in frame.columns), None)
+        output[column] = frame[found] if found else None
+    for column in ID_COLUMNS:
+        # Identifiers that went through a float column come back as '12.0'
+        output[column] = output[column].str.replace(r'\.0$', '', regex=True)
+    output['fips'] = output['fips'].where(output['fips'].str.strip() != '')
+    output['year'] = pd.to_numeric(output['year'], errors='coerce').astype('Int64')
+    output['latitude'] = pd.to_numeric(output['latitude'], errors='coerce')
+    output['longitude'] = pd.to_numeric(output['longitude'], errors='coerce')
+    output['spatial_key'] = spatial_key(output['latitude'], output['longitude'])
+    output['run_id'] = run_id
+    output['source'] = source
+    return output[list(COLUMNS)]
+
+def iter_result_chunks(paths, chunk_rows=CHUNK_ROWS):
+    """
+    Yield (source, chunk) for every *_with_fips.csv file in `paths`.
+
+    Parameters:
+    paths (list of str): Result CSV files, zip archives (their *_with_fips.csv members are read)
+                         or folders (their zip archives and result files are read)
+    chunk_rows (int): Rows per chunk
+
+    Yields:
+    tuple: (source name, pandas.DataFrame with the file's columns as str)
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(n for n in os.listdir(path) if n.endswith('.zip') or n.endswith(RESULT_SUFFIX))
+            yield from iter_result_chunks([os.path.join(path, n) for n in names], chunk_rows)
+        elif path.endswith('.zip'):
+            with zipfile.ZipFile(path) as archive:
+                for member in archive.namelist():
+                    if member.endswith(RESULT_SUFFIX):
+                        with archive.open(member) as handle:
+                            for chunk in pd.read_csv(handle, dtype=str, chunksize=chunk_rows):
+                                yield f"{os.path.basename(path)}/{member}", chunk
+        elif os.path.exists(path):
+            for chunk in pd.read_csv(path, dtype=str, chunksize=chunk_rows):
+                yield os.path.basename(path), chunk
+        else:
+            logger.warning(f"Skipping missing result file: {path}")
+
+class ResultsStore:
+    """
+    Linkage results of many runs in one SQLite or DuckDB file.
+
+    Parameters:
+    path (str): Database file (created if missing); a .duckdb path uses DuckDB (needs the duckdb package)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.duckdb = path.endswith('.duckdb')
+        if self.duckdb:
+            try:
+                import duckdb
+            except ImportError:
+                raise ImportError("A .duckdb results store needs the duckdb package (pip install duckdb)")
+            self.conn = duckdb.connect(path)
+        else:
+            self.conn = sqlite3.connect(path)
+        columns = ', '.join(f"{name} {kind}" for name, kind in COLUMNS.items())
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {TABLE} ({columns})")
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {RUNS_TABLE} (run_id TEXT PRIMARY KEY, tool TEXT, loaded_at TEXT, row_count BIGINT, sources TEXT)")
+        for name, columns in INDEXES.items():
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {TABLE} {columns}")
+        if not self.duckdb:
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def _insert(self, table, frame):
+        if self.duckdb:
+            self.conn.register('chunk', frame)
+            self.conn.execute(f"INSERT INTO {table} SELECT * FROM chunk")
+            self.conn.unregister('chunk')
+        else:
+            rows = frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None)
+            self.conn.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(frame.columns))})", rows)
+
+    def append_run(self, run_id, tool, paths, chunk_rows=CHUNK_ROWS):
+        """
+        Load the rows of a run's result files, replacing rows loaded earlier under `run_id`.
+
+        Parameters:
+        run_id (str): Run identifier (e.g. the run's output folder name)
+        tool (str): Tool that produced the run
+        paths (list of str): Result files, archives or folders (see iter_result_chunks)
+        chunk_rows (int): Rows read at a time
+
+        Returns:
+        int: Rows loaded
+        """
+        columns = ', '.join(f"{name} {kind}" for name, kind in COLUMNS.items())
+        self.conn.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+        self.conn.execute(f"CREATE TEMP TABLE {STAGING_TABLE} ({columns})")
+        sources = []
+        loaded = 0
+        if self.duckdb:
+            self.conn.begin()  # sqlite3 opens the transaction with the first insert
+        try:
+            for source, chunk in iter_result_chunks(paths, chunk_rows):
+                self._insert(STAGING_TABLE, normalize(chunk, run_id, source))
+                loaded += len(chunk)
+                if source not in sources:
+                    sources.append(source)
+            # Replace the run in one transaction; the database sorts the staged rows on disk if needed
+            self.conn.execute(f"DELETE FROM {TABLE} WHERE run_id = ?", [run_id])
+            self.conn.execute(f"DELETE FROM {RUNS_TABLE} WHERE run_id = ?", [run_id])
+            self.conn.execute(f"INSERT INTO {TABLE} SELECT * FROM {STAGING_TABLE} "
+                              f"ORDER BY fips IS NULL, fips, spatial_key IS NULL, spatial_key, year")
+            self.conn.execute(f"INSERT INTO {RUNS_TABLE} VALUES (?, ?, ?, ?, ?)",
+                              [run_id, tool, datetime.now().isoformat(timespec='seconds'), loaded, ';'.join(sources)])
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self.conn.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+        logger.info(f"Loaded {loaded} rows of run {run_id} from {len(sources)} result files into {self.path}")
+        return loaded
+
+    def query(self, entity_id=None, person_id=None, location_id=None, fips=None, year=None, run_id=None, limit=None):
+        """
+        Stored rows matching every given filter.
+
+        Parameters:
+        entity_id, person_id, location_id (str, optional): Identifier to match
+        fips (str, optional): FIPS code or prefix (e.g. a state '12' or county '12001')
+        year (int, optional): Year of the rows
+        run_id (str, optional): Run to search instead of all runs
+        limit (int, optional): Maximum rows returned
+
+        Returns:
+        pandas.DataFrame: Matching rows without the spatial key, by run, person/entity and year
+        """
+        conditions, params = [], []
+        for column, value in (('entity_id', entity_id), ('person_id', person_id), ('location_id', location_id), ('run_id', run_id)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(str(value))
+        if fips:
+            # A range instead of LIKE, so the FIPS index is used for prefixes too
+            conditions.append("fips >= ? AND fips < ?")
+            params += [fips, fips[:-1] + chr(ord(fips[-1]) + 1)]
+        if year is not None:
+            conditions.append("year = ?")
+            params.append(int(year))
+        columns = ', '.join(c for c in COLUMNS if c != 'spatial_key')
+        sql = f"SELECT {columns} FROM {TABLE}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY run_id, person_id, entity_id, year"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return self._frame(sql, params)
+
+    def runs(self):
+        """Loaded runs, oldest first."""
+        return self._frame(f"SELECT * FROM {RUNS_TABLE} ORDER BY loaded_at, run_id", [])
+
+    def _frame(self, sql, params):
+        if self.duckdb:
+            return self.conn.execute(sql, params).df()
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+def append_run(path, run_id, tool, paths):
+    """Load a run's result files into the results store at `path` (see ResultsStore.append_run)."""
+    store = ResultsStore(path)
+    try:
+        return store.append_run(run_id, tool, paths)
+    finally:
+        store.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Queryable store of linkage results across runs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    load = subparsers.add_parser('load', help='Load the result files or zip archives of a finished run')
+    load.add_argument('--db', required=True, help='Results store (SQLite, or DuckDB for a .duckdb path)')
+    load.add_argument('--run-id', required=True, help='Run identifier; loading a run again replaces its rows')
+    load.add_argument('--tool', default='', help='Tool that produced the run (recorded with the run)')
+    load.add_argument('paths', nargs='+', help='*_with_fips.csv files, zip archives or folders holding them')
+    query = subparsers.add_parser('query', help='Print the stored rows matching the filters as CSV')
+    query.add_argument('--db', required=True, help='Results store')
+    query.add_argument('--entity', default=None, help='entity_id')
+    query.add_argument('--person', default=None, help='person_id')
+    query.add_argument('--location', default=None, help='location_id')
+    query.add_argument('--fips', default=None, help='FIPS code or prefix (state, county, tract)')
+    query.add_argument('--year', type=int, default=None, help='Year')
+    query.add_argument('--run-id', default=None, help='Search only this run')
+    query.add_argument('--limit', type=int, default=None, help='Maximum rows printed')
+    query.add_argument('--output', default=None, help='Write the rows to this CSV file instead of printing them')
+    runs = subparsers.add_parser('runs', help='List the loaded runs')
+    runs.add_argument('--db', required=True, help='Results store')
+    args = parser.parse_args()
+
+    if args.command != 'load' and not os.path.exists(args.db):
+        logger.error(f"Results store not found: {args.db}")
+        sys.exit(1)
+    store = ResultsStore(args.db)
+    try:
+        if args.command == 'load':
+            store.append_run(args.run_id, args.tool, args.paths)
+        elif args.command == 'query':
+            rows = store.query(args.entity, args.person, args.location, args.fips, args.year, args.run_id, args.limit)
+            if args.output:
+                rows.to_csv(args.output, index=False)
+                logger.info(f"{len(rows)} rows written to {args.output}")
+            else:
+                rows.to_csv(sys.stdout, index=False)
+        else:
+            store.runs().to_csv(sys.stdout, index=False)
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
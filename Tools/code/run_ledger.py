@@ -0,0 +1,106 @@
+import os
+import json
+import threading
+from datetime import datetime
+
+# -------------------------------------------------------------------
+# Run ledger for checkpointed, resumable runs.
+# A small JSON file inside the run directory records every completed unit of
+# work (extracted batch, linked file, packaging step). The ledger and every
+# output registered with it are written to a temporary '.part' path first and
+# renamed into place, so a crash never leaves a partial file that looks complete.
+# -------------------------------------------------------------------
+
+PART_SUFFIX = '.part'
+
+def part_path(path):
+    """Temporary path a file is written to before being renamed into place."""
+    return path + PART_SUFFIX
+
+def is_part_file(path):
+    return path.endswith(PART_SUFFIX)
+
+def commit_part(path):
+    """Atomically move `path`.part to `path`."""
+    os.replace(part_path(path), path)
+    return path
+
+def write_csv_atomic(df, path, **kwargs):
+    """DataFrame.to_csv through a temporary file and an atomic rename."""
+    kwargs.setdefault('index', False)
+    df.to_csv(part_path(path), **kwargs)
+    return commit_part(path)
+
+
+class RunLedger:
+    """
+    JSON ledger of completed units of work, stored as run_ledger.json in the run directory.
+
+    Units are free-form string keys ('extract:Latlong', 'link:OMOP_data/...'); each maps
+    to a dict of fields. Paths stored in the ledger are relative to the run directory.
+    """
+
+    FILENAME = 'run_ledger.json'
+
+    def __init__(self, run_dir):
+        self.run_dir = os.path.abspath(run_dir)
+        self.path = os.path.join(self.run_dir, self.FILENAME)
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self._data = json.load(f)
+        else:
+            self._data = {'created': datetime.now().isoformat(timespec='seconds'), 'config': {}, 'units': {}}
+
+    @property
+    def config(self):
+        return self._data['config']
+
+    def set_config(self, **config):
+        with self._lock:
+            self._data['config'].update(config)
+            self._save()
+
+    def relative(self, path):
+        return os.path.relpath(os.path.abspath(path), self.run_dir)
+
+    def absolute(self, path):
+        return os.path.join(self.run_dir, path)
+
+    def get(self, unit):
+        with self._lock:
+            return dict(self._data['units'].get(unit, {}))
+
+    def is_done(self, unit):
+        return self.get(unit).get('done', False)
+
+    def units(self, prefix):
+        """Return {unit: fields} for every unit whose key starts with `prefix`."""
+        with self._lock:
+            return {k: dict(v) for k, v in self._data['units'].items() if k.startswith(prefix)}
+
+    def update(self, unit, **fields):
+        with self._lock:
+            record = self._data['units'].setdefault(unit, {})
+            record.update(fields)
+            record['updated'] = datetime.now().isoformat(timespec='seconds')
+            self._save()
+
+    def mark_done(self, unit, **fields):
+        self.update(unit, done=True, **fields)
+
+    def append(self, unit, field, item):
+        """Append `item` to the list `field` of a unit."""
+        with self._lock:
+            record = self._data['units'].setdefault(unit, {})
+            record.setdefault(field, []).append(item)
+            record['updated'] = datetime.now().isoformat(timespec='seconds')
+            self._save()
+
+    def _save(self):
+        tmp = part_path(self.path)
+        with open(tmp, 'w') as f:
+            json.dump(self._data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
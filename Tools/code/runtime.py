@@ -0,0 +1,47 @@
+import os
+import sys
+import importlib.util
+
+# -------------------------------------------------------------------
+# Runtime helpers shared by the CLI tools and the library API.
+# Heavy dependencies (pandas, sqlalchemy, pyarrow) are imported lazily so that
+# importing a tool or running `--help` does not pay for them, and container
+# settings are read when a container is started rather than at import time.
+# -------------------------------------------------------------------
+
+def lazy_import(name):
+    """
+    Return a module object whose real import is deferred until the first attribute access.
+
+    Only top-level packages should be passed here (locating a submodule imports its parent).
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+def preload(*modules):
+    """
+    Finish loading lazily imported modules now.
+
+    Call before starting worker threads: before Python 3.12 the first attribute access of a
+    lazy module is not thread-safe, and concurrent first accesses can see a half-loaded module.
+    """
+    for module in modules:
+        getattr(module, '__name__')  # any attribute access triggers the real import
+
+def get_host_base():
+    """
+    Host path of the workspace mounted at /workspace, needed to bind-mount files into DeGAUSS containers.
+    """
+    host_base = os.environ.get("HOST_PWD")
+    if not host_base:
+        raise RuntimeError("HOST_PWD is not set. Run the container with -e HOST_PWD=\"$(pwd)\" so DeGAUSS containers can mount the workspace.")
+    return host_base
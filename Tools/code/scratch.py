@@ -0,0 +1,154 @@
+import os
+import re
+import shutil
+import threading
+from loguru import logger
+
+# -------------------------------------------------------------------
+# Scratch-space accounting.
+# Intermediate files (geocoder and census outputs, joined visit files,
+# extracted OMOP batches) are registered with a ScratchManager when they are
+# written and deleted as soon as the stage consuming them has finished,
+# instead of staying on disk until the cleanup at the end of the run.
+# With a budget, new work (the next input file or extracted batch) is only
+# admitted while the tracked bytes plus a reservation for every unit of work
+# in progress stay under it; a unit is always admitted when nothing else is in
+# progress, so a run never stalls. The high-water mark is logged at the end.
+# -------------------------------------------------------------------
+
+# Reservation for a unit of work, as a multiple of its input size: geocoder
+# output, one census output per vintage and the final file
+FOOTPRINT_FACTOR = 4
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+def parse_size(text):
+    """
+    Parse a size such as '500M', '20G' or '1.5T' (binary units, optional trailing B) into bytes.
+
+    Raises:
+    ValueError: If the text is not a size
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*', str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Not a size: {text!r} (expected e.g. 500M, 20G)")
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+def format_size(nbytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(nbytes) < 1024:
+            return f"{nbytes:.1f} {unit}" if unit != 'B' else f"{nbytes} B"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TB"
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+class ScratchManager:
+    """
+    Tracks the intermediate files of a run, deletes them eagerly and enforces an optional budget.
+
+    Parameters:
+    budget (int, optional): Bytes of scratch space new work may use (no limit when omitted)
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.on_disk = 0
+        self.high_water = 0
+        self.throttled = set()  # units that had to wait for room
+        self._files = {}
+        self._reserved = {}
+        self._cond = threading.Condition()
+
+    def track(self, path):
+        """Register a file (or folder) just written; returns `path`."""
+        if path is None:
+            return path
+        size = _size(path)
+        with self._cond:
+            self.on_disk += size - self._files.get(path, 0)
+            self._files[path] = size
+            self.high_water = max(self.high_water, self.on_disk)
+        return path
+
+    def release(self, *paths):
+        """Delete intermediates whose consumer has finished."""
+        for path in paths:
+            if path is None:
+                continue
+            with self._cond:
+                size = self._files.pop(path, None)
+                if size is None:
+                    size = _size(path)
+                else:
+                    self.on_disk -= size
+                self._cond.notify_all()
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+            logger.debug(f"Released {path} ({format_size(size)})")
+
+    def usage(self):
+        """Tracked bytes on disk plus the reservations of work in progress."""
+        with self._cond:
+            return self.on_disk + sum(self._reserved.values())
+
+    def _fits(self, nbytes):
+        return self.budget is None or not self._reserved or self.on_disk + sum(self._reserved.values()) + nbytes <= self.budget
+
+    def admit(self, unit, nbytes, force=False):
+        """
+        Start a unit of work expected to need `nbytes` of scratch space, if the budget allows.
+
+        Returns:
+        bool: True if the unit was admitted (its reservation is held until finish(unit))
+        """
+        with self._cond:
+            if not (force or self._fits(nbytes)):
+                self.throttled.add(unit)
+                return False
+            self._reserved[unit] = nbytes
+            return True
+
+    def wait_admit(self, unit, nbytes):
+        """Block until `unit` is admitted (used by producers such as the OMOP extraction)."""
+        with self._cond:
+            if not self._fits(nbytes):
+                self.throttled.add(unit)
+                logger.info(f"Scratch budget reached ({format_size(self.usage())} of {format_size(self.budget)}), waiting before {unit}")
+                self._cond.wait_for(lambda: self._fits(nbytes))
+            self._reserved[unit] = nbytes
+
+    def finish(self, unit):
+        """Drop the reservation of a unit of work that has completed (or failed)."""
+        with self._cond:
+            self._reserved.pop(unit, None)
+            self._cond.notify_all()
+
+    def report(self):
+        budget = f" of a {format_size(self.budget)} budget, {len(self.throttled)} unit(s) of work had to wait" if self.budget else ""
+        logger.info(f"Scratch high-water mark: {format_size(self.high_water)}{budget}")
+        return self.high_water
+
+class StageGate:
+    """
+    Admission control for StageScheduler: a task starting new work reserves
+    `factor` times its size and releases the reservation when its chain of stages is over.
+    """
+
+    def __init__(self, scratch, factor=FOOTPRINT_FACTOR):
+        self.scratch = scratch
+        self.factor = factor
+
+    def admit(self, task, force):
+        return self.scratch.admit(task.name, task.size * self.factor, force)
+
+    def finish(self, task):
+        self.scratch.finish(task.name)
@@ -0,0 +1,158 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from loguru import logger
+
+# -------------------------------------------------------------------
+# Resource-aware stage scheduler.
+# Work on every file is split into stage tasks (read, geocode, one FIPS task
+# per vintage, combine) that form a small DAG. Each task names the resource it
+# occupies; every resource has its own concurrency limit, so the geocoder
+# container, the census container and CPU-bound pandas work are kept busy
+# independently instead of one large file holding a whole worker. Ready tasks
+# are started largest-first, so the longest chains begin as early as possible.
+# -------------------------------------------------------------------
+
+# Default concurrency per resource
+DEFAULT_LIMITS = {
+    'geocoder': 1,   # DeGAUSS geocoder containers (or the local geocoder)
+    'census': 2,     # DeGAUSS census_block_group containers
+    'cpu': 2,        # reading, merging and writing with pandas
+}
+
+class Task:
+    """One stage of work. `fn` is called with the results of `deps`, in order."""
+
+    def __init__(self, name, fn, resource, deps, size):
+        self.name = name
+        self.fn = fn
+        self.resource = resource
+        self.deps = list(deps)
+        self.size = size
+        self.result = None
+        self.error = None
+        self.state = 'waiting'   # waiting -> running -> done | failed | skipped
+
+def file_size(path):
+    """Size of a file in bytes (0 if it cannot be read), used as task priority."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+class StageScheduler:
+    """
+    DAG scheduler with a separate concurrency limit per resource.
+
+    Usage:
+        scheduler = StageScheduler({'geocoder': 1, 'census': 2, 'cpu': 2})
+        read = scheduler.add('a.csv:read', read_fn, 'cpu', size=file_size('a.csv'))
+        geo = scheduler.add('a.csv:geocode', geocode_fn, 'geocoder', deps=[read], size=read.size)
+        scheduler.run()
+
+    A task whose dependency failed (or returned None) is skipped, as are its own dependents.
+
+    An optional `gate` (e.g. scratch.StageGate) controls when new work starts: a task without
+    dependencies only starts once gate.admit(task, force) returns True, and gate.finish(task) is
+    called when every stage depending on it is over. `force` is True when nothing is running,
+    so a closed gate can delay work but never stall the run.
+    """
+
+    def __init__(self, limits=None, gate=None):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update({k: v for k, v in (limits or {}).items() if v})
+        self.tasks = []
+        self.gate = gate
+        self._admitted = []
+        self._lock = threading.Lock()
+
+    def add(self, name, fn, resource='cpu', deps=(), size=0):
+        if resource not in self.limits:
+            raise ValueError(f"Unknown resource: {resource} (expected one of {sorted(self.limits)})")
+        task = Task(name, fn, resource, deps, size)
+        with self._lock:
+            self.tasks.append(task)
+        return task
+
+    def _skip_blocked(self):
+        # Repeat until stable, so a skip reaches dependents added in any order
+        changed = True
+        while changed:
+            changed = False
+            for task in self.tasks:
+                if task.state == 'waiting' and any(dep.state in ('failed', 'skipped') or (dep.state == 'done' and dep.result is None) for dep in task.deps):
+                    task.state = 'skipped'
+                    changed = True
+                    logger.debug(f"Skipping {task.name}: an earlier stage produced no result")
+
+    def _ready(self):
+        self._skip_blocked()
+        ready = [task for task in self.tasks if task.state == 'waiting' and all(dep.state == 'done' for dep in task.deps)]
+        # Largest first; ties keep insertion order
+        ready.sort(key=lambda t: -t.size)
+        return ready
+
+    def _settle(self):
+        # Tell the gate about admitted roots whose whole chain of stages has ended
+        self._skip_blocked()
+        for root in list(self._admitted):
+            chain = {root}
+            changed = True
+            while changed:
+                changed = False
+                for task in self.tasks:
+                    if task not in chain and any(dep in chain for dep in task.deps):
+                        chain.add(task)
+                        changed = True
+            if all(task.state in ('done', 'failed', 'skipped') for task in chain):
+                self._admitted.remove(root)
+                self.gate.finish(root)
+
+    def _execute(self, task):
+        return task.fn(*[dep.result for dep in task.deps])
+
+    def run(self):
+        """
+        Run every task, respecting dependencies and resource limits.
+
+        Tasks may add further tasks while running (e.g. one FIPS task per vintage found in the data).
+
+        Returns:
+        dict: task name -> result (None for failed or skipped tasks)
+        """
+        running = {}
+        in_use = {resource: 0 for resource in self.limits}
+        with ThreadPoolExecutor(max_workers=sum(self.limits.values())) as executor:
+            while True:
+                with self._lock:
+                    for task in self._ready():
+                        if in_use[task.resource] >= self.limits[task.resource]:
+                            continue
+                        if self.gate and not task.deps:
+                            if not self.gate.admit(task, not running):
+                                continue
+                            self._admitted.append(task)
+                        task.state = 'running'
+                        in_use[task.resource] += 1
+                        running[executor.submit(self._execute, task)] = task
+                        logger.debug(f"Started {task.name} on {task.resource} ({in_use[task.resource]}/{self.limits[task.resource]})")
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    in_use[task.resource] -= 1
+                    try:
+                        task.result = future.result()
+                        task.state = 'done'
+                    except Exception as e:
+                        task.error = e
+                        task.state = 'failed'
+                        logger.error(f"Error in {task.name}: {e}")
+                if self.gate:
+                    with self._lock:
+                        self._settle()
+        stuck = [t.name for t in self.tasks if t.state == 'waiting']
+        if stuck:
+            logger.error(f"Tasks never became ready (dependency cycle?): {stuck}")
+        return {task.name: task.result for task in self.tasks}
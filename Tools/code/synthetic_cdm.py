@@ -0,0 +1,373 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+from loguru import logger
+from runtime import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+sqlalchemy = lazy_import('sqlalchemy')
+
+# -------------------------------------------------------------------
+# Synthetic OMOP CDM generator and extraction benchmark.
+# `generate` writes PERSON, VISIT_OCCURRENCE, LOCATION and LOCATION_HISTORY at
+# any scale, in chunks of persons, to CSV files, a SQLite database and/or a
+# DuckDB database:
+#   - visits per person follow a negative binomial (most persons have a few
+#     visits, some have many); 85% are same-day visits, the rest inpatient stays
+#   - each person has 1 + Poisson(--moves) residences with contiguous
+#     LOCATION_HISTORY intervals; visits spanning a move are dropped by the
+#     extraction, as in real data
+#   - each residence is a valid lat/long, address-only or invalid location in
+#     the requested fractions
+# `bench` runs OMOP_to_FIPS extraction and linkage against such a database with
+# the stub geocoder and FIPS backends (no containers) and reports the
+# extraction throughput, the rows per category and the time of every stage.
+#
+#   python synthetic_cdm.py generate --persons 100000 --sqlite cdm.sqlite
+#   python synthetic_cdm.py bench --db cdm.sqlite --workers 4
+# -------------------------------------------------------------------
+
+SCHEMA = 'CDM'
+TABLES = ['PERSON', 'VISIT_OCCURRENCE', 'LOCATION', 'LOCATION_HISTORY']
+
+# Date ranges
+HISTORY_START = '1998-01-01'
+HISTORY_END = '2099-12-31'
+MOVES_FROM = '2000-01-01'
+VISITS_FROM = '2010-01-01'
+VISITS_TO = '2024-12-31'
+
+SAME_DAY_VISITS = 0.85   # share of outpatient visits; the rest last a geometric number of days
+VISIT_DISPERSION = 0.5   # negative binomial shape: lower is more skewed
+
+# City, state, ZIP and centre of the places synthetic addresses are drawn from
+PLACES = [
+    ('FRESNO', 'CA', '93703', 36.7589, -119.7902),
+    ('GAINESVILLE', 'FL', '32608', 29.6516, -82.3248),
+    ('JACKSONVILLE', 'FL', '32207', 30.2966, -81.6385),
+    ('MIAMI', 'FL', '33127', 25.8090, -80.2060),
+    ('ATLANTA', 'GA', '30309', 33.7984, -84.3883),
+    ('CHICAGO', 'IL', '60614', 41.9227, -87.6533),
+    ('HOUSTON', 'TX', '77004', 29.7245, -95.3626),
+    ('DENVER', 'CO', '80205', 39.7589, -104.9658),
+    ('SEATTLE', 'WA', '98103', 47.6718, -122.3410),
+    ('BOSTON', 'MA', '02130', 42.3097, -71.1150),
+]
+STREETS = ['MAIN ST', 'OAK AVE', 'PINE ST', 'MAPLE DR', 'CEDAR LN', 'ELM ST', 'WASHINGTON BLVD', 'LAKE RD',
+           'HILL ST', 'PARK AVE', 'N BLACKSTONE AVE', 'E CLINTON AVE', 'SW 13TH ST', 'NW 25TH ST', 'PEACHTREE RD NE']
+
+def _day(date):
+    """Days since 1970-01-01."""
+    return int(np.datetime64(date, 'D').astype(int))
+
+def _dates(days):
+    return days.astype('datetime64[D]').astype(str)
+
+def generate_chunk(rng, first_person, persons, first_location, first_visit, visits_per_person=8.0, moves=0.4,
+                   latlong_fraction=0.6, address_fraction=0.3):
+    """
+    One chunk of the synthetic CDM.
+
+    Parameters:
+    rng (numpy.random.Generator): Random source
+    first_person, first_location, first_visit (int): First id of each table in this chunk
+    persons (int): Persons in the chunk
+    visits_per_person (float): Mean visits per person
+    moves (float): Mean number of moves per person
+    latlong_fraction, address_fraction (float): Shares of locations with coordinates / with an address only;
+        the rest has neither
+
+    Returns:
+    dict: table name -> DataFrame
+    """
+    person_id = np.arange(first_person, first_person + persons)
+
+    # Residences: contiguous history intervals, the first one open since HISTORY_START
+    residences = 1 + rng.poisson(moves, persons)
+    owner = np.repeat(person_id, residences)
+    first = np.cumsum(residences) - residences
+    start = rng.integers(_day(MOVES_FROM), _day(VISITS_TO), len(owner))
+    start[first] = _day(HISTORY_START)
+    start = start[np.lexsort((start, owner))]
+    end = np.append(start[1:] - 1, 0)
+    last = np.append(owner[1:] != owner[:-1], True)
+    end[last] = _day(HISTORY_END)
+    location_id = np.arange(first_location, first_location + len(owner))
+
+    # Locations: coordinates and address, address only, or nothing usable
+    kind = rng.choice(3, len(owner), p=[latlong_fraction, address_fraction, 1 - latlong_fraction - address_fraction])
+    place = rng.integers(0, len(PLACES), len(owner))
+    places = pd.DataFrame(PLACES, columns=['city', 'state', 'zip', 'lat', 'lon']).iloc[place].reset_index(drop=True)
+    address_1 = pd.Series(rng.integers(1, 9999, len(owner)).astype(str)) + ' ' + pd.Series(np.array(STREETS)[rng.integers(0, len(STREETS), len(owner))])
+    has_coordinates = kind == 0
+    location = pd.DataFrame({
+        'location_id': location_id,
+        'address_1': address_1.where(kind != 2),
+        'address_2': None,
+        'city': places['city'],
+        'state': places['state'],
+        'zip': places['zip'],
+        'county': None,
+        'location_source_value': None,
+        'country_concept_id': 42046186,
+        'country_source_value': 'UNITED STATES OF AMERICA',
+        'latitude': np.where(has_coordinates, places['lat'] + rng.normal(0, 0.05, len(owner)), np.nan).round(6),
+        'longitude': np.where(has_coordinates, places['lon'] + rng.normal(0, 0.05, len(owner)), np.nan).round(6),
+    })
+    history = pd.DataFrame({
+        'location_id': location_id,
+        'relationship_type_concept_id': 32848,
+        'domain_id': 1147314,
+        'entity_id': owner,
+        'start_date': _dates(start),
+        'end_date': _dates(end),
+    })
+    person = pd.DataFrame({
+        'person_id': person_id,
+        'gender_concept_id': rng.choice([8507, 8532], persons),
+        'year_of_birth': rng.integers(1930, 2020, persons),
+        'race_concept_id': rng.choice([8527, 8516, 8515, 0], persons, p=[0.6, 0.2, 0.05, 0.15]),
+        'ethnicity_concept_id': rng.choice([38003563, 38003564], persons, p=[0.2, 0.8]),
+        'location_id': location_id[last],
+    })
+
+    # Visits: negative binomial count per person, sorted by person and date, ids in that order
+    counts = rng.negative_binomial(VISIT_DISPERSION, VISIT_DISPERSION / (VISIT_DISPERSION + visits_per_person), persons)
+    visitor = np.repeat(person_id, counts)
+    visit_start = rng.integers(_day(VISITS_FROM), _day(VISITS_TO) + 1, len(visitor))
+    order = np.lexsort((visit_start, visitor))
+    visitor, visit_start = visitor[order], visit_start[order]
+    length = np.where(rng.random(len(visitor)) < SAME_DAY_VISITS, 0, rng.geometric(0.25, len(visitor)))
+    visit = pd.DataFrame({
+        'visit_occurrence_id': np.arange(first_visit, first_visit + len(visitor)),
+        'person_id': visitor,
+        'visit_concept_id': np.where(length == 0, 9202, 9201),
+        'visit_start_date': _dates(visit_start),
+        'visit_end_date': _dates(visit_start + length),
+        'visit_type_concept_id': 32817,
+    })
+    return {'PERSON': person, 'VISIT_OCCURRENCE': visit, 'LOCATION': location, 'LOCATION_HISTORY': history}
+
+class CsvTarget:
+    """Appends every chunk to <folder>/<TABLE>.csv."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        for table in TABLES:
+            if os.path.exists(self._path(table)):
+                os.remove(self._path(table))
+
+    def _path(self, table):
+        return os.path.join(self.folder, f'{table}.csv')
+
+    def write(self, table, df):
+        path = self._path(table)
+        df.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+
+    def close(self):
+        pass
+
+class SqliteTarget:
+    """SQLite database; cdm_engine() attaches it as the CDM schema the extraction queries use."""
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+
+    def write(self, table, df):
+        df.to_sql(table, self.conn, if_exists='append', index=False)
+
+    def close(self):
+        self.conn.execute("CREATE INDEX idx_visit_person ON VISIT_OCCURRENCE (person_id)")
+        self.conn.execute("CREATE INDEX idx_history_entity ON LOCATION_HISTORY (entity_id)")
+        self.conn.execute("CREATE UNIQUE INDEX idx_location ON LOCATION (location_id)")
+        self.conn.commit()
+        self.conn.close()
+
+class DuckdbTarget:
+    """DuckDB database with the tables in a CDM schema (needs the duckdb package)."""
+
+    def __init__(self, path):
+        try:
+            import duckdb
+        except ImportError:
+            raise ImportError("--duckdb needs the duckdb package (pip install duckdb)")
+        if os.path.exists(path):
+            os.remove(path)
+        self.conn = duckdb.connect(path)
+        self.conn.execute(f"CREATE SCHEMA {SCHEMA}")
+        self.created = set()
+
+    def write(self, table, df):
+        self.conn.register('chunk', df)
+        if table in self.created:
+            self.conn.execute(f"INSERT INTO {SCHEMA}.{table} SELECT * FROM chunk")
+        else:
+            self.conn.execute(f"CREATE TABLE {SCHEMA}.{table} AS SELECT * FROM chunk")
+            self.created.add(table)
+        self.conn.unregister('chunk')
+
+    def close(self):
+        self.conn.close()
+
+def generate(targets, persons, chunk_persons=100000, seed=42, **distribution):
+    """
+    Write a synthetic CDM of `persons` persons to every target, one chunk of persons at a time.
+
+    Parameters:
+    targets (list): CsvTarget / SqliteTarget / DuckdbTarget
+    persons (int): Number of persons
+    chunk_persons (int): Persons generated and written per chunk (bounds memory)
+    seed (int): Random seed; the same seed and settings give the same CDM
+    distribution: visits_per_person, moves, latlong_fraction, address_fraction (see generate_chunk)
+
+    Returns:
+    dict: Rows written per table
+    """
+    rng = np.random.default_rng(seed)
+    rows = dict.fromkeys(TABLES, 0)
+    next_location = next_visit = 1
+    for first_person in range(1, persons + 1, chunk_persons):
+        chunk = generate_chunk(rng, first_person, min(chunk_persons, persons + 1 - first_person), next_location, next_visit, **distribution)
+        for table, df in chunk.items():
+            for target in targets:
+                target.write(table, df)
+            rows[table] += len(df)
+        next_location += len(chunk['LOCATION'])
+        next_visit += len(chunk['VISIT_OCCURRENCE'])
+        logger.info(f"Generated persons {first_person}-{first_person + len(chunk['PERSON']) - 1}")
+    for target in targets:
+        target.close()
+    logger.info(f"Synthetic CDM: {rows}")
+    return rows
+
+def _year(value):
+    return None if value is None else int(str(value)[:4])
+
+def cdm_engine(path):
+    """
+    SQLAlchemy engine for a generated database: DuckDB for *.duckdb (needs duckdb_engine),
+    otherwise SQLite, attached as the CDM schema with the YEAR() function the queries use.
+    """
+    if path.endswith('.duckdb'):
+        return sqlalchemy.create_engine(f'duckdb:///{os.path.abspath(path)}')
+    engine = sqlalchemy.create_engine(f'sqlite:///{os.path.abspath(path)}')
+
+    @sqlalchemy.event.listens_for(engine, 'connect')
+    def _attach(dbapi_connection, connection_record):
+        dbapi_connection.create_function('year', 1, _year, deterministic=True)
+        dbapi_connection.execute(f"ATTACH DATABASE ? AS {SCHEMA}", (os.path.abspath(path),))
+
+    return engine
+
+def benchmark(db, output_dir=None, workers=2, batch_rows=100000, extract_format='csv'):
+    """
+    Time OMOP_to_FIPS extraction, LOCATION_HISTORY export, linkage and LOCATION.csv against
+    a generated database, with the stub geocoder and FIPS backends.
+
+    Returns:
+    dict: Table sizes, rows per category and seconds per stage
+    """
+    import backends
+    import OMOP_to_FIPS as omop
+    from arrow_sink import read_extracted
+
+    backends.configure('stub', None, 'stub')
+    engine = cdm_engine(db)
+    with engine.connect() as conn:
+        tables = {table: conn.execute(sqlalchemy.text(f"SELECT COUNT(*) FROM {SCHEMA}.{table}")).scalar() for table in TABLES}
+    run_dir = omop.setup_run(output_dir or tempfile.mkdtemp(prefix='cdm_bench_'))
+    report = {'database': db, 'run_dir': run_dir, 'tables': tables, 'workers': workers, 'batch_rows': batch_rows, 'seconds': {}}
+
+    started = time.perf_counter()
+    omop.omop_extraction(None, None, None, None, None, extract_format, batch_rows, engine=engine)
+    report['seconds']['extraction'] = time.perf_counter() - started
+    folders = {category: os.path.join(omop.linkage_data_dir, folder) for category, folder in
+               [('Latlong', 'valid_lat_long'), ('Address', 'valid_address'), ('Invalid', 'invalid_lat_lon_address')]}
+    report['rows'] = {category: sum(len(read_extracted(os.path.join(folder, name))) for name in os.listdir(folder))
+                      for category, folder in folders.items()}
+    extracted = sum(report['rows'].values())
+    report['extraction_rows_per_second'] = extracted / max(report['seconds']['extraction'], 1e-9)
+
+    stage = time.perf_counter()
+    omop.export_location_history(None, None, None, None, None, engine=engine)
+    report['seconds']['location_history'] = time.perf_counter() - stage
+    stage = time.perf_counter()
+    omop.process_directories(list(folders.values()), workers=workers)
+    report['seconds']['linkage'] = time.perf_counter() - stage
+    report['linkage_rows_per_second'] = extracted / max(report['seconds']['linkage'], 1e-9)
+    stage = time.perf_counter()
+    omop.create_location_csv(run_dir)
+    report['seconds']['location_csv'] = time.perf_counter() - stage
+    report['seconds']['end_to_end'] = time.perf_counter() - started
+
+    logger.info(f"Tables: {tables}")
+    logger.info(f"Extraction: {extracted} rows in {report['seconds']['extraction']:.2f} s "
+                f"({report['extraction_rows_per_second']:.0f} rows/s); per category {report['rows']}")
+    logger.info(f"LOCATION_HISTORY export: {report['seconds']['location_history']:.2f} s")
+    logger.info(f"Linkage (stub backends, {workers} workers): {report['seconds']['linkage']:.2f} s "
+                f"({report['linkage_rows_per_second']:.0f} rows/s)")
+    logger.info(f"LOCATION.csv: {report['seconds']['location_csv']:.2f} s")
+    logger.info(f"End to end: {report['seconds']['end_to_end']:.2f} s (outputs in {run_dir})")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic OMOP CDM generator and extraction benchmark')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    gen = subparsers.add_parser('generate', help='Write a synthetic PERSON / VISIT_OCCURRENCE / LOCATION / LOCATION_HISTORY')
+    gen.add_argument('--persons', type=int, required=True, help='Number of persons')
+    gen.add_argument('--csv', help='Folder to write the tables to as CSV files')
+    gen.add_argument('--sqlite', help='SQLite file to write')
+    gen.add_argument('--duckdb', help='DuckDB file to write (needs the duckdb package)')
+    gen.add_argument('--visits-per-person', type=float, default=8.0, help='Mean visits per person (default 8)')
+    gen.add_argument('--moves', type=float, default=0.4, help='Mean moves per person (default 0.4)')
+    gen.add_argument('--latlong-fraction', type=float, default=0.6, help='Share of locations with coordinates (default 0.6)')
+    gen.add_argument('--address-fraction', type=float, default=0.3, help='Share of locations with an address only (default 0.3); the rest is invalid')
+    gen.add_argument('--chunk-persons', type=int, default=100000, help='Persons generated per chunk (default 100000)')
+    gen.add_argument('--seed', type=int, default=42, help='Random seed (default 42)')
+    bench = subparsers.add_parser('bench', help='Time OMOP_to_FIPS extraction and linkage against a generated database (stub backends)')
+    bench.add_argument('--db', required=True, help='SQLite (or *.duckdb, needs duckdb_engine) database written by generate')
+    bench.add_argument('--output', help='Run directory (default: a new temporary folder)')
+    bench.add_argument('--workers', type=int, default=2, help='Batch files linked concurrently (default 2)')
+    bench.add_argument('--batch-rows', type=int, default=100000, help='Rows per extracted batch file (default 100000)')
+    bench.add_argument('--extract-format', choices=['csv', 'csv.gz', 'parquet'], default='csv', help='File format of extracted batches (default csv)')
+    bench.add_argument('--report', help='Also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, format="{time} {level} {message}", level="INFO")
+    if args.command == 'generate':
+        if not (args.csv or args.sqlite or args.duckdb):
+            parser.error('give at least one of --csv, --sqlite, --duckdb')
+        if args.latlong_fraction + args.address_fraction > 1:
+            parser.error('--latlong-fraction plus --address-fraction must not exceed 1')
+        targets = []
+        try:
+            if args.csv:
+                targets.append(CsvTarget(args.csv))
+            if args.sqlite:
+                targets.append(SqliteTarget(args.sqlite))
+            if args.duckdb:
+                targets.append(DuckdbTarget(args.duckdb))
+        except ImportError as e:
+            logger.error(str(e))
+            sys.exit(1)
+        generate(targets, args.persons, args.chunk_persons, args.seed, visits_per_person=args.visits_per_person,
+                 moves=args.moves, latlong_fraction=args.latlong_fraction, address_fraction=args.address_fraction)
+    elif args.command == 'bench':
+        report = benchmark(args.db, args.output, args.workers, args.batch_rows, args.extract_format)
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
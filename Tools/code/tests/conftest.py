@@ -0,0 +1,14 @@
+import os
+import sys
+import pytest
+
+# The tools import each other as flat modules (run from Tools/code)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope='session')
+def synthetic_cdm_db(tmp_path_factory):
+    """SQLite CDM of 300 persons written by synthetic_cdm.py (open it with synthetic_cdm.cdm_engine)."""
+    import synthetic_cdm
+    path = str(tmp_path_factory.mktemp('cdm') / 'cdm.sqlite')
+    synthetic_cdm.generate([synthetic_cdm.SqliteTarget(path)], 300, seed=7)
+    return path
@@ -0,0 +1,34 @@
+import pandas as pd
+import aggregate
+
+def _linked(person_ids, fips, years):
+    return pd.DataFrame({'person_id': person_ids, 'FIPS': fips, 'year': years})
+
+def test_persons_are_counted_once_across_batches(tmp_path):
+    batches = [
+        _linked([1, 1, 2], ['12001000100', '12001000100', '12001000100'], [2015, 2015, 2015]),
+        _linked([1, 3, 3], ['12001000100', '12001000100', None], [2015, 2015, 2016]),
+    ]
+    for n, batch in enumerate(batches):
+        aggregate.write_partial(batch, str(tmp_path / f'batch_{n}{aggregate.PARTIAL_SUFFIX}'), 'address')
+    summary = aggregate.collect_partials(str(tmp_path)).summary()
+    assert summary.astype(object).where(summary.notna(), None).values.tolist() == [
+        ['12001000100', 2015, 5, 3, False],
+        [None, 2016, 1, 1, False],
+    ]
+
+def test_small_cells_are_suppressed():
+    counter = aggregate.FipsCounter(by_category=True)
+    counter.add_frame(_linked([1, 2, 3, 4], ['12001000100'] * 3 + ['12001000200'], [2020] * 4), 'latlong')
+    summary = counter.summary(min_cell_size=2)
+    assert summary['category'].tolist() == ['latlong', 'latlong']
+    assert summary['suppressed'].tolist() == [False, True]
+    assert summary['n_persons'].tolist()[0] == 3
+    assert summary.loc[1, ['n_rows', 'n_persons']].isna().all()
+
+def test_remove_partials(tmp_path):
+    (tmp_path / 'address').mkdir()
+    aggregate.write_partial(_linked([1], ['12001000100'], [2020]), str(tmp_path / 'address' / f'b{aggregate.PARTIAL_SUFFIX}'))
+    (tmp_path / 'address' / 'b_with_fips.csv').write_text('kept\n')
+    assert aggregate.remove_partials(str(tmp_path)) == 1
+    assert [p.name for p in (tmp_path / 'address').iterdir()] == ['b_with_fips.csv']
@@ -0,0 +1,47 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import sqlalchemy
+import arrow_sink
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'source.sqlite'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE t (id INTEGER, v, address TEXT)")
+        # v: integers, then floats, then text, as a loosely typed source column can hold
+        rows = [(i, i, f'{i} Main St') for i in range(1, 5)] + [(5, 2.5, '5 Main St, Apt 2'), (6, 6, 'Say "hi"'), (7, 'n/a', None), (8, 8, '8 Main St')]
+        conn.exec_driver_sql("INSERT INTO t VALUES (?, ?, ?)", rows)
+    return engine
+
+def test_later_batches_widen_the_column_type(engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(arrow_sink, 'FETCH_ROWS', 2)
+    for fmt in arrow_sink.SINK_FORMATS:
+        files = arrow_sink.stream_query_to_files(engine, "SELECT * FROM t ORDER BY id", str(tmp_path / f'out_{fmt}'), fmt=fmt, rows_per_file=None)
+        df = pq.read_table(files[0]).to_pandas() if fmt == 'parquet' else pd.read_csv(files[0], dtype=str, keep_default_na=False)
+        assert df['v'].astype(str).tolist() == ['1', '2', '3', '4', '2.5', '6', 'n/a', '8'], fmt
+        assert df['address'].tolist()[4:6] == ['5 Main St, Apt 2', 'Say "hi"'], fmt
+
+def test_csv_is_quoted_like_pandas(engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(arrow_sink, 'FETCH_ROWS', 4)
+    files = arrow_sink.stream_query_to_files(engine, "SELECT id, address FROM t ORDER BY id", str(tmp_path / 'out_{}'), rows_per_file=3)
+    assert [open(f).read() for f in files] == [
+        'id,address\n1,1 Main St\n2,2 Main St\n3,3 Main St\n',
+        'id,address\n4,4 Main St\n5,"5 Main St, Apt 2"\n6,"Say ""hi"""\n',
+        'id,address\n7,\n8,8 Main St\n',
+    ]
+
+def test_on_file_gets_the_last_row(engine, tmp_path):
+    done = []
+    arrow_sink.stream_query_to_files(engine, "SELECT id FROM t ORDER BY id", str(tmp_path / 'out_{}'), rows_per_file=4,
+                                     on_file=lambda path, rows, last_row: done.append((rows, last_row)))
+    assert done == [(4, {'id': 4}), (4, {'id': 8})]
+
+def test_csv_batch_that_cannot_be_written_raises(tmp_path, monkeypatch):
+    writer = arrow_sink.BatchFileWriter(str(tmp_path / 'out.csv'), pa.schema([('id', pa.int64())]))
+    def write_csv(data, sink, options):
+        raise pa.ArrowInvalid(f'cannot write with quoting {options.quoting_style}')
+    monkeypatch.setattr(writer._csv, 'write_csv', write_csv)
+    with pytest.raises(pa.ArrowInvalid, match='needed'):
+        writer.write(pa.record_batch([pa.array([1])], names=['id']))
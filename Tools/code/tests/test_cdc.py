@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+import cdc
+import synthetic_cdm
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = synthetic_cdm.cdm_engine(str(tmp_path / 'cdm.sqlite'))
+    with engine.begin() as conn:
+        conn.exec_driver_sql("""CREATE TABLE CDM.LOCATION (location_id INTEGER, address_1 TEXT, address_2 TEXT, city TEXT, state TEXT, zip TEXT, county TEXT,
+                                location_source_value TEXT, country_concept_id INTEGER, country_source_value TEXT, latitude REAL, longitude REAL)""")
+        conn.exec_driver_sql("CREATE TABLE CDM.LOCATION_HISTORY (location_id INTEGER, entity_id INTEGER, start_date TEXT, end_date TEXT)")
+        conn.exec_driver_sql("CREATE TABLE CDM.VISIT_OCCURRENCE (visit_occurrence_id INTEGER, person_id INTEGER, visit_start_date TEXT)")
+        for location_id in range(1, 11):
+            conn.exec_driver_sql(f"INSERT INTO CDM.LOCATION (location_id, address_1, city, state, zip) VALUES ({location_id}, '{location_id} Main St', 'Gainesville', 'FL', '32601')")
+        # Persons 1-4 with one to four location rows each
+        for entity_id in range(1, 5):
+            for n in range(entity_id):
+                conn.exec_driver_sql(f"INSERT INTO CDM.LOCATION_HISTORY VALUES ({entity_id + n}, {entity_id}, '20{10 + n}-01-01', NULL)")
+        conn.exec_driver_sql("INSERT INTO CDM.VISIT_OCCURRENCE VALUES (7, 1, '2020-05-01'), (9, 2, '2021-03-02')")
+    return engine
+
+def test_fingerprint_does_not_depend_on_fetch_size(engine, tmp_path):
+    assert cdc.write_fingerprint(engine, str(tmp_path / 'a.csv')) == 4
+    cdc.write_fingerprint(engine, str(tmp_path / 'b.csv'), fetch_rows=3)
+    a = pd.read_csv(tmp_path / 'a.csv', dtype={'checksum': str})
+    assert a['entity_id'].tolist() == [1, 2, 3, 4]
+    assert a['location_rows'].tolist() == [1, 2, 3, 4]
+    pd.testing.assert_frame_equal(a, pd.read_csv(tmp_path / 'b.csv', dtype={'checksum': str}))
+
+def test_prepare_finds_changed_persons(engine, tmp_path):
+    first, second = tmp_path / 'first', tmp_path / 'second'
+    first.mkdir()
+    second.mkdir()
+    changes = cdc.prepare(engine, str(first))
+    assert changes.watermark == {'visit_occurrence_id': 9, 'visit_start_date': '2021-03-02'}
+    assert not changes.incremental
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql("UPDATE CDM.LOCATION SET zip = '32603' WHERE location_id = 4")      # persons 3 and 4
+        conn.exec_driver_sql("INSERT INTO CDM.LOCATION_HISTORY VALUES (10, 5, '2024-01-01', NULL)")  # new person 5
+        conn.exec_driver_sql("INSERT INTO CDM.VISIT_OCCURRENCE VALUES (12, 5, '2024-02-01')")
+    changes = cdc.prepare(engine, str(second), previous_run=str(first))
+    assert changes.incremental
+    assert changes.changed_persons == [3, 4, 5]
+    assert changes.visit_filter() == "p.visit_occurrence_id <= 12 AND (p.visit_occurrence_id > 9 OR p.visit_start_date > '2021-03-02' OR p.person_id IN (3, 4, 5))"
@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+import cdm_writeback
+import synthetic_cdm
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = synthetic_cdm.cdm_engine(str(tmp_path / 'cdm.sqlite'))
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE CDM.LOCATION (location_id BIGINT PRIMARY KEY, latitude VARCHAR(50), longitude VARCHAR(50))")
+        conn.exec_driver_sql("INSERT INTO CDM.LOCATION VALUES (1, NULL, NULL), (2, 'NA', '0'), (3, '29.6', '-82.3')")
+    return engine
+
+def _write_results(folder):
+    (folder / 'address').mkdir(parents=True)
+    pd.DataFrame({
+        'location_id': [1, 2, 3], 'latitude': [29.65, 28.54, 27.95], 'longitude': [-82.32, -81.38, -82.46],
+        'year_for_fips': [2020, 2020, 2020], 'FIPS': ['12001000100', '12095000200', '12057000300'],
+    }).to_csv(folder / 'address' / 'batch_with_fips.csv', index=False)
+    pd.DataFrame({
+        'location_id': [3], 'year_for_fips': [2010], 'FIPS': ['12057000301'],
+    }).to_csv(folder / 'latlong_with_fips.csv', index=False)
+
+def _location(engine):
+    with engine.connect() as conn:
+        return pd.read_sql("SELECT * FROM CDM.LOCATION ORDER BY location_id", conn)
+
+def _mapping(engine):
+    with engine.connect() as conn:
+        return pd.read_sql("SELECT * FROM CDM.LOCATION_FIPS ORDER BY location_id, fips_vintage", conn)
+
+def test_write_back_fills_blanks_and_upserts(engine, tmp_path):
+    _write_results(tmp_path / 'results')
+    updated, upserted = cdm_writeback.write_back_results(engine, str(tmp_path / 'results'))
+    assert (updated, upserted) == (2, 4)
+
+    location = _location(engine)
+    assert location['latitude'].astype(float).tolist() == [29.65, 28.54, 29.6]  # location 3 already had coordinates
+    mapping = _mapping(engine)
+    assert mapping[['location_id', 'fips_vintage', 'fips']].values.tolist() == [
+        [1, 2020, '12001000100'], [2, 2020, '12095000200'], [3, 2010, '12057000301'], [3, 2020, '12057000300']]
+
+def test_write_back_is_idempotent(engine, tmp_path):
+    _write_results(tmp_path / 'results')
+    cdm_writeback.write_back_results(engine, str(tmp_path / 'results'))
+    location, mapping = _location(engine), _mapping(engine)
+
+    updated, _ = cdm_writeback.write_back_results(engine, str(tmp_path / 'results'))
+    assert updated == 0
+    pd.testing.assert_frame_equal(_location(engine), location)
+    pd.testing.assert_frame_equal(_mapping(engine), mapping)
+
+def test_write_back_updates_changed_fips(engine):
+    fips = pd.DataFrame({'location_id': [1], 'fips_vintage': [2020], 'fips': ['12001000100']})
+    cdm_writeback.write_back(engine, pd.DataFrame(), fips)
+    cdm_writeback.write_back(engine, pd.DataFrame(), fips.assign(fips='12001000200'))
+    assert _mapping(engine)['fips'].tolist() == ['12001000200']
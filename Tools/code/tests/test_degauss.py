@@ -0,0 +1,48 @@
+import subprocess
+import pandas as pd
+import pytest
+import degauss
+
+@pytest.fixture
+def tmpfs_transport(tmp_path, monkeypatch):
+    monkeypatch.setitem(degauss.SETTINGS, 'transport', 'tmpfs')
+    monkeypatch.setitem(degauss.SETTINGS, 'scratch', str(tmp_path / 'scratch'))
+    monkeypatch.setattr(degauss, '_visible_scratch', set())
+    return tmp_path / 'scratch'
+
+def _fake_docker(monkeypatch, scratch_visible):
+    """Replace `docker run` with a container that sees the mounted scratch folder only if `scratch_visible`."""
+    calls = []
+    def run(command, **kwargs):
+        calls.append(command)
+        volume = command[command.index('-v') + 1]
+        host, _ = volume.rsplit(':', 1)
+        if command[command.index('--entrypoint') + 1] == 'cat':
+            path = host + command[-1][len('/scratch'):]
+            if scratch_visible:
+                return subprocess.CompletedProcess(command, 0, open(path).read(), '')
+            return subprocess.CompletedProcess(command, 1, '', f"cat: {command[-1]}: No such file or directory")
+        raise AssertionError(f"unexpected command {command}")
+    monkeypatch.setattr(degauss.subprocess, 'run', run)
+    return calls
+
+def test_visible_scratch_is_checked_once(tmpfs_transport, monkeypatch):
+    calls = _fake_docker(monkeypatch, scratch_visible=True)
+    assert degauss.scratch_root(degauss.GEOCODER_IMAGE) == str(tmpfs_transport)
+    assert degauss.scratch_root(degauss.GEOCODER_IMAGE) == str(tmpfs_transport)
+    assert len(calls) == 1
+    assert degauss.SETTINGS['transport'] == 'tmpfs'
+    assert list(tmpfs_transport.iterdir()) == []
+
+def test_unshared_scratch_falls_back_to_workspace_files(tmpfs_transport, tmp_path, monkeypatch):
+    _fake_docker(monkeypatch, scratch_visible=False)
+    ran_in = []
+    def run_batch(part, batch_dir, retries):
+        ran_in.append(batch_dir)
+        return part
+    output_file = str(tmp_path / 'work' / 'out.csv')
+    degauss.run_batched(pd.DataFrame({'address': ['1 Main St', '2 Oak Ave']}), run_batch, str(tmp_path / 'work'), output_file,
+                        str(tmp_path / 'work' / 'q.csv'), image=degauss.GEOCODER_IMAGE)
+    assert degauss.SETTINGS['transport'] == 'file'
+    assert ran_in and all(path.startswith(str(tmp_path / 'work')) for path in ran_in)
+    assert len(pd.read_csv(output_file)) == 2
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+import exposure_windows
+
+TRACT_A, TRACT_B, TRACT_A_2020 = '12001000100', '12001000200', '12001000300'
+
+def _table():
+    # value = 1 in tract A, 3 in tract B and 5 in A's 2020 tract, plus the year's offset in `trend`
+    rows = [(fips, year, value, year - 2010) for fips, value in [(TRACT_A, 1), (TRACT_B, 3), (TRACT_A_2020, 5)] for year in range(2008, 2026)]
+    return exposure_windows.VariableTable(pd.DataFrame(rows, columns=['fips', 'year', 'value', 'trend']))
+
+def _timeline(periods):
+    history = pd.DataFrame(periods, columns=exposure_windows.HISTORY_COLUMNS)
+    location_fips = pd.DataFrame([(10, 2010, TRACT_A), (10, 2020, TRACT_A_2020), (20, 2010, TRACT_B), (20, 2020, TRACT_B)],
+                                 columns=['location_id', 'fips_vintage', 'fips'])
+    return exposure_windows.ResidenceTimeline(history, location_fips)
+
+def _days(date):
+    return int(np.datetime64(date, 'D').astype(np.int64))
+
+def _exposures(timeline, anchor, windows):
+    anchors = pd.DataFrame({'person_id': [1], 'visit_occurrence_id': [100], 'visit_start_date': [anchor]})
+    return exposure_windows.window_exposures(anchors, timeline, _table(), windows).iloc[0]
+
+def test_segments_are_split_at_january_first_with_the_vintage_fips():
+    timeline = _timeline([(10, 1, '2018-07-01', '2020-03-31')])
+    seg = timeline.segments(np.array([1]), _days('2000-01-01'), _days('2030-01-01'))
+    assert seg['year'].tolist() == [2018, 2019, 2020]
+    assert seg['start'].tolist() == [_days('2018-07-01'), _days('2019-01-01'), _days('2020-01-01')]
+    assert seg['end'].tolist() == [_days('2019-01-01'), _days('2020-01-01'), _days('2020-04-01')]
+    assert seg['fips'].tolist() == [int(TRACT_A), int(TRACT_A), int(TRACT_A_2020)]
+
+def test_window_mean_is_weighted_by_days_in_each_year():
+    timeline = _timeline([(10, 1, '2010-01-01', '2019-12-31')])
+    row = _exposures(timeline, '2019-07-01', [1])
+    # [2018-07-01, 2019-07-01): 184 days of 2018 (trend 8) and 181 days of 2019 (trend 9)
+    assert row['trend_1y'] == pytest.approx((184 * 8 + 181 * 9) / 365)
+    assert row['value_1y'] == pytest.approx(1)
+    assert row['coverage_1y'] == pytest.approx(1)
+
+def test_open_ended_period_and_gaps():
+    timeline = _timeline([(10, 1, '2021-01-01', None)])
+    row = _exposures(timeline, '2024-01-01', [1, 5])
+    assert row['value_1y'] == pytest.approx(5)
+    assert row['coverage_1y'] == pytest.approx(1)
+    # Only 2021-2023 of [2019-01-01, 2024-01-01) has a residence
+    assert row['coverage_5y'] == pytest.approx(1095 / 1826)
+    assert row['value_5y'] == pytest.approx(5)
+
+def test_nested_period_keeps_the_outer_residence_around_it():
+    timeline = _timeline([(10, 1, '2010-01-01', '2020-12-31'), (20, 1, '2015-01-01', '2015-06-30')])
+    seg = timeline.segments(np.array([1]), _days('2014-01-01'), _days('2016-01-01'))
+    assert seg['fips'].tolist() == [int(TRACT_A), int(TRACT_B), int(TRACT_A)]
+    assert seg['start'].tolist() == [_days('2014-01-01'), _days('2015-01-01'), _days('2015-07-01')]
+
+    row = _exposures(timeline, '2016-01-01', [2])
+    # [2014-01-01, 2016-01-01): 365 days in A, 181 in B, then 184 back in A
+    assert row['coverage_2y'] == pytest.approx(1)
+    assert row['value_2y'] == pytest.approx((365 * 1 + 181 * 3 + 184 * 1) / 730)
+
+def test_overlapping_periods_switch_at_the_later_start():
+    timeline = _timeline([(10, 1, '2012-01-01', '2015-06-30'), (20, 1, '2015-01-01', '2017-12-31')])
+    row = _exposures(timeline, '2016-01-01', [2])
+    # A until 2014-12-31, B from 2015-01-01
+    assert row['coverage_2y'] == pytest.approx(1)
+    assert row['value_2y'] == pytest.approx((365 * 1 + 365 * 3) / 730)
+
+def test_unknown_person_and_date_get_no_exposure():
+    timeline = _timeline([(10, 1, '2010-01-01', None)])
+    anchors = pd.DataFrame({'person_id': [2, 1], 'visit_occurrence_id': [100, 101], 'visit_start_date': ['2016-01-01', 'not a date']})
+    result = exposure_windows.window_exposures(anchors, timeline, _table(), [1])
+    assert result['coverage_1y'].tolist()[0] == 0
+    assert result['value_1y'].isna().all()
@@ -0,0 +1,77 @@
+import os
+import pandas as pd
+import pytest
+import address_union
+import backends
+import degauss
+from geocode_store import GeocodeStore
+
+class FailingGeocoder:
+    """Stub geocoder run through degauss.run_batched; rows whose address contains 'Broken' fail."""
+
+    name = 'failing'
+
+    def geocode(self, df, threshold, output_folder, output_file):
+        def run_batch(part, batch_dir, retries):
+            if part['address'].str.contains('Broken').any():
+                raise degauss.ContainerError('geocoder crashed')
+            part_file = os.path.join(batch_dir, 'part.csv')
+            backends.StubGeocoder().geocode(part, threshold, batch_dir, part_file)
+            return pd.read_csv(part_file, dtype=str)
+        quarantine_file = os.path.join(output_folder, f"geocoder{degauss.QUARANTINE_SUFFIX}")
+        return degauss.run_batched(df, run_batch, output_folder, output_file, quarantine_file, batch_rows=10, retries=0)
+
+@pytest.fixture
+def union():
+    addresses = pd.Series(['1 Main St Gainesville Fl 32601', '2 Broken Rd Ocala Fl 34470', '3 Oak Ave Tampa Fl 33601'])
+    return pd.DataFrame({'address': addresses, address_union.KEY_COLUMN: address_union.address_key(addresses)})
+
+def test_quarantined_store_rows_keep_the_union_key(tmp_path, union):
+    store = GeocodeStore(str(tmp_path / 'store'))
+    output_file = str(tmp_path / 'geocoded.csv')
+    _, quarantined = store.geocoder(FailingGeocoder()).geocode(union, 0.5, str(tmp_path), output_file)
+    assert quarantined == 1
+
+    lookup = address_union._read_lookup(output_file, str(tmp_path))
+    assert set(lookup[address_union.KEY_COLUMN]) == set(union[address_union.KEY_COLUMN])
+    broken = lookup[lookup[address_union.KEY_COLUMN] == '2 broken rd ocala fl 34470']
+    assert broken['geocode_result'].isna().all()
+    assert (lookup['geocode_result'] == 'geocoded').sum() == 2
+
+def test_read_lookup_keys_quarantine_without_key_column(tmp_path, union):
+    output_file = str(tmp_path / 'geocoded.csv')
+    backends.StubGeocoder().geocode(union.iloc[[0, 2]], 0.5, str(tmp_path), output_file)
+    union.iloc[[1]][['address']].assign(error='geocoder crashed').to_csv(tmp_path / f"geocoder{degauss.QUARANTINE_SUFFIX}", index=False)
+
+    lookup = address_union._read_lookup(output_file, str(tmp_path))
+    assert len(lookup) == 3
+    assert '2 broken rd ocala fl 34470' in set(lookup[address_union.KEY_COLUMN])
+
+def test_store_reuses_candidates_across_thresholds(tmp_path, union):
+    store = GeocodeStore(str(tmp_path / 'store'))
+    geocoder = store.geocoder(FailingGeocoder())
+    geocoder.geocode(union, 0.5, str(tmp_path), str(tmp_path / 'first.csv'))
+    geocoder.geocode(union.iloc[[0, 2]], 0.9, str(tmp_path), str(tmp_path / 'second.csv'))
+    assert store.geocoded == 2
+    assert GeocodeStore(str(tmp_path / 'store')).counts()[0] == 2
+
+DEMO_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'demo', 'address_files', 'input', 'multi_column_address_data_1.csv')
+
+@pytest.mark.parametrize('keep', [False, True])
+def test_default_store_is_deleted_after_the_run(tmp_path, monkeypatch, keep):
+    import sys
+    import Address_to_FIPS
+    (tmp_path / 'input').mkdir()
+    pd.read_csv(DEMO_FILE).head(5).to_csv(tmp_path / 'input' / 'addresses.csv', index=False)
+    argv = ['Address_to_FIPS.py', '-i', str(tmp_path / 'input'), '--geocoder', 'stub', '--fips-backend', 'stub']
+    if keep:
+        argv += ['--geocode-store', str(tmp_path / 'kept_store')]
+    monkeypatch.setattr(sys, 'argv', argv)
+    monkeypatch.chdir(tmp_path)
+    try:
+        Address_to_FIPS.main()
+    finally:
+        backends.configure()
+    assert any(name.startswith('geocoded_fips_codes_') for name in os.listdir(tmp_path / 'output'))
+    assert not (tmp_path / 'output' / 'geocode_store').exists()
+    assert (tmp_path / 'kept_store' / 'store.sqlite').exists() == keep
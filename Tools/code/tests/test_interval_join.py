@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import interval_join
+
+def _history(rows):
+    return pd.DataFrame(rows, columns=interval_join.HISTORY_COLUMNS)
+
+def _visits(rows):
+    return pd.DataFrame(rows, columns=interval_join.VISIT_COLUMNS)
+
+def test_visit_inside_a_nested_period_matches_the_outer_one():
+    index = interval_join.ResidenceIndex(_history([
+        (10, 1, '2010-01-01', '2020-12-31'),
+        (20, 1, '2015-01-01', '2015-06-30'),
+    ]))
+    joined = interval_join.join_visits(_visits([
+        (100, 1, '2016-01-05', '2016-01-06'),
+        (101, 1, '2015-03-01', '2015-03-02'),
+        (102, 1, '2009-12-31', '2010-01-02'),
+    ]), index)
+    assert list(zip(joined['visit_occurrence_id'], joined['location_id'])) == [(100, 10), (101, 10), (101, 20)]
+
+def test_open_ended_and_unknown_persons():
+    index = interval_join.ResidenceIndex(_history([
+        (10, 1, '2010-01-01', None),
+        (30, 2, '2012-01-01', '2012-12-31'),
+    ]))
+    joined = interval_join.join_visits(_visits([
+        (100, 1, '2024-05-01', '2024-05-03'),
+        (101, 2, '2012-12-30', '2013-01-02'),
+        (102, 3, '2012-06-01', '2012-06-01'),
+    ]), index)
+    assert list(zip(joined['visit_occurrence_id'], joined['location_id'])) == [(100, 10)]
+
+def test_matches_the_sql_between_join():
+    rng = np.random.default_rng(3)
+    base = pd.Timestamp('2010-01-01')
+    periods = []
+    for location_id in range(200):
+        start = base + pd.Timedelta(days=int(rng.integers(0, 3000)))
+        periods.append((location_id, int(rng.integers(1, 15)), start.date().isoformat(),
+                        (start + pd.Timedelta(days=int(rng.integers(0, 1500)))).date().isoformat()))
+    visits = []
+    for visit_id in range(1000):
+        start = base + pd.Timedelta(days=int(rng.integers(0, 4000)))
+        visits.append((visit_id, int(rng.integers(1, 17)), start.date().isoformat(),
+                       (start + pd.Timedelta(days=int(rng.integers(0, 5)))).date().isoformat()))
+    history, visits = _history(periods), _visits(visits)
+
+    joined = interval_join.join_visits(visits, interval_join.ResidenceIndex(history))
+
+    cross = visits.merge(history, left_on='person_id', right_on='entity_id')
+    covered = cross[(cross['visit_start_date'] >= cross['start_date']) & (cross['visit_start_date'] <= cross['end_date'])
+                    & (cross['visit_end_date'] >= cross['start_date']) & (cross['visit_end_date'] <= cross['end_date'])]
+    assert sorted(zip(joined['visit_occurrence_id'], joined['location_id'])) == sorted(zip(covered['visit_occurrence_id'], covered['location_id']))
+    assert joined['visit_occurrence_id'].is_monotonic_increasing
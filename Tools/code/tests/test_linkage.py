@@ -0,0 +1,53 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+import backends
+import linkage
+
+@pytest.fixture
+def stub_backends():
+    backends.configure('stub', None, 'stub')
+    yield
+    backends.configure()
+
+def _addresses():
+    # Vintages alternate, so grouping by vintage would reorder the rows
+    return pd.DataFrame({
+        'id': [1, 2, 3, 4],
+        'Street': ['1 Main St', '2 Oak Ave', '3 Elm St', '4 Pine Rd'],
+        'City': ['Gainesville', 'Tampa', 'Miami', 'Orlando'],
+        'State': ['FL'] * 4,
+        'Zip': ['32601', '33601', '33101', '32801'],
+        'year': [2015, 2021, 2012, 2022],
+    }, index=[40, 30, 20, 10])
+
+def test_link_addresses_keeps_input_rows(stub_backends, tmp_path):
+    df = _addresses()
+    result = linkage.link_addresses(df, work_dir=str(tmp_path))
+    assert result.index.tolist() == [40, 30, 20, 10]
+    assert result.columns.tolist() == df.columns.tolist() + linkage.GEOCODE_COLUMNS + ['FIPS']
+    pd.testing.assert_frame_equal(result[df.columns], df)
+    assert result['FIPS'].str.len().tolist() == [11] * 4
+    assert result['geocode_result'].tolist() == ['Geocoded'] * 4
+
+    # Each row's FIPS is the one it gets when linked on its own
+    for i in range(len(df)):
+        alone = linkage.link_addresses(df.iloc[[i]], work_dir=str(tmp_path))
+        assert alone['FIPS'].iloc[0] == result['FIPS'].iloc[i]
+        assert alone['latitude'].iloc[0] == result['latitude'].iloc[i]
+
+def test_link_coordinates_keeps_input_rows(stub_backends, tmp_path):
+    df = pd.DataFrame({'id': [1, 2, 3, 4], 'latitude': [29.65, 27.95, 25.76, 28.54],
+                       'longitude': [-82.32, -82.46, -80.19, -81.38], 'year': [2015, 2021, 2012, 2022]})
+    result = linkage.link_coordinates(df, work_dir=str(tmp_path))
+    assert result['id'].tolist() == [1, 2, 3, 4]
+    assert result.columns.tolist() == df.columns.tolist() + ['FIPS']
+    for i in range(len(df)):
+        assert linkage.link_coordinates(df.iloc[[i]], work_dir=str(tmp_path))['FIPS'].iloc[0] == result['FIPS'].iloc[i]
+
+def test_geocode_addresses_arrow_round_trip(stub_backends, tmp_path):
+    table = pa.Table.from_pandas(_addresses(), preserve_index=False)
+    result = linkage.geocode_addresses(table, work_dir=str(tmp_path))
+    assert isinstance(result, pa.Table)
+    assert result.column_names == table.column_names + linkage.GEOCODE_COLUMNS
+    assert result.column('id').to_pylist() == [1, 2, 3, 4]
@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+import local_geocoder
+
+@pytest.fixture
+def store(tmp_path):
+    # Two edges of one street in 32601: 1-99 / 2-100 running north, 101-199 / 102-200 further north
+    pd.DataFrame({
+        'FULLNAME': ['NW 1st Avenue', 'NW 1st Avenue', 'Oak Street'],
+        'LFROMHN': ['1', '101', '1'], 'LTOHN': ['99', '199', '49'],
+        'RFROMHN': ['2', '102', '2'], 'RTOHN': ['100', '200', '50'],
+        'ZIPL': ['32601', '32601', '32603'], 'ZIPR': ['32601', '32601', '32603'],
+        'WKT': ['LINESTRING (-82.3 29.60, -82.3 29.61)', 'LINESTRING (-82.3 29.61, -82.3 29.62)',
+                'LINESTRING (-82.40 29.65, -82.38 29.65)'],
+    }).to_csv(tmp_path / 'addrfeat.csv', index=False)
+    pd.DataFrame({'zip': ['32601', '32603'], 'city': ['Gainesville', 'Gainesville'], 'state': ['FL', 'FL']}).to_csv(tmp_path / 'zips.csv', index=False)
+    db = str(tmp_path / 'tiger.sqlite')
+    assert local_geocoder.build_store(str(tmp_path / 'addrfeat.csv'), db, str(tmp_path / 'zips.csv')) == 6
+    return local_geocoder.LocalGeocoder(db)
+
+def test_normalize_street():
+    assert local_geocoder.normalize_street('North Main Street') == 'N MAIN ST'
+
+def test_geocode_interpolates_along_the_range(store):
+    result = store.geocode_frame(pd.Series(['51 Nw 1st Ave Gainesville Fl 32601', '150 NW 1st Avenue Gainesville FL 32601']), 0.5)
+    assert result['geocode_result'].tolist() == ['geocoded', 'geocoded']
+    assert result['precision'].tolist() == ['range', 'range']
+    assert result['score'].tolist() == [1.0, 1.0]
+    assert result['lat'].tolist() == pytest.approx([29.605, 29.615], abs=1e-3)
+    assert result['lon'].tolist() == pytest.approx([-82.3, -82.3])
+    assert result['matched_city'].tolist() == ['Gainesville', 'Gainesville']
+
+def test_geocode_imprecise_matches(store):
+    addresses = pd.Series(['500 Oak St Gainesville Fl 32603', '7 Unknown Rd Gainesville Fl 32603', 'no address'], index=[10, 11, 12])
+    result = store.geocode_frame(addresses, 0.5)
+    assert result.index.tolist() == [10, 11, 12]
+    assert result['precision'].tolist() == ['street', 'zip', None]
+    assert result['score'].tolist() == [0.8, 0.5, 0.0]
+    assert result['geocode_result'].tolist() == ['geocoded', 'imprecise_geocode', 'imprecise_geocode']
+    assert result.loc[[11, 12], 'lat'].isna().all()
+
+def test_threshold_drops_coordinates(store):
+    result = store.geocode_frame(pd.Series(['500 Oak St Gainesville Fl 32603']), 0.9)
+    assert result['geocode_result'].tolist() == ['imprecise_geocode']
+    assert result['lat'].isna().all()
+
+def test_geocode_writes_input_and_results(store, tmp_path):
+    df = pd.DataFrame({'_rid': [1, 2], 'address': ['10 Nw 1st Ave 32601', '20 Oak St 32603']})
+    output_file = str(tmp_path / 'out.csv')
+    assert store.geocode(df, 0.5, str(tmp_path), output_file, batch_rows=1) == (output_file, 0)
+    output = pd.read_csv(output_file)
+    assert output.columns.tolist() == ['_rid', 'address'] + local_geocoder.RESULT_COLUMNS
+    assert output['geocode_result'].tolist() == ['geocoded', 'geocoded']
@@ -0,0 +1,31 @@
+import pandas as pd
+import location_builder
+
+def _fips_file(path, location_ids, city):
+    df = pd.DataFrame({column: '' for column in location_builder.LOCATION_COLUMNS}, index=range(len(location_ids)))
+    df['location_id'] = [str(i) for i in location_ids]
+    df['city'] = city
+    df.assign(person_id=1, FIPS='12001000100').to_csv(path, index=False)
+    return str(path)
+
+def test_multi_pass_merge_matches_single_pass(tmp_path):
+    # 20 files of 30 rows spilled 4 rows at a time: 160 runs, merged 3 at a time
+    files = [_fips_file(tmp_path / f'f{n}_with_fips.csv', [(n * 7 + i * 13) % 250 for i in range(30)], f'city{n}') for n in range(20)]
+    single = tmp_path / 'single' / 'LOCATION.csv'
+    multi = tmp_path / 'multi' / 'LOCATION.csv'
+    single.parent.mkdir()
+    multi.parent.mkdir()
+    written = location_builder.build_location_csv(files, str(single), chunksize=4, run_rows=4, fan_in=1000)
+    assert location_builder.build_location_csv(files, str(multi), chunksize=4, run_rows=4, fan_in=3) == written
+    assert single.read_text() == multi.read_text()
+
+    location = pd.read_csv(multi, dtype=str)
+    assert location['location_id'].astype(int).is_monotonic_increasing
+    assert location['location_id'].is_unique
+    # The first file a location appears in wins
+    first = {}
+    for n in range(20):
+        for i in range(30):
+            first.setdefault(str((n * 7 + i * 13) % 250), f'city{n}')
+    assert dict(zip(location['location_id'], location['city'])) == first
+    assert list((tmp_path / 'multi').iterdir()) == [multi]
@@ -0,0 +1,66 @@
+import glob
+import os
+import pandas as pd
+import pytest
+import OMOP_to_FIPS
+import synthetic_cdm
+from arrow_sink import read_extracted
+from run_ledger import RunLedger
+
+def _extract(engine, run_dir, on_file=None):
+    run = OMOP_to_FIPS.CdmRun(str(run_dir))
+    OMOP_to_FIPS.omop_extraction(None, None, None, None, None, batch_rows=200, on_file=on_file, ledger=RunLedger(str(run_dir)), engine=engine, run=run)
+    return run
+
+def _rows(run, folder):
+    files = sorted(glob.glob(os.path.join(run.linkage_data_dir, folder, '*.csv')), key=lambda p: int(p.rsplit('_', 1)[1][:-4]))
+    return pd.concat([read_extracted(f) for f in files], ignore_index=True)
+
+def test_interrupted_extraction_resumes_after_the_last_key(synthetic_cdm_db, tmp_path):
+    engine = synthetic_cdm.cdm_engine(synthetic_cdm_db)
+    full = _extract(engine, tmp_path / 'full')
+
+    def interrupt(category, path):
+        if category == 'Latlong' and path.endswith('_2.csv'):
+            raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        _extract(engine, tmp_path / 'resumed', on_file=interrupt)
+    assert len(RunLedger(str(tmp_path / 'resumed')).get('extract:Latlong')['batches']) == 2
+    resumed = _extract(engine, tmp_path / 'resumed')
+
+    expected = _rows(full, 'valid_lat_long')
+    assert len(expected) > 400
+    pd.testing.assert_frame_equal(_rows(resumed, 'valid_lat_long'), expected)
+    keys = expected[OMOP_to_FIPS.EXTRACTION_KEY]
+    assert keys.equals(keys.sort_values(OMOP_to_FIPS.EXTRACTION_KEY))
+
+def test_after_key():
+    assert OMOP_to_FIPS._after_key([5, 10, 3]) == \
+        "(p.person_id > 5 OR (p.person_id = 5 AND (p.visit_occurrence_id > 10 OR (p.visit_occurrence_id = 10 AND address.location_id > 3))))"
+
+def test_failed_hand_off_releases_the_site_slot(synthetic_cdm_db, tmp_path, monkeypatch):
+    import threading
+    import backends
+    from scratch import ScratchManager
+
+    class FirstTrackFails(ScratchManager):
+        def track(self, path):
+            if path is not None and path.endswith('Latlong_1.csv') and not getattr(self, 'failed', False):
+                self.failed = True
+                raise OSError('disk went away')
+            return super().track(path)
+
+    monkeypatch.setattr(OMOP_to_FIPS, 'scratch', FirstTrackFails())
+    backends.configure('stub', None, 'stub')
+    run = OMOP_to_FIPS.CdmRun(str(tmp_path / 'run'))
+    jobs = [(run, synthetic_cdm.cdm_engine(synthetic_cdm_db), None)]
+    monkeypatch.chdir(tmp_path)
+    try:
+        # With the slot leaked, the other categories of the site would block on site_workers=1 forever
+        pipeline = threading.Thread(target=OMOP_to_FIPS.run_pipelines, args=(jobs, 'csv', 200, 1, 2, 1), daemon=True)
+        pipeline.start()
+        pipeline.join(120)
+    finally:
+        backends.configure()
+    assert not pipeline.is_alive()
+    assert glob.glob(os.path.join(run.linkage_result_dir, 'address', '*.zip'))
@@ -0,0 +1,136 @@
+import io
+import json
+import threading
+import http.client
+import pandas as pd
+import pyarrow as pa
+import pytest
+import backends
+import linkage
+import service
+
+@pytest.fixture
+def stub_backends():
+    backends.configure('stub', None, 'stub')
+    yield
+    backends.configure()
+
+@pytest.fixture
+def http_service(stub_backends, tmp_path):
+    linkage_service = service.LinkageService(str(tmp_path), max_concurrent=2, window=0.3)
+    httpd = service.LinkageServer(('127.0.0.1', 0), service.make_handler(linkage_service))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address, linkage_service
+    httpd.shutdown()
+    httpd.server_close()
+
+def _request(address, method, path, body=None, content_type='application/json'):
+    conn = http.client.HTTPConnection(*address, timeout=30)
+    conn.request(method, path, body=body, headers={'Content-Type': content_type})
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    return response.status, response.getheader('Content-Type'), data
+
+def _submit_together(submit, requests):
+    results = [None] * len(requests)
+    def run(i):
+        results[i] = submit(*requests[i])
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_coalescer_merges_requests_in_one_window():
+    calls = []
+    def fn(df, name):
+        calls.append(len(df))
+        return df.assign(doubled=df['value'] * 2)
+    coalescer = service.Coalescer(fn, threading.BoundedSemaphore(1), window=0.2)
+    requests = [(('double',), pd.DataFrame({'value': [i, i + 10, i + 20]})) for i in range(4)]
+    results = _submit_together(coalescer.submit, requests)
+
+    assert calls == [12]
+    for (_, df), result in zip(requests, results):
+        assert result.columns.tolist() == ['value', 'doubled']
+        assert result['value'].tolist() == df['value'].tolist()
+        assert result['doubled'].tolist() == (df['value'] * 2).tolist()
+
+def test_coalescer_keeps_incompatible_requests_apart():
+    calls = []
+    def fn(df, name):
+        calls.append(name)
+        return df
+    coalescer = service.Coalescer(fn, threading.BoundedSemaphore(2), window=0.2)
+    _submit_together(coalescer.submit, [(('a',), pd.DataFrame({'value': [1]})), (('b',), pd.DataFrame({'value': [2]}))])
+    assert sorted(calls) == ['a', 'b']
+
+def test_coalescer_fails_every_caller():
+    def fn(df, name):
+        raise ValueError('bad rows')
+    coalescer = service.Coalescer(fn, threading.BoundedSemaphore(1), window=0.2)
+    errors = []
+    def submit(key, df):
+        try:
+            coalescer.submit(key, df)
+        except ValueError as e:
+            errors.append(str(e))
+    _submit_together(submit, [(('a',), pd.DataFrame({'value': [1]}))] * 3)
+    assert errors == ['bad rows'] * 3
+
+def test_coalescer_busy():
+    slots = threading.BoundedSemaphore(1)
+    slots.acquire()
+    coalescer = service.Coalescer(lambda df, name: df, slots, window=0, queue_timeout=0.1)
+    with pytest.raises(service.ServiceBusy):
+        coalescer.submit(('a',), pd.DataFrame({'value': [1]}))
+
+def test_service_link_matches_library(stub_backends, tmp_path):
+    linkage_service = service.LinkageService(str(tmp_path))
+    df = pd.DataFrame({'address': ['1248 N Blackstone Ave Fresno CA 93703', '3 Oak Ave Tampa Fl 33601'], 'year': [2015, 2021]})
+    result = linkage_service.handle('/link', df)
+    assert result['FIPS'].str.len().tolist() == [11, 11]
+    assert result['geocode_result'].tolist() == ['Geocoded', 'Geocoded']
+
+def test_http_health_and_errors(http_service):
+    address, _ = http_service
+    status, _, body = _request(address, 'GET', '/health')
+    assert status == 200
+    assert json.loads(body) == {'status': 'ok', 'geocoder': 'stub', 'fips': 'stub'}
+    assert _request(address, 'GET', '/nowhere')[0] == 404
+    assert _request(address, 'POST', '/nowhere', b'[]')[0] == 404
+    assert _request(address, 'POST', '/link', b'[]')[0] == 400
+    assert _request(address, 'POST', '/link', b'not json')[0] == 400
+
+def test_http_json_requests_are_coalesced(http_service):
+    address, linkage_service = http_service
+    rows = [[{'address': f'{n} Main St Gainesville Fl 32601', 'year': 2015}] for n in range(1, 6)]
+    expected = linkage.link_addresses(pd.DataFrame([r[0] for r in rows]), work_dir=linkage_service.work_dir)['FIPS'].tolist()
+    calls = []
+    call = linkage_service.coalescer.fn
+    linkage_service.coalescer.fn = lambda df, *key: calls.append(len(df)) or call(df, *key)
+    responses = _submit_together(lambda body: _request(address, 'POST', '/link', json.dumps(body).encode()), [(r,) for r in rows])
+    for fips, (status, content_type, body) in zip(expected, responses):
+        assert status == 200
+        assert content_type == 'application/json'
+        result = json.loads(body)['rows']
+        assert len(result) == 1
+        assert result[0]['year'] == 2015
+        assert result[0]['FIPS'] == fips
+    assert sum(calls) == len(rows) and len(calls) < len(rows)
+
+def test_http_arrow_request(http_service):
+    address, _ = http_service
+    table = pa.Table.from_pandas(pd.DataFrame({'latitude': [29.65, 27.95], 'longitude': [-82.32, -82.46], 'year': [2015, 2021]}), preserve_index=False)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    status, content_type, body = _request(address, 'POST', '/fips', sink.getvalue(), service.ARROW_TYPE)
+    assert status == 200
+    assert content_type == service.ARROW_TYPE
+    result = pa.ipc.open_stream(body).read_all().to_pandas()
+    assert result['latitude'].tolist() == [29.65, 27.95]
+    assert result['FIPS'].notna().all()
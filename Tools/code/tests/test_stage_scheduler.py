@@ -0,0 +1,85 @@
+import threading
+import time
+from stage_scheduler import StageScheduler
+
+def test_failed_or_empty_stages_skip_their_dependents():
+    scheduler = StageScheduler({'cpu': 2})
+    def fail():
+        raise ValueError('bad file')
+    failed = scheduler.add('a:read', fail)
+    after_failed = scheduler.add('a:geocode', lambda x: x, 'geocoder', deps=[failed])
+    scheduler.add('a:combine', lambda x: x, deps=[after_failed])
+    empty = scheduler.add('b:read', lambda: None)
+    scheduler.add('b:geocode', lambda x: 'never', 'geocoder', deps=[empty])
+    ok = scheduler.add('c:read', lambda: 'rows')
+    scheduler.add('c:geocode', lambda x: x + ' geocoded', 'geocoder', deps=[ok])
+
+    results = scheduler.run()
+    states = {task.name: task.state for task in scheduler.tasks}
+    assert states == {'a:read': 'failed', 'a:geocode': 'skipped', 'a:combine': 'skipped',
+                      'b:read': 'done', 'b:geocode': 'skipped', 'c:read': 'done', 'c:geocode': 'done'}
+    assert isinstance(failed.error, ValueError)
+    assert results['c:geocode'] == 'rows geocoded'
+    assert results['a:combine'] is None and results['b:geocode'] is None
+
+def test_each_resource_has_its_own_limit():
+    scheduler = StageScheduler({'geocoder': 1, 'census': 2, 'cpu': 3})
+    lock = threading.Lock()
+    active = {'geocoder': 0, 'census': 0, 'cpu': 0}
+    peak = dict(active)
+    def work(resource):
+        def fn():
+            with lock:
+                active[resource] += 1
+                peak[resource] = max(peak[resource], active[resource])
+            time.sleep(0.05)
+            with lock:
+                active[resource] -= 1
+            return resource
+        return fn
+    for resource in active:
+        for n in range(5):
+            scheduler.add(f'{resource}{n}', work(resource), resource)
+    scheduler.run()
+    assert peak == {'geocoder': 1, 'census': 2, 'cpu': 3}
+
+def test_ready_tasks_start_largest_first():
+    scheduler = StageScheduler({'cpu': 1})
+    order = []
+    for name, size in [('small', 1), ('large', 50), ('medium', 10), ('also_medium', 10)]:
+        scheduler.add(name, lambda name=name: order.append(name) or name, size=size)
+    scheduler.run()
+    assert order == ['large', 'medium', 'also_medium', 'small']
+
+def test_running_tasks_can_add_stages():
+    scheduler = StageScheduler()
+    def read():
+        for year in (2010, 2020):
+            scheduler.add(f'fips{year}', lambda rows, year=year: f'{rows}@{year}', 'census', deps=[first])
+        return 'rows'
+    first = scheduler.add('read', read)
+    assert scheduler.run() == {'read': 'rows', 'fips2010': 'rows@2010', 'fips2020': 'rows@2020'}
+
+class OneAtATimeGate:
+    """Admits new work only when nothing else is running."""
+
+    def __init__(self):
+        self.events = []
+
+    def admit(self, task, force):
+        if force:
+            self.events.append(('admit', task.name))
+        return force
+
+    def finish(self, task):
+        self.events.append(('finish', task.name))
+
+def test_gate_admits_roots_and_hears_when_their_chain_ends():
+    gate = OneAtATimeGate()
+    scheduler = StageScheduler({'cpu': 4}, gate=gate)
+    for name, size in [('a', 1), ('b', 2)]:
+        read = scheduler.add(f'{name}:read', lambda: 'rows', size=size)
+        scheduler.add(f'{name}:combine', lambda rows: rows, deps=[read], size=size)
+    scheduler.run()
+    # b is larger, so it goes first; a is only admitted once b's whole chain is over
+    assert gate.events == [('admit', 'b:read'), ('finish', 'b:read'), ('admit', 'a:read'), ('finish', 'a:read')]
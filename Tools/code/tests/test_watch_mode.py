@@ -0,0 +1,48 @@
+import os
+import shutil
+import pandas as pd
+import pytest
+import backends
+import watch_mode
+import Address_to_FIPS
+
+DEMO_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'demo', 'address_files', 'input', 'multi_column_address_data_1.csv')
+
+@pytest.fixture
+def stub_backends():
+    backends.configure('stub', None, 'stub')
+    yield
+    backends.configure()
+
+def test_inbox_waits_for_files_to_stop_changing(tmp_path):
+    inbox = watch_mode.Inbox(str(tmp_path))
+    (tmp_path / 'a.csv').write_text('street\n')
+    (tmp_path / 'notes.txt').write_text('not an input')
+    assert inbox.ready() == []
+    (tmp_path / 'a.csv').write_text('street\n1 Main St\n')
+    assert inbox.ready() == []
+    assert inbox.ready() == ['a.csv']
+
+def test_same_name_drops_keep_both_results(stub_backends, tmp_path, monkeypatch):
+    inbox, outbox = tmp_path / 'inbox', tmp_path / 'outbox'
+    inbox.mkdir()
+    monkeypatch.chdir(tmp_path)
+    published = []
+    for rows in (3, 5):
+        pd.read_csv(DEMO_FILE).head(rows).to_csv(inbox / 'drop.csv', index=False)
+        published.append(Address_to_FIPS.process_inbox_file('drop.csv', str(inbox), str(outbox)))
+
+    assert all(published) and not set(published[0]) & set(published[1])
+    fips = [next(path for path in files if path.endswith('_drop_with_fips.csv')) for files in published]
+    assert [len(pd.read_csv(path)) for path in fips] == [3, 5]
+    assert sorted(os.listdir(outbox)) == sorted(os.path.basename(path) for files in published for path in files)
+    assert len(os.listdir(inbox / watch_mode.PROCESSED_FOLDER)) == 2
+    assert not (inbox / 'drop.csv').exists()
+
+def test_recover_requeues_interrupted_inputs(tmp_path):
+    work_dir = tmp_path / watch_mode.WORK_FOLDER / '20240101_000000_000000'
+    work_dir.mkdir(parents=True)
+    shutil.copy(DEMO_FILE, work_dir / 'drop.csv')
+    watch_mode.recover(str(tmp_path))
+    assert (tmp_path / 'drop.csv').exists()
+    assert not work_dir.exists()
@@ -0,0 +1,110 @@
+import os
+import time
+import shutil
+from loguru import logger
+from run_ledger import part_path, commit_part
+import ingest
+
+# -------------------------------------------------------------------
+# Watch mode: process files as they arrive in an inbox directory.
+# The inbox is polled; a file is picked up once its size and modification
+# time have not changed between two polls, so files still being copied in are
+# left alone. The process stays up between files, so imports, the geocoder
+# backend and its caches stay warm. Results are published to the outbox with
+# an atomic rename and the input is archived under inbox/processed or
+# inbox/failed; both are prefixed with the arrival's timestamp.
+# -------------------------------------------------------------------
+
+WORK_FOLDER = '.work'
+PROCESSED_FOLDER = 'processed'
+FAILED_FOLDER = 'failed'
+
+class Inbox:
+    """Input files of a directory that have stopped changing since the previous poll."""
+
+    def __init__(self, path):
+        self.path = path
+        self._seen = {}
+
+    def ready(self):
+        """
+        Poll the directory.
+
+        Returns:
+        list of str: File names whose size and mtime are unchanged since the previous poll
+        """
+        current = {}
+        for name in sorted(os.listdir(self.path)):
+            path = os.path.join(self.path, name)
+            if not ingest.is_input_file(name) or not os.path.isfile(path):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # removed since listing
+            current[name] = (stat.st_size, stat.st_mtime_ns)
+        ready = [name for name, state in current.items() if self._seen.get(name) == state]
+        self._seen = {name: state for name, state in current.items() if name not in ready}
+        return ready
+
+def publish(path, outbox, stamp):
+    """
+    Copy `path` into `outbox` through a temporary file, so readers never see a partial file.
+    The name is prefixed with `stamp`, so results of repeated input names do not overwrite each other.
+    """
+    os.makedirs(outbox, exist_ok=True)
+    target = os.path.join(outbox, f"{stamp}_{os.path.basename(path)}")
+    shutil.copy(path, part_path(target))
+    commit_part(target)
+    logger.info(f"Published {target}")
+    return target
+
+def archive(path, inbox, folder, stamp):
+    """Move a processed input file to inbox/<folder>, prefixed with `stamp` so repeated names do not clash."""
+    destination = os.path.join(inbox, folder)
+    os.makedirs(destination, exist_ok=True)
+    target = os.path.join(destination, f"{stamp}_{os.path.basename(path)}")
+    shutil.move(path, target)
+    return target
+
+def recover(inbox):
+    """Move inputs left in work folders by an interrupted run back into the inbox."""
+    work_root = os.path.join(inbox, WORK_FOLDER)
+    if not os.path.isdir(work_root):
+        return
+    for stamp in sorted(os.listdir(work_root)):
+        work_dir = os.path.join(work_root, stamp)
+        for name in os.listdir(work_dir):
+            path = os.path.join(work_dir, name)
+            if ingest.is_input_file(name) and os.path.isfile(path) and not os.path.exists(os.path.join(inbox, name)):
+                shutil.move(path, os.path.join(inbox, name))
+                logger.info(f"Re-queued {name} from an interrupted run")
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def watch(inbox, process_file, poll_interval=5, max_polls=None):
+    """
+    Call `process_file(name)` for every file that arrives in `inbox`, until interrupted.
+
+    Parameters:
+    inbox (str): Directory to watch
+    process_file (callable): process_file(file name) -> anything; exceptions are logged and watching continues
+    poll_interval (float): Seconds between polls
+    max_polls (int, optional): Stop after this many polls (runs forever when omitted)
+    """
+    recover(inbox)
+    logger.info(f"Watching {inbox} every {poll_interval}s (Ctrl+C to stop)")
+    watcher = Inbox(inbox)
+    polls = 0
+    try:
+        while max_polls is None or polls < max_polls:
+            for name in watcher.ready():
+                started = time.time()
+                try:
+                    process_file(name)
+                except Exception as e:
+                    logger.error(f"Error processing {name}: {e}")
+                logger.info(f"{name} done in {time.time() - started:.1f}s")
+            polls += 1
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        logger.info("Watch mode stopped.")